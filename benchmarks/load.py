@@ -0,0 +1,238 @@
+"""Load benchmark for FakeSMTPd.
+
+Starts a FakeSMTPd server process for each selected variant, sends mail
+over several concurrent connections and reports the message throughput.
+The "-unix" variants connect over a Unix domain socket instead of TCP.
+The "-starttls" variants negotiate TLS with STARTTLS before sending mail,
+using a self-signed certificate created with the openssl command.
+
+Usage: python benchmarks/load.py [--connections N] [--messages N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Awaitable, Callable, Sequence
+from functools import partial
+
+MESSAGE = (
+    b"From: sender@example.com\r\n"
+    b"To: receiver@example.com\r\n"
+    b"Subject: Load test\r\n"
+    b"\r\n" + b"Lorem ipsum dolor sit amet.\r\n" * 20 + b".\r\n"
+)
+
+VARIANTS: dict[str, list[str]] = {
+    "streams": ["--transport", "streams"],
+    "protocol": ["--transport", "protocol"],
+    "streams-uvloop": ["--transport", "streams", "--loop", "uvloop"],
+    "protocol-uvloop": ["--transport", "protocol", "--loop", "uvloop"],
+    "streams-unix": ["--transport", "streams"],
+    "protocol-unix": ["--transport", "protocol"],
+    "streams-starttls": ["--transport", "streams"],
+    "protocol-starttls": ["--transport", "protocol"],
+}
+
+_Connection = tuple[asyncio.StreamReader, asyncio.StreamWriter]
+_Connect = Callable[[], Awaitable[_Connection]]
+_StartTLS = Callable[[asyncio.StreamWriter], Awaitable[None]]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", "-c", type=int, default=50)
+    parser.add_argument("--messages", "-m", type=int, default=200)
+    parser.add_argument(
+        "variants",
+        nargs="*",
+        default=["streams", "protocol"],
+        help=f"server variants to compare: {', '.join(VARIANTS)}",
+    )
+    args = parser.parse_args()
+    for name in args.variants:
+        if name not in VARIANTS:
+            parser.error(f"unknown variant: {name}")
+    print(f"{'variant':<18} {'messages':>9} {'seconds':>8} {'msg/s':>9}")
+    for name in args.variants:
+        total = args.connections * args.messages
+        elapsed = run_variant(
+            VARIANTS[name],
+            args.connections,
+            args.messages,
+            unix=name.endswith("-unix"),
+            starttls=name.endswith("-starttls"),
+        )
+        print(f"{name:<18} {total:>9} {elapsed:>8.2f} {total / elapsed:>9.0f}")
+
+
+def run_variant(
+    server_args: Sequence[str],
+    connections: int,
+    messages: int,
+    *,
+    unix: bool = False,
+    starttls: bool = False,
+) -> float:
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "smtp.sock")
+        listen = ["--listen", f"127.0.0.1:{port}"]
+        if unix:
+            listen += ["--listen", f"unix:{path}"]
+        start_tls: _StartTLS | None = None
+        if starttls:
+            cert_file = _create_certificate(tmp_dir)
+            listen += ["--tls-cert", cert_file]
+            context = ssl.create_default_context(cafile=cert_file)
+            start_tls = partial(
+                _start_tls, context=context, server_hostname="localhost"
+            )
+        command = [
+            sys.executable,
+            "-c",
+            "from fakesmtpd.server import main; main()",
+            *listen,
+            "--output-filename",
+            "/dev/null",
+            *server_args,
+        ]
+        server = subprocess.Popen(command, stderr=subprocess.DEVNULL)
+        try:
+            _wait_for_port(port)
+            connect: _Connect
+            if unix:
+                connect = partial(asyncio.open_unix_connection, path)
+            else:
+                connect = partial(asyncio.open_connection, "127.0.0.1", port)
+            return asyncio.run(
+                _run_clients(connect, connections, messages, start_tls)
+            )
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def _create_certificate(directory: str) -> str:
+    cert_file = os.path.join(directory, "localhost.pem")
+    key_file = os.path.join(directory, "localhost.key")
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "ec",
+            "-pkeyopt",
+            "ec_paramgen_curve:prime256v1",
+            "-nodes",
+            "-subj",
+            "/CN=localhost",
+            "-addext",
+            "subjectAltName=DNS:localhost",
+            "-keyout",
+            key_file,
+            "-out",
+            cert_file,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    with open(cert_file, "a") as cert, open(key_file) as key:
+        cert.write(key.read())
+    return cert_file
+
+
+async def _start_tls(
+    writer: asyncio.StreamWriter,
+    *,
+    context: ssl.SSLContext,
+    server_hostname: str,
+) -> None:
+    await writer.start_tls(context, server_hostname=server_hostname)
+
+
+async def _run_clients(
+    connect: _Connect,
+    connections: int,
+    messages: int,
+    start_tls: _StartTLS | None = None,
+) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            _send_mails(connect, messages, start_tls)
+            for _ in range(connections)
+        )
+    )
+    return time.perf_counter() - start
+
+
+async def _send_mails(
+    connect: _Connect, count: int, start_tls: _StartTLS | None
+) -> None:
+    reader, writer = await connect()
+    await _expect(reader, b"220")
+    writer.write(b"EHLO client.example.com\r\n")
+    await _expect(reader, b"250")
+    if start_tls is not None:
+        writer.write(b"STARTTLS\r\n")
+        await _expect(reader, b"220")
+        await start_tls(writer)
+        writer.write(b"EHLO client.example.com\r\n")
+        await _expect(reader, b"250")
+    for _ in range(count):
+        writer.write(
+            b"MAIL FROM:<sender@example.com>\r\n"
+            b"RCPT TO:<receiver@example.com>\r\n"
+            b"DATA\r\n"
+        )
+        await _expect(reader, b"250")
+        await _expect(reader, b"250")
+        await _expect(reader, b"354")
+        writer.write(MESSAGE)
+        await _expect(reader, b"250")
+    writer.write(b"QUIT\r\n")
+    await _expect(reader, b"221")
+    writer.close()
+    await writer.wait_closed()
+
+
+async def _expect(reader: asyncio.StreamReader, code: bytes) -> None:
+    while True:
+        line = await reader.readuntil(b"\r\n")
+        if not line.startswith(code):
+            raise RuntimeError(f"unexpected reply: {line!r}")
+        if line[3:4] != b"-":
+            return
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port: int = sock.getsockname()[1]
+        return port
+
+
+def _wait_for_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.02)
+        else:
+            return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Per-connection memory benchmark for FakeSMTPd.
+
+Measures the memory allocated per State object with tracemalloc, then
+starts a FakeSMTPd server process for each selected transport, opens
+many idle connections (after EHLO and one message each), and reports
+the growth of the server's resident set size per connection. The RSS
+is read from /proc, so the second part only works on Linux.
+
+Usage: python benchmarks/memory.py [--connections N] [TRANSPORT ...]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import resource
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections.abc import Sequence
+
+from fakesmtpd.state import State
+
+TRANSPORTS = ("streams", "protocol")
+
+MESSAGE = (
+    b"MAIL FROM:<sender@example.com>\r\n"
+    b"RCPT TO:<receiver@example.com>\r\n"
+    b"DATA\r\n"
+    b"Subject: Memory test\r\n"
+    b"\r\n"
+    b"Lorem ipsum dolor sit amet.\r\n"
+    b".\r\n"
+)
+
+_Connection = tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", "-c", type=int, default=2000)
+    parser.add_argument(
+        "transports",
+        nargs="*",
+        default=list(TRANSPORTS),
+        help=f"server transports to measure: {', '.join(TRANSPORTS)}",
+    )
+    args = parser.parse_args()
+    for name in args.transports:
+        if name not in TRANSPORTS:
+            parser.error(f"unknown transport: {name}")
+    _raise_file_limit(args.connections * 2 + 100)
+
+    print(f"State object:     {_measure_state():>8.0f} bytes")
+    print(f"{'transport':<10} {'connections':>11} {'bytes/connection':>17}")
+    for name in args.transports:
+        per_connection = measure_server(name, args.connections)
+        print(f"{name:<10} {args.connections:>11} {per_connection:>17.0f}")
+
+
+def _measure_state(count: int = 10_000) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    states = [State() for _ in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # Don't count the list holding the states.
+    return (after - before - sys.getsizeof(states)) / count
+
+
+def _raise_file_limit(limit: int) -> None:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < limit:
+        new = limit if hard == resource.RLIM_INFINITY else min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (new, hard))
+
+
+def measure_server(transport: str, connections: int) -> float:
+    """Return the RSS growth of a server process per open connection."""
+    port = _free_port()
+    command = [
+        sys.executable,
+        "-c",
+        "from fakesmtpd.server import main; main()",
+        "--listen",
+        f"127.0.0.1:{port}",
+        "--transport",
+        transport,
+        "--output-filename",
+        "/dev/null",
+        "--log-level",
+        "WARNING",
+    ]
+    server = subprocess.Popen(command, stderr=subprocess.DEVNULL)
+    try:
+        _wait_for_port(port)
+        return asyncio.run(_measure_connections(server.pid, port, connections))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def _measure_connections(pid: int, port: int, count: int) -> float:
+    # Warm up, so that one-time allocations are not counted.
+    await _close(await asyncio.gather(*(_connect(port) for _ in range(10))))
+    await asyncio.sleep(0.2)
+    before = _rss(pid)
+    connections: list[_Connection] = []
+    for start in range(0, count, 100):
+        batch = min(100, count - start)
+        connections += await asyncio.gather(
+            *(_connect(port) for _ in range(batch))
+        )
+    await asyncio.sleep(0.2)
+    after = _rss(pid)
+    await _close(connections)
+    return (after - before) / count
+
+
+async def _connect(port: int) -> _Connection:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    await _expect(reader, b"220")
+    writer.write(b"EHLO client.example.com\r\n")
+    await _expect(reader, b"250")
+    writer.write(MESSAGE)
+    for code in (b"250", b"250", b"354", b"250"):
+        await _expect(reader, code)
+    return reader, writer
+
+
+async def _close(connections: Sequence[_Connection]) -> None:
+    for _, writer in connections:
+        writer.close()
+    await asyncio.gather(
+        *(writer.wait_closed() for _, writer in connections),
+        return_exceptions=True,
+    )
+
+
+async def _expect(reader: asyncio.StreamReader, code: bytes) -> None:
+    while True:
+        line = await reader.readuntil(b"\r\n")
+        if not line.startswith(code):
+            raise RuntimeError(f"unexpected reply: {line!r}")
+        if line[3:4] != b"-":
+            return
+
+
+def _rss(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError("VmRSS not found")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port: int = sock.getsockname()[1]
+        return port
+
+
+def _wait_for_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.02)
+        else:
+            return
+
+
+if __name__ == "__main__":
+    main()
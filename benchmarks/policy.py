@@ -0,0 +1,122 @@
+"""Recipient policy benchmark for FakeSMTPd.
+
+Builds recipient policies of increasing size, with addresses, domains,
+and subdomain wildcards, and measures the time to load each policy from
+a file and the average time of a lookup. Lookups are a mix of accepted
+addresses, accepted domains and subdomains, and rejected recipients.
+Exits with status 1 if lookups in the largest table are more than
+--max-ratio times slower than in the smallest one.
+
+Usage: python benchmarks/policy.py [--lookups N] [--max-ratio R] [SIZE ...]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections.abc import Sequence
+
+from fakesmtpd.policy import RecipientPolicy, load_recipient_policy
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lookups", "-n", type=int, default=100_000)
+    parser.add_argument(
+        "--max-ratio",
+        type=float,
+        default=2.0,
+        help="maximum slowdown of lookups in the largest table",
+    )
+    parser.add_argument(
+        "sizes",
+        nargs="*",
+        type=int,
+        default=list(DEFAULT_SIZES),
+        help="numbers of rules, default: "
+        + " ".join(str(s) for s in DEFAULT_SIZES),
+    )
+    args = parser.parse_args()
+    sizes = sorted(args.sizes)
+
+    print(f"{'rules':>10} {'load s':>8} {'ns/lookup':>10} {'accepted':>9}")
+    timings = []
+    for size in sizes:
+        rules = make_rules(size)
+        load_time, policy = _measure_load(rules)
+        addresses = make_lookups(size, args.lookups)
+        per_lookup, accepted = _measure_lookups(policy, addresses)
+        timings.append(per_lookup)
+        print(
+            f"{size:>10} {load_time:>8.2f} {per_lookup * 1e9:>10.0f} "
+            f"{accepted / len(addresses):>9.0%}"
+        )
+
+    ratio = timings[-1] / timings[0]
+    print(f"slowdown from {sizes[0]} to {sizes[-1]} rules: {ratio:.2f}x")
+    sys.exit(1 if ratio > args.max_ratio else 0)
+
+
+def make_rules(size: int) -> list[str]:
+    """Return size rules: 89% addresses, 10% domains, 1% wildcards."""
+    domains = max(1, size // 10)
+    wildcards = max(1, size // 100)
+    rules = [f"*.w{i}.example" for i in range(wildcards)]
+    rules += [f"d{i}.example" for i in range(domains)]
+    rules += [
+        f"user{i}@a{i % domains}.example"
+        for i in range(size - domains - wildcards)
+    ]
+    rules.append("!blocked@d0.example")
+    return rules
+
+
+def make_lookups(size: int, count: int) -> list[str]:
+    """Return addresses that hit the different kinds of rules."""
+    rng = random.Random(size)
+    domains = max(1, size // 10)
+    wildcards = max(1, size // 100)
+    users = max(1, size - domains - wildcards)
+    kinds = [
+        lambda i: f"user{i % users}@a{i % users % domains}.example",
+        lambda i: f"someone@d{i % domains}.example",
+        lambda i: f"someone@mx.w{i % wildcards}.example",
+        lambda i: f"nobody{i}@unknown{i}.example",
+    ]
+    return [rng.choice(kinds)(rng.randrange(size)) for _ in range(count)]
+
+
+def _measure_load(rules: Sequence[str]) -> tuple[float, RecipientPolicy]:
+    fd, filename = tempfile.mkstemp(suffix=".txt")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write("\n".join(rules))
+        start = time.perf_counter()
+        policy = load_recipient_policy(filename)
+        return time.perf_counter() - start, policy
+    finally:
+        os.unlink(filename)
+
+
+def _measure_lookups(
+    policy: RecipientPolicy, addresses: Sequence[str], runs: int = 5
+) -> tuple[float, int]:
+    """Return the best time per lookup and the number of accepted."""
+    accepts = policy.accepts
+    best = float("inf")
+    accepted = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        accepted = sum(accepts(a) for a in addresses)
+        best = min(best, time.perf_counter() - start)
+    return best / len(addresses), accepted
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Start-up time benchmark for FakeSMTPd.
+
+Measures the import time of fakesmtpd.server (using python -X importtime)
+and the time from starting a server process until it accepts the first
+connection and sends its greeting. Each time is the best of --runs
+runs, which is the least affected by other load on the machine. Exits
+with status 1 if the time to first connection or the import time
+exceeds its budget.
+
+Usage: python benchmarks/startup.py [--runs N] [--budget-ms MS]
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import socket
+import subprocess
+import sys
+import time
+from collections.abc import Callable
+
+SERVER_MODULE = "fakesmtpd.server"
+POLL_INTERVAL = 0.001
+
+# Measured best times are 105-130 ms for the import and 135-180 ms to the
+# first connection. The budgets leave room for noise, but not for an
+# eager import of a module like smtplib, which adds about 23 ms.
+DEFAULT_IMPORT_BUDGET_MS = 140.0
+DEFAULT_BUDGET_MS = 190.0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", "-n", type=int, default=10)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=DEFAULT_BUDGET_MS,
+        help="budget for the time to first accepted connection",
+    )
+    parser.add_argument(
+        "--import-budget-ms",
+        type=float,
+        default=DEFAULT_IMPORT_BUDGET_MS,
+        help=f"budget for the cumulative import time of {SERVER_MODULE}",
+    )
+    args = parser.parse_args()
+
+    interpreter = _best(_measure_interpreter, args.runs)
+    imports = _best(_measure_import_time, args.runs)
+    first_connection = _best(_measure_first_connection, args.runs)
+    print(f"interpreter start-up:        {interpreter:8.1f} ms")
+    print(f"import {SERVER_MODULE}:      {imports:8.1f} ms")
+    print(f"time to first connection:    {first_connection:8.1f} ms")
+
+    failed = False
+    if imports > args.import_budget_ms:
+        print(f"import time exceeds budget of {args.import_budget_ms} ms")
+        failed = True
+    if first_connection > args.budget_ms:
+        print(f"time to first connection exceeds {args.budget_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+def _best(measure: Callable[[], float], runs: int) -> float:
+    return min(measure() for _ in range(runs))
+
+
+def _measure_interpreter() -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return (time.perf_counter() - started) * 1000
+
+
+def _measure_import_time() -> float:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {SERVER_MODULE}"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    for line in result.stderr.splitlines():
+        m = re.match(r"import time:\s*\d+ \|\s*(\d+) \|\s*(\S+)$", line)
+        if m and m.group(2) == SERVER_MODULE:
+            return int(m.group(1)) / 1000
+    raise RuntimeError(f"no import time found for {SERVER_MODULE}")
+
+
+def _measure_first_connection() -> float:
+    port = _free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "from fakesmtpd.server import main; main()",
+            "--port",
+            str(port),
+            "--output-filename",
+            "/dev/null",
+        ],
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            try:
+                sock = socket.create_connection(("127.0.0.1", port))
+            except ConnectionRefusedError:
+                if server.poll() is not None:
+                    raise RuntimeError("server exited") from None
+                time.sleep(POLL_INTERVAL)
+                continue
+            with sock:
+                greeting = sock.recv(1024)
+            if not greeting.startswith(b"220"):
+                raise RuntimeError(f"unexpected greeting: {greeting!r}")
+            return (time.perf_counter() - started) * 1000
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port: int = sock.getsockname()[1]
+        return port
+
+
+if __name__ == "__main__":
+    main()
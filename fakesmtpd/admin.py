@@ -0,0 +1,152 @@
+"""Minimal HTTP/1.1 server for administrative requests.
+
+All responses are JSON documents. Each connection handles a single
+request.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import inspect
+import json
+import logging
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from http import HTTPStatus
+from typing import Any, Union
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_SIZE = 16 * 1024
+MAX_BODY_SIZE = 1024 * 1024
+REQUEST_TIMEOUT = 10.0
+
+AdminResponse = tuple[HTTPStatus, Any]
+RouteHandler = Callable[
+    [dict[str, str]], Union[AdminResponse, Awaitable[AdminResponse]]
+]
+
+
+class BadRequest(Exception):
+    pass
+
+
+class AdminServer:
+    """HTTP server that dispatches requests to route handlers.
+
+    Route handlers receive the query parameters and return (or resolve
+    to) the response status and a JSON-serializable body. ValueError
+    raised by a handler results in a 400 response, RuntimeError in a 409
+    response.
+    """
+
+    def __init__(self) -> None:
+        self._routes: dict[tuple[str, str], RouteHandler] = {}
+
+    def add_route(self, method: str, path: str, handler: RouteHandler) -> None:
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self, host: str, port: int) -> asyncio.Server:
+        server = await asyncio.start_server(
+            self._handle_connection,
+            host=host,
+            port=port,
+            limit=MAX_HEADER_SIZE,
+        )
+        logger.info("admin interface listening on %s:%d", host, port)
+        return server
+
+    @asynccontextmanager
+    async def serving(
+        self, host: str, port: int
+    ) -> AsyncIterator[asyncio.Server]:
+        server = await self.start(host, port)
+        try:
+            yield server
+        finally:
+            server.close()
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            status, body = await asyncio.wait_for(
+                self._handle_request(reader), REQUEST_TIMEOUT
+            )
+        except BadRequest as exc:
+            status, body = HTTPStatus.BAD_REQUEST, {"error": str(exc)}
+        except (
+            asyncio.TimeoutError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            ConnectionError,
+        ):
+            writer.close()
+            return
+        data = json.dumps(body, indent=2).encode("utf-8") + b"\n"
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            "Connection: close\r\n"
+            "\r\n".encode("ascii")
+            + data
+        )
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def _handle_request(
+        self, reader: asyncio.StreamReader
+    ) -> AdminResponse:
+        request_line = await reader.readuntil(b"\r\n")
+        try:
+            method, target, _ = request_line.decode("ascii").split(" ", 2)
+        except (UnicodeDecodeError, ValueError):
+            raise BadRequest("invalid request line") from None
+        content_length = 0
+        while True:
+            header = await reader.readuntil(b"\r\n")
+            if header == b"\r\n":
+                break
+            name, _, value = header.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                try:
+                    content_length = int(value.strip())
+                except ValueError:
+                    raise BadRequest("invalid Content-Length") from None
+        if not 0 <= content_length <= MAX_BODY_SIZE:
+            raise BadRequest("invalid Content-Length")
+        await reader.readexactly(content_length)
+        url = urlsplit(target)
+        return await self.dispatch(
+            method, url.path, dict(parse_qsl(url.query))
+        )
+
+    async def dispatch(
+        self, method: str, path: str, query: dict[str, str]
+    ) -> AdminResponse:
+        handler = self._routes.get((method.upper(), path))
+        if handler is None:
+            if any(p == path for _, p in self._routes):
+                return HTTPStatus.METHOD_NOT_ALLOWED, {
+                    "error": "method not allowed"
+                }
+            return HTTPStatus.NOT_FOUND, {"error": "not found"}
+        try:
+            result = handler(query)
+            if inspect.isawaitable(result):
+                result = await result
+        except ValueError as exc:
+            return HTTPStatus.BAD_REQUEST, {"error": str(exc)}
+        except RuntimeError as exc:
+            return HTTPStatus.CONFLICT, {"error": str(exc)}
+        except Exception:
+            logger.exception("error handling admin request %s", path)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {
+                "error": "internal error"
+            }
+        return result
@@ -1,5 +1,8 @@
 import argparse
-from smtplib import SMTP_PORT
+
+from fakesmtpd.listeners import Listener, parse_listener
+from fakesmtpd.ratelimit import parse_rate_limit
+from fakesmtpd.smtp import SMTP_PORT
 
 
 def parse_args() -> argparse.Namespace:
@@ -13,6 +16,60 @@ def parse_args() -> argparse.Namespace:
         default="-",
         help="output mbox file, default stdout",
     )
+    parser.add_argument(
+        "--body-store",
+        metavar="DIR",
+        help="store each unique mail body once in DIR, instead of in the "
+        "output file",
+    )
+    parser.add_argument(
+        "--output-queue-size",
+        type=int,
+        default=1000,
+        metavar="N",
+        help="number of mails queued for the output file, default 1000",
+    )
+    parser.add_argument(
+        "--output-queue-policy",
+        choices=["block", "drop"],
+        default="block",
+        help="what to do when the output queue is full: delay the client "
+        "(block, the default) or drop the mail",
+    )
+    parser.add_argument(
+        "--mailbox-dir",
+        metavar="DIR",
+        help="also write each mail to one mbox file per recipient in DIR",
+    )
+    parser.add_argument(
+        "--mailbox-route",
+        choices=["recipient", "domain"],
+        default="recipient",
+        help="use one mailbox per recipient (default) or per domain",
+    )
+    parser.add_argument(
+        "--max-open-mailboxes",
+        type=int,
+        default=128,
+        metavar="N",
+        help="number of mailbox files kept open, default 128",
+    )
+    parser.add_argument(
+        "--webhook-url",
+        metavar="URL",
+        help="POST a JSON summary of received mails to the http URL",
+    )
+    parser.add_argument(
+        "--webhook-socket",
+        metavar="PATH",
+        help="send web hook requests to this Unix domain socket",
+    )
+    parser.add_argument(
+        "--config",
+        "-c",
+        metavar="FILE",
+        help="JSON configuration file, reloaded on SIGHUP",
+    )
     parser.add_argument(
         "--bind",
         "-b",
@@ -28,4 +85,158 @@ def parse_args() -> argparse.Namespace:
         default=SMTP_PORT,
         help="SMTP port to listen on",
     )
+    parser.add_argument(
+        "--listen",
+        "-l",
+        action="append",
+        type=_listener,
+        metavar="ADDRESS",
+        help="HOST:PORT, [IPV6]:PORT, or unix:PATH to listen on, "
+        "optionally followed by ,name=NAME, ,max-connections=N, "
+        "and ,tls for implicit TLS; "
+        "can be given multiple times and replaces --bind and --port",
+    )
+    parser.add_argument(
+        "--tls-cert",
+        metavar="FILE",
+        help="PEM certificate chain, enables STARTTLS and tls listeners",
+    )
+    parser.add_argument(
+        "--tls-key",
+        metavar="FILE",
+        help="PEM private key, if not included in --tls-cert",
+    )
+    parser.add_argument(
+        "--transport",
+        choices=["streams", "protocol"],
+        default="streams",
+        help="connection implementation to use, default streams",
+    )
+    parser.add_argument(
+        "--loop",
+        choices=["asyncio", "uvloop", "auto"],
+        default="asyncio",
+        help="event loop implementation, auto uses uvloop if installed",
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=["text", "json"],
+        default="text",
+        help="log format, default text",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        default="INFO",
+        help="minimum level of logged messages, default INFO",
+    )
+    parser.add_argument(
+        "--log-sample-rate",
+        type=float,
+        default=1.0,
+        help="fraction of sessions whose commands are logged at DEBUG level",
+    )
+    parser.add_argument(
+        "--trace-dir",
+        metavar="DIR",
+        help="record the raw data of each session to a trace file in DIR",
+    )
+    parser.add_argument(
+        "--write-buffer-high",
+        type=int,
+        default=64 * 1024,
+        metavar="BYTES",
+        help="pause reading commands while more replies are buffered, "
+        "default 65536",
+    )
+    parser.add_argument(
+        "--write-buffer-low",
+        type=int,
+        default=16 * 1024,
+        metavar="BYTES",
+        help="resume reading commands below this buffer size, default 16384",
+    )
+    parser.add_argument(
+        "--shutdown-timeout",
+        type=float,
+        default=10.0,
+        metavar="SECONDS",
+        help="time open sessions may take to finish on shutdown, "
+        "default 10 seconds",
+    )
+    parser.add_argument(
+        "--fault-rules",
+        metavar="FILE",
+        help="inject faults and latency according to the rules in FILE",
+    )
+    parser.add_argument(
+        "--recipient-policy",
+        metavar="FILE",
+        help="accept only the recipients allowed by the rules in FILE",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        dest="rate_limits",
+        action="append",
+        type=_rate_limit,
+        default=[],
+        metavar="SPEC",
+        help="limit connections, messages, or bytes per peer or sender, "
+        "e.g. peer:messages=100/m; can be given multiple times",
+    )
+    parser.add_argument(
+        "--admin-port",
+        type=int,
+        help="port of the HTTP admin interface, disabled by default",
+    )
+    parser.add_argument(
+        "--admin-bind",
+        default="127.0.0.1",
+        help="IP address of the HTTP admin interface, default 127.0.0.1",
+    )
+    parser.add_argument(
+        "--session-history",
+        type=int,
+        default=1000,
+        metavar="N",
+        help="number of ended sessions listed by the admin interface, "
+        "default 1000",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        metavar="DIR",
+        default=".",
+        help="directory for profiling output, default current directory",
+    )
+    parser.add_argument(
+        "--profile-seconds",
+        type=float,
+        default=30.0,
+        help="duration of a profiling run, default 30 seconds",
+    )
+    parser.add_argument(
+        "--slow-callback-ms",
+        type=float,
+        help="log event loop callbacks that take longer (enables debug mode)",
+    )
+    parser.add_argument(
+        "--loop-lag-interval-ms",
+        type=float,
+        help="measure the event loop lag in this interval",
+    )
     return parser.parse_args()
+
+
+def _listener(spec: str) -> Listener:
+    try:
+        return parse_listener(spec)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc)) from None
+
+
+def _rate_limit(spec: str) -> str:
+    try:
+        parse_rate_limit(spec)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc)) from None
+    return spec
@@ -0,0 +1,76 @@
+"""Content-addressed storage of mail bodies.
+
+Each unique body is stored once, in a file named after its SHA-256 hash,
+so that mails with the same body (e.g. from bulk campaigns) only need a
+reference to the hash.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+
+from fakesmtpd.metrics import metrics
+
+HASH_ALGORITHM = "sha256"
+
+
+def body_digest(body: bytes) -> str:
+    """Return the hash under which body is stored."""
+    return hashlib.new(HASH_ALGORITHM, body).hexdigest()
+
+
+class BodyStore:
+    """Store mail bodies in directory, keyed by their hash.
+
+    Bodies are stored in subdirectories named after the first two
+    characters of the hash, to keep directories small. Bodies are
+    written atomically, so concurrent writers can share a store.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # Hashes of bodies known to be stored, so that duplicates don't
+        # need a file system lookup.
+        self._known: set[str] = set()
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def put(self, body: bytes) -> str:
+        """Store body, unless already stored, and return its hash."""
+        digest = body_digest(body)
+        if digest in self._known:
+            metrics.increment("bodies_deduplicated")
+            return digest
+        path = self.path(digest)
+        if os.path.exists(path):
+            metrics.increment("bodies_deduplicated")
+        else:
+            self._write(path, body)
+            metrics.increment("bodies_stored")
+            metrics.increment("body_bytes_stored", len(body))
+        self._known.add(digest)
+        return digest
+
+    def _write(self, path: str, body: bytes) -> None:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, digest: str) -> bytes:
+        """Return the body with the given hash.
+
+        FileNotFoundError is raised if it is not stored.
+        """
+        with open(self.path(digest), "rb") as f:
+            return f.read()
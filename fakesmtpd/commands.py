@@ -1,6 +1,9 @@
-from socket import getfqdn
-from typing import Tuple
+from __future__ import annotations
 
+from typing import TYPE_CHECKING, Tuple
+
+from fakesmtpd.metrics import metrics
+from fakesmtpd.replies import server_name
 from fakesmtpd.smtp import SYNTAX_ERROR_MSG, SMTPStatus
 from fakesmtpd.state import State
 from fakesmtpd.syntax import (
@@ -11,14 +14,21 @@ from fakesmtpd.syntax import (
     parse_reverse_path,
 )
 
+if TYPE_CHECKING:
+    from fakesmtpd.policy import RecipientPolicy
+
 Reply = Tuple[SMTPStatus, str]
 
+# Service extensions advertised in the reply to EHLO.
+ESMTP_EXTENSIONS = ("PIPELINING",)
+
 
 def handle_data(state: State, arguments: str) -> Reply:
     if arguments:
         return handle_unexpected_arguments()
     if not state.data_allowed:
         return handle_bad_command_sequence()
+    state.start_data()
     return (
         SMTPStatus.START_MAIL_INPUT,
         "Enter mail text. End with . on a separate line.",
@@ -32,8 +42,11 @@ def handle_ehlo(state: State, arguments: str) -> Reply:
         arguments
     ):
         return handle_wrong_arguments()
-    state.greeted = True
-    return SMTPStatus.OK, f"{getfqdn()} Hello {arguments}"
+    state.greet()
+    lines = [f"{server_name()} Hello {arguments}", *ESMTP_EXTENSIONS]
+    if state.starttls_available:
+        lines.append("STARTTLS")
+    return SMTPStatus.OK, "\n".join(lines)
 
 
 def handle_helo(state: State, arguments: str) -> Reply:
@@ -41,8 +54,8 @@ def handle_helo(state: State, arguments: str) -> Reply:
         return handle_missing_arguments()
     if not is_valid_domain(arguments):
         return handle_wrong_arguments()
-    state.greeted = True
-    return SMTPStatus.OK, f"{getfqdn()} Hello {arguments}"
+    state.greet()
+    return SMTPStatus.OK, f"{server_name()} Hello {arguments}"
 
 
 def handle_mail(state: State, arguments: str) -> Reply:
@@ -58,8 +71,7 @@ def handle_mail(state: State, arguments: str) -> Reply:
         return handle_no_greeting()
     if not state.mail_allowed:
         return handle_bad_command_sequence()
-    state.clear()
-    state.reverse_path = path
+    state.start_mail(path)
     return SMTPStatus.OK, "Sender OK"
 
 
@@ -70,11 +82,15 @@ def handle_noop(state: State, arguments: str) -> Reply:
 def handle_quit(state: State, arguments: str) -> Reply:
     if arguments:
         return handle_unexpected_arguments()
-    msg = "{} Service closing transmission channel".format(getfqdn())
+    msg = "{} Service closing transmission channel".format(server_name())
     return SMTPStatus.SERVICE_CLOSING, msg
 
 
-def handle_rcpt(state: State, arguments: str) -> Reply:
+def handle_rcpt(
+    state: State,
+    arguments: str,
+    recipient_policy: RecipientPolicy | None = None,
+) -> Reply:
     if arguments[:3].upper() != "TO:":
         return handle_wrong_arguments()
     try:
@@ -85,6 +101,9 @@ def handle_rcpt(state: State, arguments: str) -> Reply:
         return handle_wrong_arguments()
     if not state.rcpt_allowed:
         return handle_bad_command_sequence()
+    if recipient_policy is not None and not recipient_policy.accepts(path):
+        metrics.increment("recipients_rejected")
+        return handle_unknown_recipient()
     state.add_forward_path(path)
     return SMTPStatus.OK, "Receiver OK"
 
@@ -96,6 +115,16 @@ def handle_rset(state: State, arguments: str) -> Reply:
     return SMTPStatus.OK, "OK"
 
 
+def handle_starttls(state: State, arguments: str) -> Reply:
+    if arguments:
+        return handle_unexpected_arguments()
+    if not state.starttls_available:
+        return SMTPStatus.COMMAND_NOT_IMPLEMENTED, "TLS not available"
+    if not state.mail_allowed:
+        return handle_bad_command_sequence()
+    return SMTPStatus.SERVICE_READY, "Ready to start TLS"
+
+
 def handle_vrfy(state: State, arguments: str) -> Reply:
     return SMTPStatus.CANNOT_VRFY, "Verify not allowed"
 
@@ -116,6 +145,10 @@ def handle_wrong_arguments(msg: str = "") -> Reply:
     return SMTPStatus.SYNTAX_ERROR_IN_PARAMETERS, msg or SYNTAX_ERROR_MSG
 
 
+def handle_unknown_recipient() -> Reply:
+    return SMTPStatus.MAILBOX_PERMANENTLY_UNAVAILABLE, "No such user here"
+
+
 def handle_bad_command_sequence() -> Reply:
     return SMTPStatus.BAD_SEQUENCE, "Bad command sequence"
 
@@ -133,11 +166,20 @@ _handlers = {
     "QUIT": handle_quit,
     "RCPT": handle_rcpt,
     "RSET": handle_rset,
+    "STARTTLS": handle_starttls,
     "VRFY": handle_vrfy,
 }
 
 
-def handle_command(state: State, command: str, arguments: str) -> Reply:
+def handle_command(
+    state: State,
+    command: str,
+    arguments: str,
+    *,
+    recipient_policy: RecipientPolicy | None = None,
+) -> Reply:
+    if command == "RCPT":
+        return handle_rcpt(state, arguments, recipient_policy)
     try:
         handler = _handlers[command]
     except KeyError:
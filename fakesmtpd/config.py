@@ -0,0 +1,545 @@
+"""Server settings that can be reloaded while the server runs."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import signal
+from collections.abc import AsyncIterator, Awaitable, Sequence
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from fakesmtpd.connection import ConnectionHandler
+from fakesmtpd.log import set_command_sample_rate
+from fakesmtpd.mbox import MboxSink
+from fakesmtpd.metrics import metrics
+from fakesmtpd.pipeline import (
+    DEFAULT_QUEUE_SIZE,
+    POLICIES,
+    SinkPipeline,
+    SinkWorker,
+)
+from fakesmtpd.ratelimit import RateLimiter, parse_rate_limit
+from fakesmtpd.replies import server_name
+from fakesmtpd.tls import create_server_context
+
+if TYPE_CHECKING:
+    import ssl
+    from argparse import Namespace
+
+    from fakesmtpd.admin import AdminResponse, AdminServer
+    from fakesmtpd.bodystore import BodyStore
+    from fakesmtpd.connection import (
+        HandlerFactory,
+        _StreamReaderProto,
+        _StreamWriterProto,
+    )
+    from fakesmtpd.faults import FaultRules
+    from fakesmtpd.listeners import Listener
+    from fakesmtpd.policy import RecipientPolicy
+    from fakesmtpd.routing import MailboxRouter
+    from fakesmtpd.sessions import SessionRegistry
+    from fakesmtpd.state import State
+    from fakesmtpd.webhook import WebhookNotifier
+
+logger = logging.getLogger(__name__)
+
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+
+class ConfigError(ValueError):
+    pass
+
+
+class Settings(NamedTuple):
+    output_filename: str = "-"
+    body_store: str | None = None
+    output_queue_size: int = DEFAULT_QUEUE_SIZE
+    output_queue_policy: str = "block"
+    mailbox_dir: str | None = None
+    mailbox_route: str = "recipient"
+    max_open_mailboxes: int = 128
+    webhook_url: str | None = None
+    webhook_socket: str | None = None
+    trace_dir: str | None = None
+    write_buffer_high: int = 64 * 1024
+    write_buffer_low: int = 16 * 1024
+    shutdown_timeout: float = 10.0
+    log_level: str = "INFO"
+    log_sample_rate: float = 1.0
+    tls_cert: str | None = None
+    tls_key: str | None = None
+    fault_rules: str | None = None
+    recipient_policy: str | None = None
+    rate_limits: Sequence[str] = ()
+
+    @classmethod
+    def from_args(cls, args: Namespace) -> Settings:
+        return cls(**{field: getattr(args, field) for field in cls._fields})
+
+
+_FIELD_TYPES: dict[str, tuple[type, ...]] = {
+    "output_filename": (str,),
+    "body_store": (str, type(None)),
+    "output_queue_size": (int,),
+    "output_queue_policy": (str,),
+    "mailbox_dir": (str, type(None)),
+    "mailbox_route": (str,),
+    "max_open_mailboxes": (int,),
+    "webhook_url": (str, type(None)),
+    "webhook_socket": (str, type(None)),
+    "trace_dir": (str, type(None)),
+    "write_buffer_high": (int,),
+    "write_buffer_low": (int,),
+    "shutdown_timeout": (int, float),
+    "log_level": (str,),
+    "log_sample_rate": (int, float),
+    "tls_cert": (str, type(None)),
+    "tls_key": (str, type(None)),
+    "fault_rules": (str, type(None)),
+    "recipient_policy": (str, type(None)),
+    "rate_limits": (list,),
+}
+
+
+def load_config(filename: str, defaults: Settings) -> Settings:
+    """Read settings from a JSON file.
+
+    The file contains an object with some or all fields of Settings.
+    Missing fields are taken from defaults. ConfigError is raised if
+    the file can't be read or contains invalid settings.
+    """
+    import json
+
+    try:
+        with open(filename) as f:
+            data = json.load(f)
+    except OSError as exc:
+        raise ConfigError(f"can't read config file: {exc}") from exc
+    except json.JSONDecodeError as exc:
+        raise ConfigError(f"invalid config file {filename}: {exc}") from exc
+    if not isinstance(data, dict):
+        raise ConfigError(f"invalid config file {filename}: not an object")
+    return parse_settings(data, defaults)
+
+
+def parse_settings(data: dict[str, Any], defaults: Settings) -> Settings:
+    for key, value in data.items():
+        try:
+            types = _FIELD_TYPES[key]
+        except KeyError:
+            raise ConfigError(f"unknown setting: {key}") from None
+        if isinstance(value, bool) or not isinstance(value, types):
+            raise ConfigError(f"invalid value for {key}: {value!r}")
+    settings = defaults._replace(**data)
+    _validate(settings)
+    return settings
+
+
+def _validate(settings: Settings) -> None:
+    if settings.output_queue_size < 1:
+        raise ConfigError("output_queue_size must be positive")
+    if settings.output_queue_policy not in POLICIES:
+        raise ConfigError(
+            f"unknown output queue policy: {settings.output_queue_policy}"
+        )
+    if settings.mailbox_route not in ("recipient", "domain"):
+        raise ConfigError(f"unknown mailbox route: {settings.mailbox_route}")
+    if settings.max_open_mailboxes < 1:
+        raise ConfigError("max_open_mailboxes must be positive")
+    if settings.webhook_socket is not None and settings.webhook_url is None:
+        raise ConfigError("webhook_socket requires webhook_url")
+    if settings.write_buffer_low < 0:
+        raise ConfigError("write_buffer_low must not be negative")
+    if settings.write_buffer_high < settings.write_buffer_low:
+        raise ConfigError("write_buffer_high must be >= write_buffer_low")
+    if settings.shutdown_timeout < 0:
+        raise ConfigError("shutdown_timeout must not be negative")
+    if settings.log_level not in LOG_LEVELS:
+        raise ConfigError(f"unknown log level: {settings.log_level}")
+    if not 0.0 <= settings.log_sample_rate <= 1.0:
+        raise ConfigError("log_sample_rate must be between 0 and 1")
+    if settings.tls_key is not None and settings.tls_cert is None:
+        raise ConfigError("tls_key requires tls_cert")
+    for spec in settings.rate_limits:
+        if not isinstance(spec, str):
+            raise ConfigError(f"invalid rate limit: {spec!r}")
+        try:
+            parse_rate_limit(spec)
+        except ValueError as exc:
+            raise ConfigError(f"invalid rate limit: {exc}") from None
+
+
+def _create_tls_context(settings: Settings) -> ssl.SSLContext | None:
+    if settings.tls_cert is None:
+        return None
+    try:
+        return create_server_context(settings.tls_cert, settings.tls_key)
+    except OSError as exc:
+        raise ConfigError(f"can't load TLS certificate: {exc}") from exc
+
+
+def _create_trace_dir(settings: Settings) -> None:
+    if settings.trace_dir is None:
+        return
+    try:
+        os.makedirs(settings.trace_dir, exist_ok=True)
+    except OSError as exc:
+        raise ConfigError(f"can't create trace dir: {exc}") from exc
+    if not os.access(settings.trace_dir, os.W_OK | os.X_OK):
+        raise ConfigError(f"can't write to trace dir: {settings.trace_dir}")
+
+
+def _create_rate_limiter(settings: Settings) -> RateLimiter | None:
+    if not settings.rate_limits:
+        return None
+    return RateLimiter(parse_rate_limit(spec) for spec in settings.rate_limits)
+
+
+# Settings that require new sinks if they are changed by a reload.
+_SINK_SETTINGS = (
+    "output_filename",
+    "body_store",
+    "mailbox_dir",
+    "mailbox_route",
+    "max_open_mailboxes",
+    "webhook_url",
+    "webhook_socket",
+)
+_QUEUE_SETTINGS = ("output_queue_size", "output_queue_policy")
+
+
+class _Sinks(NamedTuple):
+    output: MboxSink
+    mailboxes: MailboxRouter | None
+    webhook: WebhookNotifier | None
+
+    def reopen(self) -> None:
+        self.output.reopen()
+        if self.mailboxes is not None:
+            self.mailboxes.reopen()
+
+    async def aclose(self) -> None:
+        if self.webhook is not None:
+            await self.webhook.aclose()
+
+    def close(self) -> None:
+        self.output.close()
+        if self.mailboxes is not None:
+            self.mailboxes.close()
+        if self.webhook is not None:
+            self.webhook.close()
+
+
+def _create_sinks(settings: Settings) -> _Sinks:
+    body_store: BodyStore | None = None
+    if settings.body_store is not None:
+        from fakesmtpd.bodystore import BodyStore
+
+        try:
+            body_store = BodyStore(settings.body_store)
+        except OSError as exc:
+            raise ConfigError(f"can't create body store: {exc}") from exc
+    mailboxes: MailboxRouter | None = None
+    if settings.mailbox_dir is not None:
+        from fakesmtpd.routing import MailboxRouter
+
+        try:
+            mailboxes = MailboxRouter(
+                settings.mailbox_dir,
+                route=settings.mailbox_route,
+                max_open_files=settings.max_open_mailboxes,
+                body_store=body_store,
+            )
+        except OSError as exc:
+            raise ConfigError(f"can't create mailbox dir: {exc}") from exc
+    webhook: WebhookNotifier | None = None
+    if settings.webhook_url is not None:
+        from fakesmtpd.webhook import WebhookNotifier
+
+        try:
+            webhook = WebhookNotifier(
+                settings.webhook_url,
+                unix_socket=settings.webhook_socket,
+                body_hash=body_store is not None,
+            )
+        except ValueError as exc:
+            raise ConfigError(str(exc)) from exc
+    output = MboxSink(settings.output_filename, body_store=body_store)
+    return _Sinks(output, mailboxes, webhook)
+
+
+def _create_pipeline(settings: Settings, sinks: _Sinks) -> SinkPipeline:
+    worker = partial(
+        SinkWorker,
+        queue_size=settings.output_queue_size,
+        policy=settings.output_queue_policy,
+    )
+    workers = [worker("output", sinks.output)]
+    if sinks.mailboxes is not None:
+        workers.append(worker("mailboxes", sinks.mailboxes))
+    if sinks.webhook is not None:
+        # The notifier only queues the summaries to send.
+        workers.append(worker("webhook", sinks.webhook, threaded=False))
+    return SinkPipeline(workers)
+
+
+def _changed(old: Settings, new: Settings, fields: Sequence[str]) -> bool:
+    return any(getattr(old, f) != getattr(new, f) for f in fields)
+
+
+def _load_fault_rules(settings: Settings) -> FaultRules | None:
+    if settings.fault_rules is None:
+        return None
+    from fakesmtpd.faults import load_fault_rules
+
+    try:
+        return load_fault_rules(settings.fault_rules)
+    except (OSError, ValueError) as exc:
+        raise ConfigError(f"can't load fault rules: {exc}") from exc
+
+
+def _load_recipient_policy(settings: Settings) -> RecipientPolicy | None:
+    if settings.recipient_policy is None:
+        return None
+    from fakesmtpd.policy import load_recipient_policy
+
+    try:
+        return load_recipient_policy(
+            settings.recipient_policy, local_domains=[server_name()]
+        )
+    except (OSError, ValueError) as exc:
+        raise ConfigError(f"can't load recipient policy: {exc}") from exc
+
+
+class ServerConfig:
+    """Current settings of a running server.
+
+    The settings are read from the command line (defaults) and the
+    optional config file, which takes precedence. reload() re-reads the
+    config file, reopens the output file, and reloads the TLS
+    certificate, the fault rules, and the recipient policy. Rate limits
+    are reset if they were changed. New sessions use the settings that
+    are current when they start, open sessions are not affected by a
+    reload.
+
+    Received mails are passed to a sink pipeline, which writes them to
+    the output file in a worker thread. Mails of all sessions go to the
+    current pipeline. When a reload replaces the pipeline, the previous
+    one is closed once it has delivered its queued mails, together with
+    its sinks, unless the new pipeline reuses them.
+    """
+
+    def __init__(
+        self,
+        defaults: Settings,
+        config_file: str | None = None,
+        *,
+        sessions: SessionRegistry | None = None,
+    ) -> None:
+        self.defaults = defaults
+        self.config_file = config_file
+        self._sessions = sessions
+        self.settings = self._load()
+        _create_trace_dir(self.settings)
+        self.tls_context = _create_tls_context(self.settings)
+        self.fault_rules = _load_fault_rules(self.settings)
+        self.recipient_policy = _load_recipient_policy(self.settings)
+        self.rate_limiter = _create_rate_limiter(self.settings)
+        self._sinks = _create_sinks(self.settings)
+        self._pipeline = _create_pipeline(self.settings, self._sinks)
+        self._retired: list[tuple[SinkPipeline, _Sinks | None]] = []
+        self._retiring: set[asyncio.Task[None]] = set()
+        self._apply_global_settings()
+
+    def _load(self) -> Settings:
+        if self.config_file is None:
+            return self.defaults
+        return load_config(self.config_file, self.defaults)
+
+    def _apply_global_settings(self) -> None:
+        logging.getLogger().setLevel(self.settings.log_level)
+        set_command_sample_rate(self.settings.log_sample_rate)
+        if self._sessions is not None:
+            self._sessions.shutdown_timeout = self.settings.shutdown_timeout
+
+    def create_handler(
+        self,
+        reader: _StreamReaderProto,
+        writer: _StreamWriterProto,
+        *,
+        peer: str = "",
+        listener: Listener | None = None,
+    ) -> ConnectionHandler:
+        """Create a connection handler with the current settings."""
+        settings = self.settings
+        implicit_tls = listener is not None and listener.tls
+        return ConnectionHandler(
+            reader,
+            writer,
+            self._deliver,
+            peer=peer,
+            trace_dir=settings.trace_dir,
+            write_buffer_limits=(
+                settings.write_buffer_high,
+                settings.write_buffer_low,
+            ),
+            sessions=self._sessions,
+            listener=listener,
+            tls_context=self.tls_context,
+            implicit_tls=implicit_tls,
+            faults=self.fault_rules,
+            rate_limiter=self.rate_limiter,
+            recipient_policy=self.recipient_policy,
+        )
+
+    def _deliver(self, state: State) -> Awaitable[None] | None:
+        return self._pipeline(state)
+
+    def handler_factory(self, listener: Listener) -> HandlerFactory:
+        """Return a handler factory for connections to listener."""
+        return partial(self.create_handler, listener=listener)
+
+    def reload(self) -> Settings:
+        """Re-read the config file and reopen the output file.
+
+        If the config file is invalid, ConfigError is raised and the
+        current settings are kept.
+        """
+        try:
+            settings = self._load()
+            if self.tls_context is not None and settings.tls_cert is None:
+                raise ConfigError("TLS can't be disabled by a reload")
+            _create_trace_dir(settings)
+            tls_context = _create_tls_context(settings)
+            fault_rules = _load_fault_rules(settings)
+            recipient_policy = _load_recipient_policy(settings)
+            sinks = None
+            if _changed(self.settings, settings, _SINK_SETTINGS):
+                sinks = _create_sinks(settings)
+        except ConfigError:
+            metrics.increment("config_reload_errors")
+            raise
+        if sinks is None:
+            self._sinks.reopen()
+        if sinks is not None or _changed(
+            self.settings, settings, _QUEUE_SETTINGS
+        ):
+            # If only the queue settings changed, the sinks are reused.
+            self._retire(
+                self._pipeline, None if sinks is None else self._sinks
+            )
+            if sinks is not None:
+                self._sinks = sinks
+            self._pipeline = _create_pipeline(settings, self._sinks)
+        if list(settings.rate_limits) != list(self.settings.rate_limits):
+            self.rate_limiter = _create_rate_limiter(settings)
+        self.settings = settings
+        self.tls_context = tls_context
+        self.fault_rules = fault_rules
+        self.recipient_policy = recipient_policy
+        self._apply_global_settings()
+        metrics.increment("config_reloads")
+        logger.info("configuration reloaded")
+        return settings
+
+    def _retire(self, pipeline: SinkPipeline, sinks: _Sinks | None) -> None:
+        """Close a pipeline that receives no more mails, and its sinks.
+
+        If no event loop is running, they are closed by close().
+        """
+        retired = (pipeline, sinks)
+        self._retired.append(retired)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(self._close_retired(retired))
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    async def _close_retired(
+        self, retired: tuple[SinkPipeline, _Sinks | None]
+    ) -> None:
+        pipeline, sinks = retired
+        await pipeline.aclose(self.settings.shutdown_timeout)
+        pipeline.close()
+        if sinks is not None:
+            await self._close_sinks(sinks)
+            sinks.close()
+        if retired in self._retired:
+            self._retired.remove(retired)
+
+    async def _close_sinks(self, sinks: _Sinks) -> None:
+        try:
+            await asyncio.wait_for(
+                sinks.aclose(), self.settings.shutdown_timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning("web hook notifications not sent before shutdown")
+
+    async def drain(self) -> None:
+        """Wait until queued mails were written and notified.
+
+        This waits at most shutdown_timeout seconds for the mail sinks
+        and for the web hook each.
+        """
+        if self._retiring:
+            await asyncio.gather(*self._retiring)
+        await self._pipeline.aclose(self.settings.shutdown_timeout)
+        await self._close_sinks(self._sinks)
+
+    def close(self) -> None:
+        """Write queued mails, then flush and close all output files."""
+        for pipeline, sinks in self._retired:
+            pipeline.close()
+            if sinks is not None:
+                sinks.close()
+        self._retired.clear()
+        self._pipeline.close()
+        self._sinks.close()
+
+    def _reload_on_signal(self) -> None:
+        try:
+            self.reload()
+        except ConfigError as exc:
+            logger.error("configuration not reloaded: %s", exc)
+
+
+@asynccontextmanager
+async def reloading(config: ServerConfig) -> AsyncIterator[None]:
+    """Reload the configuration on SIGHUP while the server runs."""
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGHUP, config._reload_on_signal)
+    try:
+        yield
+    finally:
+        loop.remove_signal_handler(signal.SIGHUP)
+
+
+@asynccontextmanager
+async def delivering(config: ServerConfig) -> AsyncIterator[None]:
+    """Write the mails that are still queued when the server stops."""
+    try:
+        yield
+    finally:
+        await config.drain()
+
+
+def add_config_routes(admin: AdminServer, config: ServerConfig) -> None:
+    """Add admin routes to inspect and reload the configuration.
+
+    GET /config returns the current settings, POST /reload reloads them.
+    """
+    from http import HTTPStatus
+
+    def get_config(query: dict[str, str]) -> AdminResponse:
+        return HTTPStatus.OK, config.settings._asdict()
+
+    def reload_config(query: dict[str, str]) -> AdminResponse:
+        return HTTPStatus.OK, config.reload()._asdict()
+
+    admin.add_route("GET", "/config", get_config)
+    admin.add_route("POST", "/reload", reload_config)
@@ -1,24 +1,61 @@
 from __future__ import annotations
 
+import asyncio
 import codecs
 import datetime
 import logging
-from collections.abc import Callable
-from socket import getfqdn
-from typing import Any
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from typing import TYPE_CHECKING, Any, Protocol, cast
 
-from typing_extensions import Protocol
-
-from fakesmtpd.commands import handle_command
+from fakesmtpd.commands import Reply, handle_command
+from fakesmtpd.log import new_session_id, sample_command_log
+from fakesmtpd.metrics import metrics
+from fakesmtpd.replies import encode_reply, server_name
 from fakesmtpd.smtp import SMTP_COMMAND_LIMIT, SMTP_TEXT_LINE_LIMIT, SMTPStatus
 from fakesmtpd.state import State
+from fakesmtpd.trace import TraceWriter
+
+if TYPE_CHECKING:
+    import ssl
+
+    from fakesmtpd.faults import FaultRule, FaultRules
+    from fakesmtpd.listeners import Listener
+    from fakesmtpd.policy import RecipientPolicy
+    from fakesmtpd.ratelimit import RateLimiter
+    from fakesmtpd.sessions import SessionRegistry
 
 CRLF_LENGTH = 2
 
+# Replies to pipelined commands are sent together, but at most this many
+# at a time.
+MAX_PENDING_REPLIES = 64
+
+logger = logging.getLogger(__name__)
+
+
+class _TransportProto(Protocol):
+    def get_extra_info(self, __name: str, __default: Any = ...) -> Any: ...
+
+    def get_write_buffer_size(self) -> int: ...
+
+    def get_write_buffer_limits(self) -> tuple[int, int]: ...
+
+    def set_write_buffer_limits(
+        self, high: int | None = ..., low: int | None = ...
+    ) -> None: ...
+
 
 class _StreamWriterProto(Protocol):
+    @property
+    def transport(self) -> _TransportProto: ...
+
     def write(self, __b: bytes) -> Any: ...
 
+    def writelines(self, __data: Iterable[bytes]) -> Any: ...
+
+    async def drain(self) -> None: ...
+
     def close(self) -> Any: ...
 
 
@@ -28,6 +65,36 @@ class _StreamReaderProto(Protocol):
     async def readuntil(self, __until: bytes) -> bytes: ...
 
 
+class _BufferedReaderProto(_StreamReaderProto, Protocol):
+    def has_buffered_data(self) -> bool: ...
+
+
+def has_buffered_data(reader: _StreamReaderProto) -> bool:
+    """Return whether reader has received data that was not read yet.
+
+    Readers report this with a has_buffered_data() method, like
+    SMTPProtocol does. asyncio.StreamReader has no public API for it, so
+    its private _buffer attribute is checked instead. If it is missing,
+    AttributeError is raised, instead of silently treating all commands
+    as not pipelined. Other readers are assumed to buffer nothing.
+    """
+    if hasattr(reader, "has_buffered_data"):
+        return cast("_BufferedReaderProto", reader).has_buffered_data()
+    if isinstance(reader, asyncio.StreamReader):
+        return bool(reader._buffer)  # type: ignore[attr-defined]
+    return False
+
+
+class HandlerFactory(Protocol):
+    def __call__(
+        self,
+        reader: _StreamReaderProto,
+        writer: _StreamWriterProto,
+        *,
+        peer: str = "",
+    ) -> ConnectionHandler: ...
+
+
 class UnexpectedEOFError(Exception):
     pass
 
@@ -44,34 +111,242 @@ def replace_by_7_bit(error: UnicodeError) -> tuple[str, int]:
 codecs.register_error("7bit", replace_by_7_bit)
 
 
+def format_peer(peername: Any) -> str:
+    """Format a socket peer name as returned by get_extra_info()."""
+    if isinstance(peername, tuple) and len(peername) >= 2:
+        host, port = peername[:2]
+        return f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+    return str(peername) if peername else ""
+
+
+def peer_host(peer: str) -> str:
+    """Return the host part of a peer formatted by format_peer()."""
+    if peer.startswith("["):
+        return peer[1:].partition("]")[0]
+    host, sep, port = peer.rpartition(":")
+    return host if sep and port.isdigit() else peer
+
+
 class ConnectionHandler:
     def __init__(
         self,
         reader: _StreamReaderProto,
         writer: _StreamWriterProto,
-        print_mail: Callable[[State], None],
+        print_mail: Callable[[State], Awaitable[None] | None],
+        *,
+        peer: str = "",
+        trace_dir: str | None = None,
+        write_buffer_limits: tuple[int, int] | None = None,
+        sessions: SessionRegistry | None = None,
+        listener: Listener | None = None,
+        tls_context: ssl.SSLContext | None = None,
+        implicit_tls: bool = False,
+        faults: FaultRules | None = None,
+        rate_limiter: RateLimiter | None = None,
+        recipient_policy: RecipientPolicy | None = None,
     ) -> None:
         self.reader = reader
         self.writer = writer
         self.print_mail = print_mail
         self.state = State()
+        self._recipient_policy = recipient_policy
+        self.session_id = new_session_id()
+        self.peer = peer
+        self.commands = 0
+        self.messages = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.max_write_buffer_size = 0
+        self.write_paused_time = 0.0
+        self.started = time.monotonic()
+        self.tls = False
+        self._tls_context = tls_context
+        self._implicit_tls = implicit_tls
+        if tls_context is not None and not implicit_tls:
+            self.state.starttls_available = True
+        self._sessions = sessions
+        self._listener = listener
+        self._faults = faults or None
+        self._disconnect_after: int | None = None
+        self._rate_limiter = rate_limiter
+        self._client_host = peer_host(peer)
+        self._phase = self.state.phase
+        self._phase_started = self.started
+        self._idle = False
+        self._shutting_down = False
+        self._closed = False
+        self._log_context = {"session": self.session_id, "peer": peer}
+        self._log_commands = sample_command_log(logger)
+        self._trace: TraceWriter | None = None
+        if trace_dir is not None:
+            try:
+                self._trace = TraceWriter.for_session(
+                    trace_dir, self.session_id
+                )
+            except OSError as exc:
+                logger.warning(
+                    "can't record trace: %s", exc, extra=self._log_context
+                )
+        self._write_buffer_limits = write_buffer_limits
+        self._output: list[bytes] = []
+        self._set_up_transport()
+
+    def _set_up_transport(self) -> None:
+        transport = self.writer.transport
+        if self._write_buffer_limits is not None:
+            high, low = self._write_buffer_limits
+            transport.set_write_buffer_limits(high=high, low=low)
+        self._transport = transport
+        self._write_buffer_high = transport.get_write_buffer_limits()[1]
 
     async def handle(self) -> None:
-        logging.info("connection opened")
+        logger.debug("connection opened", extra=self._log_context)
+        if (
+            self._rate_limiter is not None
+            and not self._rate_limiter.allow_connection(self._client_host)
+        ):
+            self._reject_connection(
+                "Too many connections from your host",
+                "rate limit for %s exceeded",
+                self._client_host,
+            )
+            return
+        if self._listener is not None and not self._listener.acquire():
+            self._reject_connection(
+                "Too many connections",
+                "too many connections to %s",
+                self._listener.name,
+            )
+            return
+        if self._sessions is not None:
+            self._sessions.add(self)
         try:
             await self._handle_connection()
         except Exception as exc:
-            logging.warning(str(exc))
+            if not self._closed:
+                logger.warning("%s", exc, extra=self._log_context)
+                self.abort()
         finally:
-            logging.info("connection closed")
+            if self._sessions is not None:
+                self._sessions.remove(self)
+            if self._listener is not None:
+                self._listener.release()
+            if self._trace is not None:
+                self._trace.close()
+            self._log_summary(time.monotonic() - self.started)
+            metrics.observe(
+                "session_max_write_buffer_bytes", self.max_write_buffer_size
+            )
+            if self.write_paused_time:
+                metrics.observe(
+                    "session_write_paused_seconds", self.write_paused_time
+                )
+
+    def summary(self) -> dict[str, Any]:
+        """Return the current statistics of the session."""
+        now = time.monotonic()
+        self._update_phase(now)
+        return {
+            "session": self.session_id,
+            "peer": self.peer,
+            "listener": self._listener.name if self._listener else None,
+            "tls": self.tls,
+            "phase": self._phase.name.lower(),
+            "phase_seconds": round(now - self._phase_started, 6),
+            "duration": round(now - self.started, 6),
+            "commands": self.commands,
+            "messages": self.messages,
+            "bytes_received": self.bytes_received,
+            "bytes_sent": self.bytes_sent,
+        }
+
+    def _update_phase(self, now: float | None = None) -> None:
+        if self.state.phase is not self._phase:
+            self._phase = self.state.phase
+            self._phase_started = time.monotonic() if now is None else now
+
+    @property
+    def in_transaction(self) -> bool:
+        """Whether a mail transaction was started, but not finished."""
+        return self.state.in_transaction
+
+    def shutdown(self) -> None:
+        """Ask the session to end with a 421 reply.
+
+        An idle session is closed at once. Otherwise the session is closed
+        after the current command or mail transaction.
+        """
+        self._shutting_down = True
+        if self._idle:
+            self._close_for_shutdown()
+
+    def abort(self) -> None:
+        """Close the connection without a reply."""
+        self._closed = True
+        self._flush()
+        self.writer.close()
+
+    def _reject_connection(self, text: str, reason: str, *args: Any) -> None:
+        logger.info(
+            "connection rejected: " + reason, *args, extra=self._log_context
+        )
+        self._write_reply(
+            SMTPStatus.SERVICE_NOT_AVAILABLE,
+            f"{server_name()} {text}, closing transmission channel",
+        )
+        if self._trace is not None:
+            self._trace.close()
+        self.abort()
+
+    def _close_for_shutdown(self) -> None:
+        self._write_reply(
+            SMTPStatus.SERVICE_NOT_AVAILABLE,
+            "{} Service not available, closing transmission channel".format(
+                server_name()
+            ),
+        )
+        self.abort()
+
+    def _log_summary(self, duration: float) -> None:
+        logger.info(
+            "connection closed: %d commands, %d messages, "
+            "%d bytes received, %d bytes sent in %.3f s",
+            self.commands,
+            self.messages,
+            self.bytes_received,
+            self.bytes_sent,
+            duration,
+            extra={
+                **self._log_context,
+                "commands": self.commands,
+                "messages": self.messages,
+                "bytes_received": self.bytes_received,
+                "bytes_sent": self.bytes_sent,
+                "duration": round(duration, 6),
+                "max_write_buffer_size": self.max_write_buffer_size,
+                "write_paused_time": round(self.write_paused_time, 6),
+            },
+        )
 
     async def _handle_connection(self) -> None:
+        if self._implicit_tls:
+            await self._start_tls("implicit")
         self._write_reply(
             SMTPStatus.SERVICE_READY,
-            "{} FakeSMTPd Service ready".format(getfqdn()),
+            "{} FakeSMTPd Service ready".format(server_name()),
         )
         while not self.reader.at_eof():
-            line = await self.reader.readuntil(b"\r\n")
+            self._update_phase()
+            if self._shutting_down and not self.in_transaction:
+                self._close_for_shutdown()
+                return
+            self._idle = not self.in_transaction
+            try:
+                line = await self._read_line()
+            finally:
+                self._idle = False
+            if self._closed:
+                return
             try:
                 decoded = line.decode("ascii").rstrip()
             except UnicodeDecodeError:
@@ -81,61 +356,313 @@ class ConnectionHandler:
                 )
                 continue
             try:
-                code = self._handle_command_line(decoded)
+                if self._faults is None:
+                    code = self._handle_command_line(decoded)
+                else:
+                    code = await self._handle_command_line_with_faults(decoded)
             except ValueError:
                 pass
             else:
+                self._update_phase()
+                if self._closed:
+                    return
                 if code == SMTPStatus.START_MAIL_INPUT:
                     await self._handle_mail_text()
+                elif code == SMTPStatus.SERVICE_READY:
+                    await self._handle_starttls()
                 elif code == SMTPStatus.SERVICE_CLOSING:
                     break
+        self._flush()
         self.writer.close()
 
+    async def _handle_starttls(self) -> None:
+        # Plain text that a client sent after STARTTLS must not be
+        # processed as if it was received over TLS (RFC 3207, section 5).
+        if has_buffered_data(self.reader):
+            raise ValueError("client sent data after STARTTLS")
+        await self._start_tls("starttls")
+        # The client must start over with EHLO (RFC 3207, section 4.2).
+        self.state.reset()
+
+    async def _start_tls(self, mode: str) -> None:
+        assert self._tls_context is not None
+        start_tls = getattr(self.writer, "start_tls", None)
+        if start_tls is None:
+            raise RuntimeError("TLS is not supported by this transport")
+        self._flush()
+        labels = {"mode": mode}
+        started = time.monotonic()
+        try:
+            await start_tls(self._tls_context)
+        except Exception:
+            metrics.increment("tls_handshake_errors", labels=labels)
+            raise
+        duration = time.monotonic() - started
+        self.tls = True
+        self._set_up_transport()
+        ssl_object = self._transport.get_extra_info("ssl_object")
+        resumed = ssl_object is not None and ssl_object.session_reused
+        metrics.observe("tls_handshake_seconds", duration, labels=labels)
+        metrics.increment(
+            "tls_handshakes",
+            labels={**labels, "resumed": "yes" if resumed else "no"},
+        )
+        if self._log_commands:
+            logger.debug(
+                "TLS started in %.3f s%s",
+                duration,
+                " (resumed)" if resumed else "",
+                extra=self._log_context,
+            )
+
     def _handle_command_line(self, line: str) -> SMTPStatus:
-        logging.debug(f"received command: {line}")
-        command, arguments = self._parse_command_line(line)
-        code, text = handle_command(self.state, command, arguments)
-        logging.debug(f"sending response: {code} {text}")
-        self._write_reply(code, text)
+        command, arguments = self._receive_command_line(line)
+        code, text = self._execute_command(command, arguments)
+        self._send_reply(code, text)
+        return code
+
+    async def _handle_command_line_with_faults(self, line: str) -> SMTPStatus:
+        from fakesmtpd.faults import command_addresses
+
+        assert self._faults is not None
+        command, arguments = self._receive_command_line(line)
+        rule = self._faults.match(
+            command, *command_addresses(self.state, command, arguments)
+        )
+        if rule is None:
+            code, text = self._execute_command(command, arguments)
+            self._send_reply(code, text)
+            return code
+        await self._start_fault(rule, command)
+        if rule.disconnect:
+            self.abort()
+            return SMTPStatus.SERVICE_NOT_AVAILABLE
+        if rule.reply is not None:
+            code, text = rule.reply
+        else:
+            code, text = self._execute_command(command, arguments)
+        if code == SMTPStatus.START_MAIL_INPUT:
+            self._disconnect_after = rule.disconnect_after_bytes
+        await self._send_fault_reply(rule, code, text)
         return code
 
+    async def _start_fault(self, rule: FaultRule, command: str) -> None:
+        metrics.increment("faults_injected", labels={"command": command})
+        if self._log_commands:
+            logger.debug(
+                "injecting fault into reply to %s",
+                command,
+                extra=self._log_context,
+            )
+        if rule.delay is not None:
+            self._flush()
+            await asyncio.sleep(rule.delay())
+
+    async def _send_fault_reply(
+        self, rule: FaultRule, code: SMTPStatus, text: str
+    ) -> None:
+        if rule.drip is None:
+            self._send_reply(code, text)
+        else:
+            await self._drip_reply(code, text, rule.drip)
+        if code == SMTPStatus.SERVICE_NOT_AVAILABLE:
+            self.abort()
+
+    async def _drip_reply(
+        self, code: SMTPStatus, text: str, interval: float
+    ) -> None:
+        """Send a reply one byte at a time, pausing after each byte."""
+        if self._log_commands:
+            logger.debug(
+                "sending response: %s %s",
+                code.value,
+                text,
+                extra=self._log_context,
+            )
+        reply = encode_reply(code, text)
+        for i in range(len(reply)):
+            self._write(reply[i : i + 1])
+            self._flush()
+            await self.writer.drain()
+            await asyncio.sleep(interval)
+
+    def _execute_command(self, command: str, arguments: str) -> Reply:
+        code, text = handle_command(
+            self.state,
+            command,
+            arguments,
+            recipient_policy=self._recipient_policy,
+        )
+        if (
+            self._rate_limiter is not None
+            and command == "MAIL"
+            and code == SMTPStatus.OK
+        ):
+            assert self.state.reverse_path is not None
+            if not self._rate_limiter.allow_message(
+                self._client_host, self.state.reverse_path
+            ):
+                self.state.clear()
+                logger.info(
+                    "message rejected: rate limit for %s exceeded",
+                    self._client_host,
+                    extra=self._log_context,
+                )
+                return (
+                    SMTPStatus.LOCAL_ERROR,
+                    "Too many messages, try again later",
+                )
+        return code, text
+
+    def _receive_command_line(self, line: str) -> tuple[str, str]:
+        self.commands += 1
+        if self._log_commands:
+            logger.debug("received command: %s", line, extra=self._log_context)
+        return self._parse_command_line(line)
+
+    def _send_reply(self, code: SMTPStatus, text: str) -> None:
+        if self._log_commands:
+            logger.debug(
+                "sending response: %s %s",
+                code.value,
+                text,
+                extra=self._log_context,
+            )
+        self._write_reply(code, text)
+
     def _parse_command_line(self, line: str) -> tuple[str, str]:
         if len(line) + 2 > SMTP_COMMAND_LIMIT:
             self._write_line_too_long()
             raise ValueError()
-        command = line[:4].upper()
-        return command, line[5:]
+        command, _, arguments = line.partition(" ")
+        return command.upper(), arguments
 
     async def _handle_mail_text(self) -> None:
+        disconnect_after = self._disconnect_after
+        self._disconnect_after = None
         try:
-            await self._read_mail_text()
+            await self._read_mail_text(disconnect_after)
         except UnexpectedEOFError:
             pass
         except ValueError:
             self._write_reply(SMTPStatus.SYNTAX_ERROR, "Line too long.")
         else:
+            if self._faults is not None:
+                await self._finish_mail_with_faults()
+            else:
+                self._write_reply(SMTPStatus.OK, "OK")
+                await self._deliver_mail()
+
+    async def _finish_mail_with_faults(self) -> None:
+        from fakesmtpd.faults import END_OF_DATA
+
+        assert self._faults is not None
+        state = self.state
+        rule = self._faults.match(
+            END_OF_DATA, state.reverse_path, state.forward_path or ()
+        )
+        if rule is None:
             self._write_reply(SMTPStatus.OK, "OK")
-            self.state.date = datetime.datetime.now(
-                datetime.timezone.utc
-            ).replace(tzinfo=None)
-            state = self.state
-            self.print_mail(state)
-            self.state = State()
-            self.state.greeted = state.greeted
-
-    async def _read_mail_text(self) -> None:
+            await self._deliver_mail()
+            return
+        await self._start_fault(rule, END_OF_DATA)
+        if rule.disconnect:
+            # The mail was received, but the client never learns about it.
+            await self._deliver_mail()
+            self.abort()
+        elif rule.reply is not None:
+            self.state.clear()
+            await self._send_fault_reply(rule, *rule.reply)
+        else:
+            await self._deliver_mail()
+            await self._send_fault_reply(rule, SMTPStatus.OK, "OK")
+
+    async def _deliver_mail(self) -> None:
+        self.state.date = datetime.datetime.now(datetime.timezone.utc).replace(
+            tzinfo=None
+        )
+        self.messages += 1
+        if self._rate_limiter is not None:
+            self._rate_limiter.count_bytes(
+                self._client_host,
+                self.state.reverse_path or "",
+                len(self.state.mail_data or ""),
+            )
+        result = self.print_mail(self.state)
+        self.state.clear()
+        if result is not None:
+            # The mail sink is full, wait before reading the next command.
+            self._flush()
+            await result
+
+    async def _read_mail_text(
+        self, disconnect_after: int | None = None
+    ) -> None:
+        received = 0
         while not self.reader.at_eof():
-            line = await self.reader.readuntil(b"\r\n")
+            line = await self._read_line()
             if len(line) > SMTP_TEXT_LINE_LIMIT:
                 raise ValueError()
             if line == b".\r\n":
                 return
+            if disconnect_after is not None:
+                received += len(line)
+                if received >= disconnect_after:
+                    self.abort()
+                    raise UnexpectedEOFError()
             self.state.add_line(line.decode("ascii", "7bit"))
         raise UnexpectedEOFError()
 
+    async def _read_line(self) -> bytes:
+        # Replies to pipelined commands are sent when the last command
+        # of the group was handled (RFC 2920, section 3.2).
+        if len(self._output) >= MAX_PENDING_REPLIES or not has_buffered_data(
+            self.reader
+        ):
+            self._flush()
+        await self._wait_for_write_buffer()
+        line = await self.reader.readuntil(b"\r\n")
+        self.bytes_received += len(line)
+        if self._trace is not None:
+            self._trace.record_inbound(line)
+        return line
+
+    async def _wait_for_write_buffer(self) -> None:
+        """Wait until the client has read enough of the pending replies.
+
+        This is called before reading more input, so that a client that
+        sends commands but does not read the replies can't make the
+        write buffer grow without bounds. Once the buffer is above the
+        transport's high-water mark, drain() waits until it is below the
+        low-water mark.
+        """
+        size = self._transport.get_write_buffer_size()
+        if size > self.max_write_buffer_size:
+            self.max_write_buffer_size = size
+        if size <= self._write_buffer_high:
+            return
+        started = time.monotonic()
+        await self.writer.drain()
+        paused = time.monotonic() - started
+        self.write_paused_time += paused
+        metrics.increment("write_pauses")
+        metrics.observe("write_paused_seconds", paused)
+
     def _write_line_too_long(self) -> None:
         self._write_reply(SMTPStatus.SYNTAX_ERROR, "Line too long.")
 
     def _write_reply(self, code: SMTPStatus, text: str) -> None:
-        full_line = f"{code.value} {text}\r\n"
-        self.writer.write(full_line.encode("ascii"))
+        self._write(encode_reply(code, text))
+
+    def _write(self, data: bytes) -> None:
+        """Queue data to be sent with the next flush."""
+        self.bytes_sent += len(data)
+        if self._trace is not None:
+            self._trace.record_outbound(data)
+        self._output.append(data)
+
+    def _flush(self) -> None:
+        """Send all queued data with a single write."""
+        if self._output:
+            self.writer.writelines(self._output)
+            self._output.clear()
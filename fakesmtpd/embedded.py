@@ -0,0 +1,265 @@
+"""In-process FakeSMTPd server for test suites.
+
+Usage:
+
+    async with FakeSMTPServer() as server:
+        send_mail("127.0.0.1", server.port)
+        await server.wait_for_messages(1)
+        assert server.messages[0].forward_path == ["bar@example.com"]
+        assert server.messages[0].headers.get("Subject") == "Test"
+"""
+
+from __future__ import annotations
+
+import asyncio
+import datetime
+import logging
+from collections.abc import Callable
+from types import TracebackType
+from typing import TYPE_CHECKING, Any
+
+from fakesmtpd.connection import ConnectionHandler, format_peer
+from fakesmtpd.headers import HeaderIndex, scan_headers
+from fakesmtpd.state import State
+
+if TYPE_CHECKING:
+    from email.message import EmailMessage
+
+    from fakesmtpd.policy import RecipientPolicy
+    from fakesmtpd.postprocess import PostProcessor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 5.0
+
+
+class ReceivedMessage:
+    """A mail received by FakeSMTPServer.
+
+    The header fields are indexed when the mail is received. The full
+    MIME structure is only parsed when message is accessed.
+
+    If the server has a post-processor, its results are added to
+    results once they are available; see wait_for_results().
+    """
+
+    __slots__ = (
+        "date",
+        "reverse_path",
+        "forward_path",
+        "mail_data",
+        "headers",
+        "results",
+        "_message",
+        "_processed",
+    )
+
+    def __init__(
+        self,
+        date: datetime.datetime,
+        reverse_path: str,
+        forward_path: list[str],
+        mail_data: str,
+    ) -> None:
+        self.date = date
+        self.reverse_path = reverse_path
+        self.forward_path = forward_path
+        self.mail_data = mail_data
+        self.headers: HeaderIndex = scan_headers(mail_data)
+        self.results: dict[str, Any] = {}
+        self._message: EmailMessage | None = None
+        self._processed: asyncio.Event | None = None
+
+    @property
+    def body(self) -> str:
+        """The mail data after the header section."""
+        return self.mail_data[self.headers.body_offset :]
+
+    @property
+    def message(self) -> EmailMessage:
+        """The mail parsed with the email package, e.g. to access parts."""
+        if self._message is None:
+            from email import message_from_string, policy
+
+            self._message = message_from_string(
+                self.mail_data, policy=policy.default
+            )
+        return self._message
+
+    async def wait_for_results(
+        self, timeout: float = DEFAULT_TIMEOUT
+    ) -> dict[str, Any]:
+        """Wait until the post-processing of this mail has finished.
+
+        If post-processing failed, results stays empty.
+        asyncio.TimeoutError is raised if it doesn't finish within
+        timeout seconds.
+        """
+        if self._processed is not None:
+            await asyncio.wait_for(self._processed.wait(), timeout)
+        return self.results
+
+    @classmethod
+    def from_state(cls, state: State) -> ReceivedMessage:
+        assert state.date is not None
+        assert state.reverse_path is not None
+        assert state.forward_path is not None
+        return cls(
+            state.date,
+            state.reverse_path,
+            list(state.forward_path),
+            state.mail_data or "",
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"<ReceivedMessage from {self.reverse_path!r} "
+            f"to {self.forward_path!r}>"
+        )
+
+
+class FakeSMTPServer:
+    """SMTP server running in the current event loop.
+
+    The server listens on an ephemeral port by default and keeps all
+    received mails in memory. If sink is given, it is called for every
+    received mail as well. The state passed to sink is reused for the
+    next mail, so sink must copy any data it keeps. Several servers can
+    run at the same time.
+
+    If post_processor is given, it is run on every received mail in the
+    background, and the results are added to the ReceivedMessage. The
+    caller is responsible for closing the post-processor.
+
+    If recipient_policy is given, recipients that it doesn't accept are
+    rejected. It can be replaced while the server runs, which affects
+    new connections.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        *,
+        sink: Callable[[State], None] | None = None,
+        post_processor: PostProcessor | None = None,
+        recipient_policy: RecipientPolicy | None = None,
+    ) -> None:
+        self.host = host
+        self.recipient_policy = recipient_policy
+        self._requested_port = port
+        self._sink = sink
+        self._post_processor = post_processor
+        self._processing: set[asyncio.Task[None]] = set()
+        self._messages: list[ReceivedMessage] = []
+        self._new_message = asyncio.Event()
+        self._server: asyncio.Server | None = None
+        self._connections: set[asyncio.Task[None]] = set()
+
+    @property
+    def port(self) -> int:
+        """The port the server is listening on."""
+        if self._server is None:
+            raise RuntimeError("server is not running")
+        port: int = self._server.sockets[0].getsockname()[1]
+        return port
+
+    @property
+    def messages(self) -> list[ReceivedMessage]:
+        """Mails received so far, in order of arrival."""
+        return list(self._messages)
+
+    def clear(self) -> None:
+        """Forget all received mails."""
+        self._messages.clear()
+
+    async def wait_for_messages(
+        self, count: int = 1, timeout: float = DEFAULT_TIMEOUT
+    ) -> list[ReceivedMessage]:
+        """Wait until at least count mails were received.
+
+        asyncio.TimeoutError is raised if that doesn't happen within
+        timeout seconds.
+        """
+
+        async def wait() -> None:
+            while len(self._messages) < count:
+                self._new_message.clear()
+                await self._new_message.wait()
+
+        await asyncio.wait_for(wait(), timeout)
+        return self.messages
+
+    async def start(self) -> None:
+        if self._server is not None:
+            raise RuntimeError("server is already running")
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self._requested_port
+        )
+
+    async def stop(self) -> None:
+        """Stop the server and close all open connections."""
+        if self._server is None:
+            return
+        self._server.close()
+        self._server = None
+        tasks = self._connections | self._processing
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __aenter__(self) -> FakeSMTPServer:
+        await self.start()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        await self.stop()
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        task = asyncio.current_task()
+        assert task is not None
+        self._connections.add(task)
+        try:
+            peer = format_peer(writer.get_extra_info("peername"))
+            handler = ConnectionHandler(
+                reader,
+                writer,
+                self._print_mail,
+                peer=peer,
+                recipient_policy=self.recipient_policy,
+            )
+            await handler.handle()
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    def _print_mail(self, state: State) -> None:
+        message = ReceivedMessage.from_state(state)
+        if self._post_processor is not None:
+            message._processed = asyncio.Event()
+            task = asyncio.create_task(self._post_process(message))
+            self._processing.add(task)
+            task.add_done_callback(self._processing.discard)
+        self._messages.append(message)
+        self._new_message.set()
+        if self._sink is not None:
+            self._sink(state)
+
+    async def _post_process(self, message: ReceivedMessage) -> None:
+        assert self._post_processor is not None
+        assert message._processed is not None
+        try:
+            results = await self._post_processor.process(message.mail_data)
+        except Exception:
+            logger.exception("post-processing failed")
+        else:
+            message.results.update(results)
+        finally:
+            message._processed.set()
@@ -0,0 +1,271 @@
+"""Injection of faults and latency into SMTP sessions.
+
+Fault rules are read from a JSON file containing a list of rules:
+
+    [
+        {
+            "command": "RCPT",
+            "recipient": "*@flaky.example.com",
+            "probability": 0.2,
+            "reply": [451, "Try again later"]
+        },
+        {"command": "END-OF-DATA", "delay": {"uniform": [0.1, 0.5]}},
+        {"command": "DATA", "disconnect_after_bytes": 1000}
+    ]
+
+Each rule applies to an SMTP command, to "END-OF-DATA" (the reply to the
+mail text), or to all of these ("*"). For the first rule that matches a
+command, the server can:
+
+  * wait before replying ("delay"),
+  * send a different reply ("reply") instead of executing the command,
+  * close the connection instead of replying ("disconnect"),
+  * close the connection after receiving part of the mail text
+    ("disconnect_after_bytes", DATA only),
+  * send the reply byte by byte with a pause after each byte ("drip").
+"""
+
+from __future__ import annotations
+
+import fnmatch
+import random
+import re
+from collections.abc import Callable, Iterable, Sequence
+from typing import TYPE_CHECKING, Any
+
+from fakesmtpd.smtp import SMTPStatus
+from fakesmtpd.syntax import parse_receiver, parse_reverse_path
+
+if TYPE_CHECKING:
+    from fakesmtpd.state import State
+
+END_OF_DATA = "END-OF-DATA"
+ANY_COMMAND = "*"
+
+_Sampler = Callable[[], float]
+
+
+def _compile_pattern(pattern: str) -> re.Pattern[str]:
+    return re.compile(fnmatch.translate(pattern), re.IGNORECASE)
+
+
+class FaultRule:
+    """A fault to inject into the reply to a command.
+
+    sender and recipient are glob patterns that are matched against the
+    reverse path and the forward paths of the current transaction. For
+    MAIL and RCPT, the path given in the command is used instead.
+    """
+
+    __slots__ = (
+        "command",
+        "sender",
+        "recipient",
+        "probability",
+        "delay",
+        "reply",
+        "disconnect",
+        "disconnect_after_bytes",
+        "drip",
+    )
+
+    def __init__(
+        self,
+        command: str = ANY_COMMAND,
+        *,
+        sender: str | None = None,
+        recipient: str | None = None,
+        probability: float = 1.0,
+        delay: _Sampler | None = None,
+        reply: tuple[SMTPStatus, str] | None = None,
+        disconnect: bool = False,
+        disconnect_after_bytes: int | None = None,
+        drip: float | None = None,
+    ) -> None:
+        command = command.upper()
+        if not 0.0 <= probability <= 1.0:
+            raise ValueError("probability must be between 0 and 1")
+        if disconnect_after_bytes is not None and command != "DATA":
+            raise ValueError("disconnect_after_bytes requires command DATA")
+        self.command = command
+        self.sender = _compile_pattern(sender) if sender else None
+        self.recipient = _compile_pattern(recipient) if recipient else None
+        self.probability = probability
+        self.delay = delay
+        self.reply = reply
+        self.disconnect = disconnect
+        self.disconnect_after_bytes = disconnect_after_bytes
+        self.drip = drip
+
+    def matches(self, sender: str | None, recipients: Sequence[str]) -> bool:
+        if self.sender is not None and (
+            sender is None or not self.sender.match(sender)
+        ):
+            return False
+        if self.recipient is not None:
+            match = self.recipient.match
+            return any(match(r) for r in recipients)
+        return True
+
+
+class FaultRules:
+    """Rules indexed by the command they apply to."""
+
+    def __init__(self, rules: Iterable[FaultRule] = ()) -> None:
+        self.rules = list(rules)
+        commands = {r.command for r in self.rules} - {ANY_COMMAND}
+        self._any_command = [r for r in self.rules if r.command == ANY_COMMAND]
+        self._by_command = {
+            command: [
+                r for r in self.rules if r.command in (command, ANY_COMMAND)
+            ]
+            for command in commands
+        }
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def match(
+        self, command: str, sender: str | None, recipients: Sequence[str]
+    ) -> FaultRule | None:
+        """Return the first matching rule that is triggered."""
+        for rule in self._by_command.get(command, self._any_command):
+            if not rule.matches(sender, recipients):
+                continue
+            if rule.probability >= 1.0 or random.random() < rule.probability:
+                return rule
+        return None
+
+
+def command_addresses(
+    state: State, command: str, arguments: str
+) -> tuple[str | None, Sequence[str]]:
+    """Return the sender and recipients that rules are matched against."""
+    try:
+        if command == "MAIL" and arguments[:5].upper() == "FROM:":
+            return parse_reverse_path(arguments[5:])[0], ()
+        if command == "RCPT" and arguments[:3].upper() == "TO:":
+            path = parse_receiver(arguments[3:])[0]
+            return state.reverse_path, (path,)
+    except ValueError:
+        pass
+    return state.reverse_path, state.forward_path or ()
+
+
+def load_fault_rules(filename: str) -> FaultRules:
+    """Read fault rules from a JSON file.
+
+    ValueError is raised if the file contains invalid rules.
+    """
+    import json
+
+    with open(filename) as f:
+        data = json.load(f)
+    if not isinstance(data, list):
+        raise ValueError("fault rules must be a list")
+    rules = []
+    for index, item in enumerate(data, 1):
+        try:
+            rules.append(parse_fault_rule(item))
+        except ValueError as exc:
+            raise ValueError(f"rule {index}: {exc}") from None
+    return FaultRules(rules)
+
+
+def parse_fault_rule(data: Any) -> FaultRule:
+    if not isinstance(data, dict):
+        raise ValueError(f"invalid fault rule: {data!r}")
+    data = dict(data)
+    try:
+        command = _get(data, "command", str, ANY_COMMAND)
+        rule = FaultRule(
+            command,
+            sender=_get(data, "sender", str),
+            recipient=_get(data, "recipient", str),
+            probability=_get(data, "probability", (int, float), 1.0),
+            delay=_parse_delay(data.pop("delay", None)),
+            reply=_parse_reply(data.pop("reply", None)),
+            disconnect=_get(data, "disconnect", bool, False),
+            disconnect_after_bytes=_get(data, "disconnect_after_bytes", int),
+            drip=_get(data, "drip", (int, float)),
+        )
+    except (TypeError, ValueError) as exc:
+        raise ValueError(f"invalid fault rule: {exc}") from None
+    if data:
+        raise ValueError(f"unknown fault rule fields: {', '.join(data)}")
+    return rule
+
+
+def _get(
+    data: dict[str, Any],
+    key: str,
+    types: type | tuple[type, ...],
+    default: Any = None,
+) -> Any:
+    value = data.pop(key, default)
+    if value is default:
+        return value
+    if not isinstance(value, types) or (
+        isinstance(value, bool) and types is not bool
+    ):
+        raise ValueError(f"{key}: invalid value {value!r}")
+    return value
+
+
+def _parse_reply(data: Any) -> tuple[SMTPStatus, str] | None:
+    if data is None:
+        return None
+    if (
+        not isinstance(data, list)
+        or len(data) != 2
+        or not isinstance(data[0], int)
+        or not isinstance(data[1], str)
+    ):
+        raise ValueError("reply must be [code, text]")
+    code = SMTPStatus(data[0])
+    if code.value < 400:
+        raise ValueError("reply code must be 4xx or 5xx")
+    return code, data[1]
+
+
+def _parse_delay(data: Any) -> _Sampler | None:
+    """Parse a delay specification.
+
+    The delay is a number of seconds, or an object with one of these
+    distributions: {"uniform": [min, max]}, {"exponential": mean},
+    {"normal": [mean, stddev]}, {"lognormal": [mu, sigma]}. Negative
+    samples are treated as no delay.
+    """
+    if data is None:
+        return None
+    if isinstance(data, (int, float)) and not isinstance(data, bool):
+        if data < 0:
+            raise ValueError("delay must not be negative")
+        seconds = float(data)
+        return lambda: seconds
+    if not isinstance(data, dict) or len(data) != 1:
+        raise ValueError(f"invalid delay: {data!r}")
+    ((name, params),) = data.items()
+    if name == "exponential" and isinstance(params, (int, float)):
+        if params <= 0:
+            raise ValueError("exponential delay: mean must be positive")
+        rate = 1 / params
+        return lambda: random.expovariate(rate)
+    functions: dict[str, Callable[[float, float], float]] = {
+        "uniform": random.uniform,
+        "normal": random.gauss,
+        "lognormal": random.lognormvariate,
+    }
+    if name not in functions or not _is_pair(params):
+        raise ValueError(f"invalid delay: {data!r}")
+    function = functions[name]
+    a, b = params
+    return lambda: max(0.0, function(a, b))
+
+
+def _is_pair(value: Any) -> bool:
+    return (
+        isinstance(value, list)
+        and len(value) == 2
+        and all(isinstance(v, (int, float)) for v in value)
+    )
@@ -0,0 +1,93 @@
+"""Header index for received mails.
+
+scan_headers() reads the header section of a mail once, stopping at the
+first empty line, so that header lookups don't require parsing the mail
+with the email package.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Iterator
+
+
+class HeaderIndex:
+    """The header fields of a mail, indexed by lower-case name.
+
+    Values are unfolded, but not decoded; use decode() for headers that
+    may contain RFC 2047 encoded words. body_offset is the index of the
+    first character of the body in the mail data.
+    """
+
+    __slots__ = ("_fields", "_index", "body_offset")
+
+    def __init__(
+        self, fields: list[tuple[str, str]], body_offset: int
+    ) -> None:
+        self._fields = fields
+        self._index: dict[str, list[str]] = {}
+        for name, value in fields:
+            self._index.setdefault(name.lower(), []).append(value)
+        self.body_offset = body_offset
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and name.lower() in self._index
+
+    def __iter__(self) -> Iterator[tuple[str, str]]:
+        return iter(self._fields)
+
+    def __repr__(self) -> str:
+        return f"<HeaderIndex with {len(self._fields)} fields>"
+
+    def get(self, name: str, default: str | None = None) -> str | None:
+        """Return the value of the first header field called name."""
+        values = self._index.get(name.lower())
+        return values[0] if values else default
+
+    def get_all(self, name: str) -> list[str]:
+        """Return the values of all header fields called name."""
+        return list(self._index.get(name.lower(), ()))
+
+    def decode(self, name: str, default: str | None = None) -> str | None:
+        """Return the first value of name with encoded words decoded."""
+        value = self.get(name)
+        if value is None:
+            return default
+        if "=?" not in value:
+            return value
+        from email.header import decode_header, make_header
+
+        return str(make_header(decode_header(value)))
+
+
+def scan_headers(data: str, linesep: str = "\r\n") -> HeaderIndex:
+    """Index the header section of a mail.
+
+    Lines are separated by linesep: CRLF for mails as received over SMTP,
+    LF for mails read from an mbox file.
+    """
+    if data.startswith(linesep):
+        return HeaderIndex([], len(linesep))
+    end = data.find(linesep + linesep)
+    if end < 0:
+        # Only headers, without an empty line before the (empty) body.
+        header_section = (
+            data[: -len(linesep)] if data.endswith(linesep) else data
+        )
+        body_offset = len(data)
+    else:
+        header_section = data[:end]
+        body_offset = end + 2 * len(linesep)
+    fields: list[tuple[str, str]] = []
+    for line in header_section.split(linesep):
+        if line[:1] in (" ", "\t"):
+            if fields:
+                name, value = fields[-1]
+                fields[-1] = name, f"{value} {line.strip()}"
+            continue
+        name, sep, value = line.partition(":")
+        if sep:
+            fields.append((name.rstrip(), value.strip()))
+    return HeaderIndex(fields, body_offset)
@@ -0,0 +1,134 @@
+"""Addresses the server listens on."""
+
+from __future__ import annotations
+
+from fakesmtpd.metrics import metrics
+
+UNIX_PREFIX = "unix:"
+
+
+class Listener:
+    """A TCP or Unix domain socket address to accept connections on.
+
+    Connections are counted per listener. If max_connections is given,
+    further connections are rejected while that many are open. Metrics
+    are labelled with the listener's name. If tls is True, connections
+    start with a TLS handshake (implicit TLS).
+    """
+
+    def __init__(
+        self,
+        name: str | None = None,
+        *,
+        host: str | None = None,
+        port: int | None = None,
+        path: str | None = None,
+        max_connections: int | None = None,
+        tls: bool = False,
+    ) -> None:
+        if (path is None) == (port is None):
+            raise ValueError("either a port or a path is required")
+        if max_connections is not None and max_connections < 1:
+            raise ValueError("max-connections must be positive")
+        self.host = host
+        self.port = port
+        self.path = path
+        self.max_connections = max_connections
+        self.tls = tls
+        self.name = name or self.address
+        self.open_connections = 0
+        self._labels = {"listener": self.name}
+
+    @property
+    def address(self) -> str:
+        if self.path is not None:
+            return f"{UNIX_PREFIX}{self.path}"
+        host = self.host or ""
+        if ":" in host:
+            host = f"[{host}]"
+        return f"{host}:{self.port}"
+
+    def __repr__(self) -> str:
+        return f"<Listener {self.name!r} on {self.address}>"
+
+    def acquire(self) -> bool:
+        """Count a new connection.
+
+        Return False if the connection limit is reached. In this case,
+        the connection is not counted.
+        """
+        if (
+            self.max_connections is not None
+            and self.open_connections >= self.max_connections
+        ):
+            metrics.increment("connections_rejected", labels=self._labels)
+            return False
+        self.open_connections += 1
+        metrics.increment("connections_accepted", labels=self._labels)
+        metrics.set_gauge(
+            "connections_open", self.open_connections, labels=self._labels
+        )
+        return True
+
+    def release(self) -> None:
+        self.open_connections -= 1
+        metrics.set_gauge(
+            "connections_open", self.open_connections, labels=self._labels
+        )
+
+
+def parse_listener(spec: str) -> Listener:
+    """Parse a listener specification.
+
+    The specification is an address, optionally followed by
+    comma-separated options. The address is HOST:PORT, [IPV6]:PORT, or
+    unix:PATH. The options are name=NAME, max-connections=N, and tls:
+
+        [::1]:2525,name=local,max-connections=100
+        0.0.0.0:465,tls
+    """
+    address, *options = spec.split(",")
+    name: str | None = None
+    max_connections: int | None = None
+    tls = False
+    for option in options:
+        if option == "tls":
+            tls = True
+            continue
+        key, sep, value = option.partition("=")
+        if not sep or not value:
+            raise ValueError(f"invalid listener option: {option}")
+        if key == "name":
+            name = value
+        elif key == "max-connections":
+            max_connections = _parse_int(value, key)
+        else:
+            raise ValueError(f"unknown listener option: {key}")
+    if address.startswith(UNIX_PREFIX):
+        path = address[len(UNIX_PREFIX) :]
+        if not path:
+            raise ValueError("missing socket path")
+        return Listener(
+            name, path=path, max_connections=max_connections, tls=tls
+        )
+    host, sep, port = address.rpartition(":")
+    if not sep or not host:
+        raise ValueError(f"invalid listen address: {address}")
+    if host.startswith("[") and host.endswith("]"):
+        host = host[1:-1]
+    elif ":" in host:
+        raise ValueError(f"IPv6 addresses must be in brackets: {address}")
+    return Listener(
+        name,
+        host=host,
+        port=_parse_int(port, "port"),
+        max_connections=max_connections,
+        tls=tls,
+    )
+
+
+def _parse_int(value: str, name: str) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"invalid {name}: {value}") from None
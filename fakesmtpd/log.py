@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import copy
+import datetime
+import itertools
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from typing import Any, TextIO
+
+# Attributes that ConnectionHandler attaches to log records using "extra".
+CONTEXT_FIELDS = (
+    "session",
+    "peer",
+    "commands",
+    "messages",
+    "bytes_received",
+    "bytes_sent",
+    "duration",
+    "max_write_buffer_size",
+    "write_paused_time",
+)
+
+_session_prefix = f"{int(time.time()):x}"
+_session_counter = itertools.count(1)
+_command_sample_rate = 1.0
+
+
+def new_session_id() -> str:
+    """Return a process-wide unique, short session ID."""
+    return f"{_session_prefix}-{next(_session_counter):x}"
+
+
+def set_command_sample_rate(rate: float) -> None:
+    """Set the fraction of sessions whose commands are logged."""
+    if not 0.0 <= rate <= 1.0:
+        raise ValueError("sample rate must be between 0 and 1")
+    global _command_sample_rate
+    _command_sample_rate = rate
+
+
+def sample_command_log(logger: logging.Logger) -> bool:
+    """Decide whether to log the commands of a new session.
+
+    The decision is made once per session, so that sampled sessions are
+    logged completely and all other sessions pay only for a boolean check
+    per command.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return False
+    if _command_sample_rate >= 1.0:
+        return True
+    import random
+
+    return random.random() < _command_sample_rate
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable log format that includes the session context."""
+
+    def __init__(self) -> None:
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        line = super().formatMessage(record)
+        session = getattr(record, "session", None)
+        if session is None:
+            return line
+        return f"{line} [session={session} peer={getattr(record, 'peer', '')}]"
+
+
+class JSONFormatter(logging.Formatter):
+    """Format each log record as a single-line JSON object."""
+
+    def __init__(self) -> None:
+        import json
+
+        super().__init__()
+        self._encoder = json.JSONEncoder(separators=(",", ":"))
+
+    def format(self, record: logging.LogRecord) -> str:
+        data: dict[str, Any] = {
+            "time": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exception"] = record.exc_text
+        return self._encoder.encode(data)
+
+
+_exception_formatter = logging.Formatter()
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that leaves formatting to the listener thread.
+
+    The standard QueueHandler formats the message in the logging thread.
+    fakesmtpd only passes immutable arguments to its log calls, so its
+    records are enqueued unchanged. Records of other loggers may have
+    mutable arguments, so their message and exception are rendered here.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.name == "fakesmtpd" or record.name.startswith("fakesmtpd."):
+            return record
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(
+                record.exc_info
+            )
+            record.exc_info = None
+        return record
+
+
+def configure_logging(
+    log_format: str = "text",
+    level: int | str = logging.INFO,
+    *,
+    sample_rate: float = 1.0,
+    stream: TextIO | None = None,
+) -> logging.handlers.QueueListener:
+    """Set up non-blocking logging for the server.
+
+    Log records are passed through a queue to a listener thread that
+    formats and writes them to stream (stderr by default). The returned
+    listener is already started and must be stopped on shutdown to flush
+    pending records.
+    """
+    formatter: logging.Formatter
+    if log_format == "json":
+        formatter = JSONFormatter()
+    elif log_format == "text":
+        formatter = TextFormatter()
+    else:
+        raise ValueError(f"unknown log format: {log_format}")
+    set_command_sample_rate(sample_rate)
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(formatter)
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(log_queue, output)
+    listener.start()
+    return listener
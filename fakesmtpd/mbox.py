@@ -1,10 +1,25 @@
-import sys
-from typing import Any
+from __future__ import annotations
 
-from typing_extensions import Protocol
+import datetime
+import errno
+import mmap
+import os
+import sys
+import threading
+import time
+from array import array
+from collections.abc import Iterator
+from typing import IO, TYPE_CHECKING, Any, Protocol
 
+from fakesmtpd.headers import HeaderIndex, scan_headers
 from fakesmtpd.state import State
 
+if TYPE_CHECKING:
+    from fakesmtpd.bodystore import BodyStore
+
+RECEIVER_HEADER = "X-FakeSMTPd-Receiver"
+BODY_HEADER = "X-FakeSMTPd-Body"
+
 
 class _MBoxWriter(Protocol):
     def write(self, __s: str) -> Any: ...
@@ -21,13 +36,486 @@ def print_mbox_mail(filename: str, state: State) -> None:
             write_mbox_mail(f, state)
 
 
-def write_mbox_mail(stream: _MBoxWriter, state: State) -> None:
+class MboxSink:
+    """Append mails to an mbox file that is kept open.
+
+    If filename is "-", mails are printed to stdout. If body_store is
+    given, mail bodies are stored there instead of in the mbox file.
+    Mails can be written from a worker thread.
+    """
+
+    def __init__(
+        self, filename: str, *, body_store: BodyStore | None = None
+    ) -> None:
+        self.filename = filename
+        self.body_store = body_store
+        self._file: IO[str] | None = None
+        self._lock = threading.Lock()
+
+    def __call__(self, state: State) -> None:
+        with self._lock:
+            write_mbox_mail(self._open(), state, body_store=self.body_store)
+
+    def _open(self) -> IO[str]:
+        if self._file is None:
+            if self.filename == "-":
+                self._file = sys.stdout
+            else:
+                self._file = open(self.filename, "a")
+        return self._file
+
+    def flush(self) -> None:
+        """Flush written mails and commit them to disk."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._file is None:
+            return
+        self._file.flush()
+        if self._file is not sys.stdout:
+            try:
+                os.fsync(self._file.fileno())
+            except OSError as exc:
+                # Pipes and devices like /dev/null can't be synced.
+                if exc.errno != errno.EINVAL:
+                    raise
+
+    def reopen(self) -> None:
+        """Close the file, so that it is reopened for the next mail.
+
+        This is used when the file was moved away, e.g. by logrotate.
+        """
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is None:
+                return
+            self._flush()
+            if self._file is not sys.stdout:
+                self._file.close()
+            self._file = None
+
+
+def write_mbox_mail(
+    stream: _MBoxWriter, state: State, *, body_store: BodyStore | None = None
+) -> None:
+    """Write a mail in RFC 4155 default mbox format.
+
+    If body_store is given, the body of the mail is stored there and
+    replaced by an X-FakeSMTPd-Body field with its hash, which follows
+    the X-FakeSMTPd-Receiver fields. Mails without a body are written
+    unchanged.
+    """
     assert state.date is not None
     assert state.forward_path is not None
     assert state.mail_data is not None
+    data = state.mail_data.replace("\r\n", "\n")
     stream.write(f"From {state.reverse_path} {state.date.ctime()}\n")
     for receiver in state.forward_path:
-        stream.write(f"X-FakeSMTPd-Receiver: {receiver}\n")
-    stream.write(state.mail_data.replace("\r\n", "\n"))
+        stream.write(f"{RECEIVER_HEADER}: {receiver}\n")
+    if body_store is not None:
+        body_offset = _body_offset(data)
+        if body_offset < len(data):
+            digest = body_store.put(data[body_offset:].encode("utf-8"))
+            stream.write(f"{BODY_HEADER}: {digest}\n")
+            data = data[:body_offset]
+    stream.write(data)
     stream.write("\n")
     stream.flush()
+
+
+def stored_body(mail_data: str) -> bytes | None:
+    """Return the body of a mail as write_mbox_mail() stores it.
+
+    None is returned if the mail has no body.
+    """
+    data = mail_data.replace("\r\n", "\n")
+    body_offset = _body_offset(data)
+    if body_offset < len(data):
+        return data[body_offset:].encode("utf-8")
+    return None
+
+
+def _body_offset(data: str) -> int:
+    if data.startswith("\n"):
+        return 1
+    end = data.find("\n\n")
+    return len(data) if end < 0 else end + 2
+
+
+_SEPARATOR = b"\n\nFrom "
+_RECEIVER_PREFIX = f"{RECEIVER_HEADER}: ".encode("ascii")
+_BODY_PREFIX = f"{BODY_HEADER}: ".encode("ascii")
+_MONTHS = {
+    month: i
+    for i, month in enumerate(
+        [
+            b"Jan",
+            b"Feb",
+            b"Mar",
+            b"Apr",
+            b"May",
+            b"Jun",
+            b"Jul",
+            b"Aug",
+            b"Sep",
+            b"Oct",
+            b"Nov",
+            b"Dec",
+        ],
+        start=1,
+    )
+}
+
+
+class MboxMessage:
+    """A mail read from an mbox file written by FakeSMTPd.
+
+    The envelope is parsed when the message is read. The mail data is
+    decoded on first access and uses LF line endings, as stored in the
+    file. It must be accessed before the reader is closed.
+
+    body_hash is the hash of the body if it was written to a body store.
+    In this case, mail_data only contains the headers, unless the reader
+    was created with the body store.
+    """
+
+    __slots__ = (
+        "offset",
+        "reverse_path",
+        "forward_path",
+        "date",
+        "body_hash",
+        "_body_store",
+        "_source",
+        "_data_start",
+        "_data_end",
+        "_mail_data",
+        "_headers",
+    )
+
+    def __init__(
+        self,
+        offset: int,
+        reverse_path: str,
+        forward_path: list[str],
+        date: datetime.datetime,
+        source: mmap.mmap,
+        data_start: int,
+        data_end: int,
+        body_hash: str | None = None,
+        body_store: BodyStore | None = None,
+    ) -> None:
+        self.offset = offset
+        self.reverse_path = reverse_path
+        self.forward_path = forward_path
+        self.date = date
+        self.body_hash = body_hash
+        self._body_store = body_store
+        self._source = source
+        self._data_start = data_start
+        self._data_end = data_end
+        self._mail_data: str | None = None
+        self._headers: HeaderIndex | None = None
+
+    def __repr__(self) -> str:
+        return (
+            f"<MboxMessage at {self.offset} from {self.reverse_path!r} "
+            f"to {self.forward_path!r}>"
+        )
+
+    @property
+    def size(self) -> int:
+        """Size of the mail data in the mbox file in bytes."""
+        return self._data_end - self._data_start
+
+    @property
+    def mail_data(self) -> str:
+        if self._mail_data is None:
+            raw = self._source[self._data_start : self._data_end]
+            if self.body_hash is not None and self._body_store is not None:
+                raw += self._body_store.get(self.body_hash)
+            self._mail_data = raw.decode("utf-8", "replace")
+        return self._mail_data
+
+    @property
+    def headers(self) -> HeaderIndex:
+        if self._headers is None:
+            self._headers = scan_headers(self.mail_data, "\n")
+        return self._headers
+
+
+class MboxReader:
+    """Read mails from an mbox file written by FakeSMTPd.
+
+    The file is memory-mapped. Messages start at "From " lines that
+    follow an empty line and have a valid envelope, and their offsets are
+    kept in an index, which is extended as the file is read, so that
+    later iterations and lookups by position don't search the file again.
+    Data appended to the file is picked up by refresh() and tail().
+
+    Since FakeSMTPd doesn't quote "From " lines in mail bodies, a body
+    line like "From x Sun Jun  4 14:34:15 2017" after an empty line is
+    read as the start of a new message.
+
+    If the file was written with a body store, pass it as body_store to
+    include the stored bodies in the mail data.
+    """
+
+    def __init__(
+        self, filename: str, *, body_store: BodyStore | None = None
+    ) -> None:
+        self.filename = filename
+        self.body_store = body_store
+        self._file: IO[bytes] | None = None
+        self._map: mmap.mmap | None = None
+        self._size = 0
+        self._generation = 0
+        self._offsets = array("Q")
+        self._scan_pos = 0
+
+    def __enter__(self) -> MboxReader:
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._file = None
+        self._map = None
+        self._size = 0
+        self._generation += 1
+        self._offsets = array("Q")
+        self._scan_pos = 0
+
+    def refresh(self) -> bool:
+        """Map data appended to the file since the last call.
+
+        If the file was truncated or replaced, e.g. by logrotate, the new
+        file is read from the start. Return whether the data changed.
+        """
+        if self._file is not None and self._was_replaced(self._file):
+            self.close()
+        if self._file is None:
+            self._file = open(self.filename, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size == self._size:
+            return False
+        # Messages already read keep a reference to the old map.
+        self._map = mmap.mmap(
+            self._file.fileno(), size, access=mmap.ACCESS_READ
+        )
+        self._size = size
+        return True
+
+    def _was_replaced(self, f: IO[bytes]) -> bool:
+        current = os.fstat(f.fileno())
+        if current.st_size < self._size:
+            return True
+        try:
+            st = os.stat(self.filename)
+        except FileNotFoundError:
+            # Moved away, but not recreated yet.
+            return False
+        return (st.st_dev, st.st_ino) != (current.st_dev, current.st_ino)
+
+    @property
+    def offsets(self) -> list[int]:
+        """Byte offsets of all messages in the file."""
+        self._scan_all()
+        return self._offsets.tolist()
+
+    def __len__(self) -> int:
+        self._scan_all()
+        return len(self._offsets)
+
+    def __getitem__(self, index: int) -> MboxMessage:
+        if index < 0:
+            index += len(self)
+        else:
+            self._ensure_mapped()
+            while len(self._offsets) <= index + 1 and self._scan_next():
+                pass
+        if not 0 <= index < len(self._offsets):
+            raise IndexError("message index out of range")
+        return self._message(index)
+
+    def __iter__(self) -> Iterator[MboxMessage]:
+        """Yield the messages in the file, searching it as needed."""
+        self._ensure_mapped()
+        generation = self._generation
+        i = 0
+        while True:
+            if generation != self._generation:
+                raise RuntimeError("mbox file was replaced during iteration")
+            while len(self._offsets) <= i + 1 and self._scan_next():
+                pass
+            if i >= len(self._offsets):
+                return
+            yield self._message(i)
+            i += 1
+
+    def tail(
+        self, interval: float = 1.0, *, from_start: bool = False
+    ) -> Iterator[MboxMessage]:
+        """Yield messages as they are appended to the file.
+
+        The file is checked for new data every interval seconds, and
+        waited for if it doesn't exist yet. Unless from_start is true,
+        messages already in the file are skipped. The last message in the
+        file is only yielded once the file hasn't changed for one
+        interval, since it may be incomplete. This never returns.
+        """
+        # Skip existing messages now, not on the first call to next().
+        changed = self._refresh_if_exists()
+        self._scan_mapped()
+        start = 0 if from_start else len(self._offsets)
+        return self._tail(interval, start, changed)
+
+    def _tail(
+        self, interval: float, i: int, changed: bool
+    ) -> Iterator[MboxMessage]:
+        generation = self._generation
+        while True:
+            if generation != self._generation:
+                generation = self._generation
+                i = 0
+            self._scan_mapped()
+            complete = len(self._offsets)
+            if changed or not self._ends_with_message():
+                # The last message may still be written.
+                complete -= 1
+            while i < complete:
+                yield self._message(i)
+                i += 1
+            time.sleep(interval)
+            changed = self._refresh_if_exists()
+
+    def _refresh_if_exists(self) -> bool:
+        try:
+            return self.refresh()
+        except FileNotFoundError:
+            return False
+
+    def _ensure_mapped(self) -> None:
+        if self._file is None:
+            self.refresh()
+
+    def _ends_with_message(self) -> bool:
+        return self._map is not None and self._map[-2:] == b"\n\n"
+
+    def _scan_all(self) -> None:
+        self._ensure_mapped()
+        self._scan_mapped()
+
+    def _scan_mapped(self) -> None:
+        while self._scan_next():
+            pass
+
+    def _scan_next(self) -> bool:
+        """Add the next message to the index.
+
+        Return False if there are no further messages in the mapped data.
+        """
+        data = self._map
+        if data is None:
+            return False
+        pos = self._scan_pos
+        while True:
+            if pos == 0 and data[:5] == b"From ":
+                start = 0
+            else:
+                found = data.find(_SEPARATOR, pos)
+                if found < 0:
+                    # A separator may be cut off at the end of the data.
+                    self._scan_pos = max(pos, self._size - len(_SEPARATOR) + 1)
+                    return False
+                start = found + 2
+            eol = data.find(b"\n", start)
+            if eol < 0:
+                # Incomplete "From " line, search again after a refresh.
+                self._scan_pos = pos if start == 0 else start - 2
+                return False
+            pos = eol
+            if _parse_from_line(data[start:eol]) is not None:
+                self._offsets.append(start)
+                self._scan_pos = pos
+                return True
+
+    def _message(self, index: int) -> MboxMessage:
+        data = self._map
+        assert data is not None
+        start = self._offsets[index]
+        if index + 1 < len(self._offsets):
+            # Don't include the empty line before the next "From " line.
+            end = self._offsets[index + 1] - 1
+        else:
+            end = self._size - 1 if data[-2:] == b"\n\n" else self._size
+        eol = data.find(b"\n", start, end)
+        envelope = _parse_from_line(data[start:eol])
+        assert envelope is not None
+        reverse_path, date = envelope
+        forward_path: list[str] = []
+        pos = eol + 1
+        prefix_length = len(_RECEIVER_PREFIX)
+        while data[pos : pos + prefix_length] == _RECEIVER_PREFIX:
+            eol = data.find(b"\n", pos, end)
+            if eol < 0:
+                eol = end
+            receiver = data[pos + prefix_length : eol]
+            forward_path.append(receiver.decode("utf-8", "replace"))
+            pos = eol + 1
+        body_hash = None
+        if data[pos : pos + len(_BODY_PREFIX)] == _BODY_PREFIX:
+            eol = data.find(b"\n", pos, end)
+            if eol < 0:
+                eol = end
+            body_hash = data[pos + len(_BODY_PREFIX) : eol].decode(
+                "ascii", "replace"
+            )
+            pos = eol + 1
+        return MboxMessage(
+            start,
+            reverse_path,
+            forward_path,
+            date,
+            data,
+            min(pos, end),
+            end,
+            body_hash,
+            self.body_store,
+        )
+
+
+def _parse_from_line(line: bytes) -> tuple[str, datetime.datetime] | None:
+    """Parse a "From <reverse path> <ctime date>" line.
+
+    The reverse path may be empty, so the date is parsed from the end.
+    """
+    if len(line) < 30 or line[-25:-24] != b" ":
+        return None
+    date = line[-24:]
+    month = _MONTHS.get(date[4:7])
+    if month is None or date[13:14] != b":" or date[16:17] != b":":
+        return None
+    try:
+        parsed = datetime.datetime(
+            int(date[20:24]),
+            month,
+            int(date[8:10]),
+            int(date[11:13]),
+            int(date[14:16]),
+            int(date[17:19]),
+        )
+    except ValueError:
+        return None
+    return line[5:-25].decode("utf-8", "replace"), parsed
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+from collections.abc import Mapping
+from typing import Any
+
+
+def metric_name(name: str, labels: Mapping[str, str] | None = None) -> str:
+    """Return the metric key for a name and optional labels."""
+    if not labels:
+        return name
+    label_str = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+
+class Summary:
+    """Count, sum and maximum of observed values."""
+
+    __slots__ = ("count", "total", "maximum")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+
+    def as_dict(self) -> dict[str, float]:
+        return {"count": self.count, "sum": self.total, "max": self.maximum}
+
+
+class Metrics:
+    """Process-wide counters, gauges, summaries, and informational labels.
+
+    All operations are plain dictionary updates, so recording metrics is
+    cheap enough to do on every command.
+    """
+
+    def __init__(self) -> None:
+        self.counters: dict[str, float] = {}
+        self.gauges: dict[str, float] = {}
+        self.summaries: dict[str, Summary] = {}
+        self.info: dict[str, str] = {}
+
+    def increment(
+        self,
+        name: str,
+        value: float = 1,
+        labels: Mapping[str, str] | None = None,
+    ) -> None:
+        key = metric_name(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(
+        self,
+        name: str,
+        value: float,
+        labels: Mapping[str, str] | None = None,
+    ) -> None:
+        self.gauges[metric_name(name, labels)] = value
+
+    def add_to_gauge(
+        self,
+        name: str,
+        value: float,
+        labels: Mapping[str, str] | None = None,
+    ) -> None:
+        key = metric_name(name, labels)
+        self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        labels: Mapping[str, str] | None = None,
+    ) -> None:
+        key = metric_name(name, labels)
+        try:
+            summary = self.summaries[key]
+        except KeyError:
+            summary = self.summaries[key] = Summary()
+        summary.observe(value)
+
+    def set_info(self, name: str, value: str) -> None:
+        self.info[name] = value
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "info": dict(self.info),
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "summaries": {k: s.as_dict() for k, s in self.summaries.items()},
+        }
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.gauges.clear()
+        self.summaries.clear()
+        self.info.clear()
+
+
+metrics = Metrics()
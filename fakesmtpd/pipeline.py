@@ -0,0 +1,206 @@
+"""Fan-out of received mails to several sinks.
+
+Each sink runs behind its own bounded queue and worker task, so that a
+slow sink delays neither the SMTP replies nor the other sinks.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from contextlib import suppress
+
+from fakesmtpd.metrics import metrics
+from fakesmtpd.state import State
+
+logger = logging.getLogger(__name__)
+
+BLOCK = "block"
+DROP = "drop"
+POLICIES = (BLOCK, DROP)
+
+DEFAULT_QUEUE_SIZE = 1000
+
+MailSink = Callable[[State], "Awaitable[None] | None"]
+
+
+class SinkWorker:
+    """A mail sink with its own queue and worker task.
+
+    If threaded is true, the sink is called in a worker thread, so that
+    it may block, e.g. to write to a file. Otherwise, it is called in
+    the event loop and awaited if it returns an awaitable.
+
+    If the queue is full, the "block" policy makes the session wait
+    until there is room again, before it reads the next command. The
+    "drop" policy drops the mail for this sink.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        sink: MailSink,
+        *,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        policy: str = BLOCK,
+        threaded: bool = True,
+    ) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"unknown sink policy: {policy}")
+        self.name = name
+        self.sink = sink
+        self.policy = policy
+        self.threaded = threaded
+        self._labels = {"sink": name}
+        self._queue: asyncio.Queue[tuple[State, float]] = asyncio.Queue(
+            queue_size
+        )
+        self._task: asyncio.Task[None] | None = None
+
+    def __len__(self) -> int:
+        """Number of queued mails."""
+        return self._queue.qsize()
+
+    def submit(self, state: State) -> Awaitable[None] | None:
+        """Queue a mail for delivery.
+
+        If the queue is full and the policy is "block", an awaitable is
+        returned that finishes once the mail was queued.
+        """
+        self._start()
+        item = (state, time.perf_counter())
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.policy == DROP:
+                metrics.increment("sink_dropped", labels=self._labels)
+                return None
+            metrics.increment("sink_blocked", labels=self._labels)
+            return self._put(item)
+        self._update_queue_length()
+        return None
+
+    async def _put(self, item: tuple[State, float]) -> None:
+        await self._queue.put(item)
+        self._update_queue_length()
+
+    def _update_queue_length(self) -> None:
+        metrics.set_gauge(
+            "sink_queue_length", self._queue.qsize(), labels=self._labels
+        )
+
+    def _start(self) -> None:
+        if self._task is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Mails are delivered by close().
+            return
+        self._task = loop.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            state, queued_at = await self._queue.get()
+            self._update_queue_length()
+            try:
+                await self._deliver(state)
+            finally:
+                self._queue.task_done()
+            metrics.observe(
+                "sink_latency_seconds",
+                time.perf_counter() - queued_at,
+                labels=self._labels,
+            )
+
+    async def _deliver(self, state: State) -> None:
+        try:
+            if self.threaded:
+                await asyncio.to_thread(self.sink, state)
+            else:
+                result = self.sink(state)
+                if result is not None:
+                    await result
+        except Exception:
+            metrics.increment("sink_errors", labels=self._labels)
+            logger.exception("mail sink %s failed", self.name)
+
+    async def aclose(self, timeout: float | None = None) -> None:
+        """Wait until all queued mails were delivered, then stop.
+
+        Mails that are still queued after timeout seconds are delivered
+        by close(), if the sink is threaded.
+        """
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "mail sink %s did not finish, %d mails queued",
+                self.name,
+                self._queue.qsize(),
+            )
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+    def close(self) -> None:
+        """Deliver queued mails synchronously, without the event loop.
+
+        Mails for sinks that are not threaded are dropped.
+        """
+        while True:
+            try:
+                state, _ = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            self._queue.task_done()
+            if not self.threaded:
+                metrics.increment("sink_dropped", labels=self._labels)
+                continue
+            try:
+                self.sink(state)
+            except Exception:
+                metrics.increment("sink_errors", labels=self._labels)
+                logger.exception("mail sink %s failed", self.name)
+        self._update_queue_length()
+
+
+class SinkPipeline:
+    """Deliver each received mail to several sinks.
+
+    A pipeline can be used as the print_mail function of a connection
+    handler. The state is copied once and shared by all sinks, which
+    must not modify it.
+    """
+
+    def __init__(self, workers: Iterable[SinkWorker]) -> None:
+        self.workers = list(workers)
+
+    def __call__(self, state: State) -> Awaitable[None] | None:
+        copy = state.copy()
+        waiting = [
+            aw
+            for aw in (worker.submit(copy) for worker in self.workers)
+            if aw is not None
+        ]
+        return _wait_all(waiting) if waiting else None
+
+    async def aclose(self, timeout: float | None = None) -> None:
+        """Wait until all sinks delivered their queued mails."""
+        await asyncio.gather(
+            *(worker.aclose(timeout) for worker in self.workers)
+        )
+
+    def close(self) -> None:
+        for worker in self.workers:
+            worker.close()
+
+
+async def _wait_all(awaitables: list[Awaitable[None]]) -> None:
+    for aw in awaitables:
+        await aw
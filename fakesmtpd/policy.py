@@ -0,0 +1,165 @@
+"""Tables of recipients that the server accepts.
+
+A recipient policy is read from a text file with one rule per line:
+
+    # Accept all users of example.com, except bob.
+    example.com
+    !bob@example.com
+    # Accept a single user of example.org.
+    alice@example.org
+    # Accept all subdomains of example.net, but not example.net itself.
+    *.example.net
+
+A rule is an address, a domain, or "*." followed by a domain, which
+matches all subdomains of that domain. A single "*" matches all
+recipients. Rules starting with "!" reject the recipients they match.
+Empty lines and lines starting with "#" are ignored.
+
+Addresses are looked up in a hash table, domains in a trie of domain
+labels, so that the time of a lookup depends on the number of labels of
+the address, not on the size of the table. An address rule takes
+precedence over domain rules, and a domain rule over wildcard rules of
+its parent domains. Recipients that no rule matches are rejected.
+
+"Postmaster" is always accepted, and so is "postmaster@DOMAIN" for the
+domains of the server (RFC 5321, section 4.5.1), even if a rule rejects
+it. These are the local domains passed to the policy, usually the host
+name, and all domains that have accepted recipients.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Iterable
+
+WILDCARD = "*"
+POSTMASTER = "postmaster"
+
+
+class _Node:
+    """A domain in the trie of domain labels.
+
+    domain is the verdict for the domain itself, subdomains the verdict
+    for all its subdomains, or None if there is no rule.
+    """
+
+    __slots__ = ("children", "domain", "subdomains")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _Node] = {}
+        self.domain: bool | None = None
+        self.subdomains: bool | None = None
+
+
+class RecipientPolicy:
+    """Rules that decide which recipients are accepted.
+
+    local_domains are the domains of the server, whose postmaster is
+    always accepted.
+    """
+
+    def __init__(
+        self, rules: Iterable[str] = (), *, local_domains: Iterable[str] = ()
+    ) -> None:
+        self._addresses: dict[str, bool] = {}
+        self._root = _Node()
+        self._rules = 0
+        self._local_domains = {d.lower() for d in local_domains}
+        for rule in rules:
+            self.add(rule)
+
+    def __len__(self) -> int:
+        """Number of rules added."""
+        return self._rules
+
+    def add(self, rule: str) -> None:
+        """Add a rule.
+
+        If there already is a rule for the same address or domain, it is
+        replaced. ValueError is raised if the rule is invalid.
+        """
+        accept = not rule.startswith("!")
+        pattern = (rule if accept else rule[1:]).strip().lower()
+        if pattern == WILDCARD:
+            self._root.subdomains = accept
+        elif "@" in pattern:
+            local_part, _, domain = pattern.rpartition("@")
+            if not local_part or not domain or WILDCARD in pattern:
+                raise ValueError(f"invalid recipient rule: {rule}")
+            self._addresses[pattern] = accept
+            if accept:
+                self._local_domains.add(domain)
+        else:
+            subdomains = pattern.startswith("*.")
+            if subdomains:
+                pattern = pattern[2:]
+            if not pattern or WILDCARD in pattern:
+                raise ValueError(f"invalid recipient rule: {rule}")
+            node = self._root
+            for label in _labels(pattern):
+                node = node.children.setdefault(label, _Node())
+            if subdomains:
+                node.subdomains = accept
+            else:
+                node.domain = accept
+        self._rules += 1
+
+    def accepts(self, address: str) -> bool:
+        """Return whether mails to address are accepted."""
+        address = address.lower()
+        local_part, at, domain = address.rpartition("@")
+        if not at:
+            return address == POSTMASTER
+        if local_part == POSTMASTER and (
+            domain in self._local_domains or self._accepts_domain(domain)
+        ):
+            return True
+        verdict = self._addresses.get(address)
+        if verdict is not None:
+            return verdict
+        return self._accepts_domain(domain)
+
+    def _accepts_domain(self, domain: str) -> bool:
+        """Return whether the domain rules accept domain."""
+        node = self._root
+        verdict = None
+        for label in _labels(domain):
+            # The wildcard of a domain matches all domains below it.
+            if node.subdomains is not None:
+                verdict = node.subdomains
+            child = node.children.get(label)
+            if child is None:
+                return bool(verdict)
+            node = child
+        if node.domain is not None:
+            return node.domain
+        return bool(verdict)
+
+
+def _labels(domain: str) -> list[str]:
+    """Return the labels of a domain, starting with the top-level domain."""
+    if domain.startswith("["):
+        # Address literals are not split.
+        return [domain]
+    labels = domain.split(".")
+    labels.reverse()
+    return labels
+
+
+def load_recipient_policy(
+    filename: str, *, local_domains: Iterable[str] = ()
+) -> RecipientPolicy:
+    """Read a recipient policy from a text file.
+
+    ValueError is raised if the file contains invalid rules.
+    """
+    policy = RecipientPolicy(local_domains=local_domains)
+    with open(filename) as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                policy.add(line)
+            except ValueError as exc:
+                raise ValueError(f"line {lineno}: {exc}") from None
+    return policy
@@ -0,0 +1,173 @@
+"""CPU-bound post-processing of received mails in a process pool.
+
+Processors are functions that take the mail data as a memoryview and
+return a picklable result, e.g. a hash or a summary of the MIME
+structure. They run in worker processes, so that they don't block the
+event loop that serves SMTP sessions. Large mails are passed to the
+workers in shared memory instead of being pickled.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable, Mapping
+from functools import partial
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from fakesmtpd.metrics import metrics
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+    from fakesmtpd.state import State
+
+logger = logging.getLogger(__name__)
+
+Processor = Callable[[memoryview], Any]
+
+# Mails of at least this size are passed to the workers in shared
+# memory. For smaller mails, pickling is cheaper than creating a shared
+# memory block.
+DEFAULT_SHARED_MEMORY_THRESHOLD = 64 * 1024
+
+
+class _SharedMail(NamedTuple):
+    name: str
+    size: int
+
+
+class PostProcessor:
+    """Run processors on received mails in a process pool.
+
+    processors maps result names to processor functions. They must be
+    picklable, i.e. defined at module level. The pool is started on
+    first use and shut down by close().
+    """
+
+    def __init__(
+        self,
+        processors: Mapping[str, Processor],
+        *,
+        max_workers: int | None = None,
+        shared_memory_threshold: int = DEFAULT_SHARED_MEMORY_THRESHOLD,
+    ) -> None:
+        self.processors = dict(processors)
+        self.max_workers = max_workers
+        self.shared_memory_threshold = shared_memory_threshold
+        self._pool: ProcessPoolExecutor | None = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._pool = ProcessPoolExecutor(self.max_workers)
+        return self._pool
+
+    async def process(self, mail_data: str | bytes) -> dict[str, Any]:
+        """Run all processors on a mail and return their results.
+
+        If a processor raises an exception, it is raised here.
+        """
+        if isinstance(mail_data, str):
+            mail_data = mail_data.encode("utf-8")
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        processors = tuple(self.processors.items())
+        start = time.perf_counter()
+        try:
+            if len(mail_data) < self.shared_memory_threshold:
+                return await loop.run_in_executor(
+                    pool, _run_processors, processors, mail_data
+                )
+            from multiprocessing.shared_memory import SharedMemory
+
+            shm = SharedMemory(create=True, size=len(mail_data))
+            try:
+                buf = shm.buf
+                assert buf is not None
+                buf[: len(mail_data)] = mail_data
+                shared = _SharedMail(shm.name, len(mail_data))
+                return await loop.run_in_executor(
+                    pool, _run_processors, processors, shared
+                )
+            finally:
+                shm.close()
+                shm.unlink()
+        except Exception:
+            metrics.increment("postprocess_errors")
+            raise
+        finally:
+            metrics.observe("postprocess_seconds", time.perf_counter() - start)
+
+    def sink(
+        self, on_result: Callable[[State, dict[str, Any]], None]
+    ) -> Callable[[State], Awaitable[None]]:
+        """Return a mail sink that passes the results to on_result.
+
+        The sink must be run in the event loop, e.g. with
+        SinkWorker(..., threaded=False).
+        """
+        return partial(self._process_state, on_result)
+
+    async def _process_state(
+        self,
+        on_result: Callable[[State, dict[str, Any]], None],
+        state: State,
+    ) -> None:
+        on_result(state, await self.process(state.mail_data or ""))
+
+    def close(self, wait: bool = True) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+
+def _run_processors(
+    processors: tuple[tuple[str, Processor], ...],
+    mail: bytes | _SharedMail,
+) -> dict[str, Any]:
+    """Run processors in a worker process."""
+    if isinstance(mail, bytes):
+        return {name: f(memoryview(mail)) for name, f in processors}
+    from multiprocessing.shared_memory import SharedMemory
+
+    shm = SharedMemory(mail.name)
+    try:
+        assert shm.buf is not None
+        with shm.buf[: mail.size] as view:
+            return {name: f(view) for name, f in processors}
+    finally:
+        shm.close()
+
+
+def content_hash(data: memoryview) -> str:
+    """Return the SHA-256 hash of the mail data as hex string."""
+    import hashlib
+
+    return hashlib.sha256(data).hexdigest()
+
+
+def mime_summary(data: memoryview) -> dict[str, Any]:
+    """Parse the MIME structure of a mail.
+
+    Return the content type of the mail and the content type, file name,
+    and decoded size of each leaf part.
+    """
+    from email import message_from_bytes, policy
+
+    message = message_from_bytes(bytes(data), policy=policy.default)
+    parts = []
+    for part in message.walk():
+        if part.is_multipart():
+            continue
+        payload = part.get_payload(decode=True)
+        parts.append(
+            {
+                "content_type": part.get_content_type(),
+                "filename": part.get_filename(),
+                "size": len(payload) if isinstance(payload, bytes) else 0,
+            }
+        )
+    return {"content_type": message.get_content_type(), "parts": parts}
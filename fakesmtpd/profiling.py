@@ -0,0 +1,215 @@
+"""On-demand profiling of a running server."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import signal
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING
+
+from fakesmtpd.metrics import metrics
+
+if TYPE_CHECKING:
+    import cProfile
+    import tracemalloc
+
+    from fakesmtpd.admin import AdminResponse, AdminServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE_SECONDS = 30.0
+TRACEMALLOC_FRAMES = 10
+TRACEMALLOC_TOP = 10
+
+
+def _timestamp() -> str:
+    now = time.time()
+    ms = int(now * 1000) % 1000
+    return time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f".{ms:03d}"
+
+
+class Profiler:
+    """Collect cProfile statistics for a limited time.
+
+    Statistics are written in pstats format to a file in output_dir
+    when the profiling period ends or the profiler is stopped manually.
+    """
+
+    def __init__(self, output_dir: str = ".") -> None:
+        self.output_dir = output_dir
+        self._profile: cProfile.Profile | None = None
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._profile is not None
+
+    def start(self, seconds: float = DEFAULT_PROFILE_SECONDS) -> None:
+        import cProfile
+
+        if self._profile is not None:
+            raise RuntimeError("profiler is already running")
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        loop = asyncio.get_running_loop()
+        self._timer = loop.call_later(seconds, self.stop)
+        logger.info("profiling started for %.1f s", seconds)
+
+    def stop(self) -> str:
+        """Stop profiling and return the name of the statistics file."""
+        if self._profile is None:
+            raise RuntimeError("profiler is not running")
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        profile, self._profile = self._profile, None
+        profile.disable()
+        filename = os.path.join(
+            self.output_dir, f"fakesmtpd-{_timestamp()}.pstats"
+        )
+        profile.dump_stats(filename)
+        logger.info("profiling stopped, statistics written to %s", filename)
+        return filename
+
+    def toggle(self, seconds: float = DEFAULT_PROFILE_SECONDS) -> None:
+        if self.running:
+            self.stop()
+        else:
+            self.start(seconds)
+
+
+class MemoryTracer:
+    """Compare tracemalloc snapshots.
+
+    The first call to snapshot() starts tracing memory allocations. Each
+    following call writes the difference to the previous snapshot to a
+    file in output_dir.
+    """
+
+    def __init__(self, output_dir: str = ".") -> None:
+        self.output_dir = output_dir
+        self._previous: tracemalloc.Snapshot | None = None
+
+    def snapshot(self) -> str | None:
+        """Take a snapshot and return the name of the difference file.
+
+        Return None if this is the first snapshot.
+        """
+        import tracemalloc
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._previous = None
+        snapshot = tracemalloc.take_snapshot()
+        previous, self._previous = self._previous, snapshot
+        if previous is None:
+            logger.info("tracemalloc started, baseline snapshot taken")
+            return None
+        stats = snapshot.compare_to(previous, "lineno")
+        filename = os.path.join(
+            self.output_dir, f"fakesmtpd-{_timestamp()}.tracemalloc"
+        )
+        with open(filename, "w") as f:
+            for stat in stats:
+                f.write(f"{stat}\n")
+        for stat in stats[:TRACEMALLOC_TOP]:
+            logger.info("tracemalloc: %s", stat)
+        return filename
+
+    def stop(self) -> None:
+        import tracemalloc
+
+        tracemalloc.stop()
+        self._previous = None
+
+
+async def monitor_loop_lag(interval: float, threshold: float) -> None:
+    """Measure how late the event loop wakes up from a sleep.
+
+    The lag is recorded in the metrics, and a warning is logged if it
+    exceeds threshold.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        metrics.set_gauge("event_loop_lag_seconds", lag)
+        metrics.observe("event_loop_lag", lag)
+        if lag > threshold:
+            logger.warning("event loop lagging by %.3f s", lag)
+
+
+@asynccontextmanager
+async def profiling(
+    profiler: Profiler,
+    memory_tracer: MemoryTracer,
+    *,
+    profile_seconds: float = DEFAULT_PROFILE_SECONDS,
+    slow_callback_duration: float | None = None,
+    lag_interval: float | None = None,
+) -> AsyncIterator[None]:
+    """Enable profiling hooks while the server runs.
+
+    SIGUSR1 toggles the profiler, SIGUSR2 takes a tracemalloc snapshot.
+    If slow_callback_duration is given, the event loop's debug mode is
+    enabled to log callbacks that take longer. If lag_interval is given,
+    the event loop lag is monitored.
+    """
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGUSR1, profiler.toggle, profile_seconds)
+    loop.add_signal_handler(signal.SIGUSR2, memory_tracer.snapshot)
+    if slow_callback_duration is not None:
+        loop.set_debug(True)
+        loop.slow_callback_duration = slow_callback_duration
+    lag_task = None
+    if lag_interval is not None:
+        threshold = slow_callback_duration or lag_interval
+        lag_task = asyncio.create_task(
+            monitor_loop_lag(lag_interval, threshold)
+        )
+    try:
+        yield
+    finally:
+        loop.remove_signal_handler(signal.SIGUSR1)
+        loop.remove_signal_handler(signal.SIGUSR2)
+        if lag_task is not None:
+            lag_task.cancel()
+        if profiler.running:
+            profiler.stop()
+
+
+def add_profiling_routes(
+    admin: AdminServer,
+    profiler: Profiler,
+    memory_tracer: MemoryTracer,
+    *,
+    profile_seconds: float = DEFAULT_PROFILE_SECONDS,
+) -> None:
+    """Add admin routes that mirror the profiling signals.
+
+    POST /profile?seconds=N starts the profiler, DELETE /profile stops it
+    early, and POST /tracemalloc takes a tracemalloc snapshot.
+    """
+    from http import HTTPStatus
+
+    def start_profile(query: dict[str, str]) -> AdminResponse:
+        seconds = float(query.get("seconds", profile_seconds))
+        if seconds <= 0:
+            raise ValueError("seconds must be positive")
+        profiler.start(seconds)
+        return HTTPStatus.ACCEPTED, {"profiling": True, "seconds": seconds}
+
+    def stop_profile(query: dict[str, str]) -> AdminResponse:
+        return HTTPStatus.OK, {"profiling": False, "file": profiler.stop()}
+
+    def snapshot_memory(query: dict[str, str]) -> AdminResponse:
+        return HTTPStatus.OK, {"file": memory_tracer.snapshot()}
+
+    admin.add_route("POST", "/profile", start_profile)
+    admin.add_route("DELETE", "/profile", stop_profile)
+    admin.add_route("POST", "/tracemalloc", snapshot_memory)
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import asyncio
+import ssl
+import threading
+from collections.abc import Iterable
+from typing import Any
+
+from fakesmtpd.connection import HandlerFactory, format_peer
+
+RECEIVE_BUFFER_SIZE = 64 * 1024
+PENDING_LIMIT = 64 * 1024  # same as asyncio.StreamReader's default limit
+
+_receive_buffers = threading.local()
+
+
+def _shared_receive_buffer(size: int) -> memoryview:
+    """Return a receive buffer shared by all connections of this thread.
+
+    Received data is copied out of the buffer in buffer_updated(), so a
+    single buffer per event loop thread is enough.
+    """
+    try:
+        buffers: dict[int, memoryview] = _receive_buffers.buffers
+    except AttributeError:
+        buffers = _receive_buffers.buffers = {}
+    buffer = buffers.get(size)
+    if buffer is None:
+        buffer = buffers[size] = memoryview(bytearray(size))
+    return buffer
+
+
+class SMTPProtocol(asyncio.BufferedProtocol):
+    """Low-level SMTP server protocol.
+
+    Received data is read into a preallocated buffer that is shared by
+    all connections, and appended to the pending data of the connection.
+    Lines are handed out from a read offset into the pending data, which
+    is compacted once most of it was consumed. The protocol implements
+    the reader and writer interface expected by ConnectionHandler, so
+    the SMTP session itself is handled exactly as with the stream-based
+    server. Lines that are already buffered are handed out without
+    suspending the connection handler.
+    """
+
+    def __init__(
+        self,
+        handler_factory: HandlerFactory,
+        *,
+        buffer_size: int = RECEIVE_BUFFER_SIZE,
+        limit: int = PENDING_LIMIT,
+    ) -> None:
+        self.handler_factory = handler_factory
+        self._buffer_size = buffer_size
+        self._pending = bytearray()
+        self._offset = 0
+        self._limit = limit
+        self._transport: asyncio.Transport | None = None
+        self._waiter: asyncio.Future[None] | None = None
+        self._eof = False
+        self._reading_paused = False
+        self._drain_waiter: asyncio.Future[None] | None = None
+        self._writing_paused = False
+        self._task: asyncio.Task[None] | None = None
+
+    # Protocol interface
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        assert isinstance(transport, asyncio.Transport)
+        self._transport = transport
+        peer = format_peer(transport.get_extra_info("peername"))
+        handler = self.handler_factory(self, self, peer=peer)
+        loop = asyncio.get_running_loop()
+        self._task = loop.create_task(handler.handle())
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return _shared_receive_buffer(self._buffer_size)
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self._pending += _shared_receive_buffer(self._buffer_size)[:nbytes]
+        if self._pending_size() > 2 * self._limit:
+            self._pause_reading()
+        self._wake_up()
+
+    def eof_received(self) -> bool | None:
+        self._eof = True
+        self._wake_up()
+        return None
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self._eof = True
+        self._wake_up()
+        self._writing_paused = False
+        self._wake_up_drain()
+
+    def pause_writing(self) -> None:
+        self._writing_paused = True
+
+    def resume_writing(self) -> None:
+        self._writing_paused = False
+        self._wake_up_drain()
+
+    # Reader interface
+
+    def has_buffered_data(self) -> bool:
+        return self._pending_size() > 0
+
+    def at_eof(self) -> bool:
+        return self._eof and not self._pending_size()
+
+    async def readuntil(self, separator: bytes = b"\n") -> bytes:
+        start = self._offset
+        while True:
+            index = self._pending.find(separator, start)
+            if index >= 0:
+                end = index + len(separator)
+                line = self._consume(end)
+                self._resume_reading()
+                return line
+            if self._pending_size() > self._limit:
+                raise asyncio.LimitOverrunError(
+                    "Separator is not found, and chunk exceed the limit",
+                    self._pending_size(),
+                )
+            if self._eof:
+                partial = self._consume(len(self._pending))
+                raise asyncio.IncompleteReadError(partial, None)
+            start = max(self._offset, len(self._pending) - len(separator) + 1)
+            await self._wait_for_data()
+
+    # Writer interface
+
+    @property
+    def transport(self) -> asyncio.Transport:
+        assert self._transport is not None
+        return self._transport
+
+    def write(self, data: bytes) -> Any:
+        assert self._transport is not None
+        self._transport.write(data)
+
+    def writelines(self, data: Iterable[bytes]) -> Any:
+        assert self._transport is not None
+        self._transport.writelines(data)
+
+    async def drain(self) -> None:
+        if not self._writing_paused:
+            return
+        assert self._drain_waiter is None
+        self._drain_waiter = asyncio.get_running_loop().create_future()
+        try:
+            await self._drain_waiter
+        finally:
+            self._drain_waiter = None
+
+    def close(self) -> Any:
+        if self._transport is not None:
+            self._transport.close()
+
+    async def start_tls(self, sslcontext: ssl.SSLContext) -> None:
+        """Upgrade the connection to TLS, using the same protocol."""
+        assert self._transport is not None
+        loop = asyncio.get_running_loop()
+        self._resume_reading()
+        transport = await loop.start_tls(
+            self._transport, self, sslcontext, server_side=True
+        )
+        assert transport is not None
+        self._transport = transport
+
+    # Internals
+
+    def _pending_size(self) -> int:
+        return len(self._pending) - self._offset
+
+    def _consume(self, end: int) -> bytes:
+        """Return the pending data up to end and advance the read offset."""
+        with memoryview(self._pending) as view:
+            data = bytes(view[self._offset : end])
+        if end == len(self._pending):
+            self._pending.clear()
+            self._offset = 0
+        elif end > len(self._pending) // 2:
+            # Most of the buffer was consumed, move the rest to the front.
+            del self._pending[:end]
+            self._offset = 0
+        else:
+            self._offset = end
+        return data
+
+    async def _wait_for_data(self) -> None:
+        assert self._waiter is None
+        self._resume_reading()
+        self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            await self._waiter
+        finally:
+            self._waiter = None
+
+    def _wake_up(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _wake_up_drain(self) -> None:
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_result(None)
+
+    def _pause_reading(self) -> None:
+        if not self._reading_paused and self._transport is not None:
+            self._transport.pause_reading()
+            self._reading_paused = True
+
+    def _resume_reading(self) -> None:
+        if self._reading_paused and self._pending_size() <= self._limit:
+            assert self._transport is not None
+            self._transport.resume_reading()
+            self._reading_paused = False
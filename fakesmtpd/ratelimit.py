@@ -0,0 +1,232 @@
+"""Per-client rate limits on connections, messages, and bytes.
+
+Rate limits are token buckets, implemented with the generic cell rate
+algorithm (GCRA): instead of the number of tokens and the time of the
+last update, only the time at which a bucket will be full again is
+stored per client. A bucket that is full is equivalent to a missing
+bucket, so it can be dropped, which keeps the tables small.
+"""
+
+from __future__ import annotations
+
+import heapq
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
+from typing import NamedTuple
+
+from fakesmtpd.metrics import metrics
+
+PEER = "peer"
+SENDER = "sender"
+CONNECTIONS = "connections"
+MESSAGES = "messages"
+BYTES = "bytes"
+
+# Maximum number of clients per table. If more clients are tracked, the
+# least recently seen clients are forgotten.
+DEFAULT_MAX_CLIENTS = 100_000
+
+# The expiry heap is rebuilt once it holds this many more stale entries
+# than twice the number of buckets.
+_MIN_EXPIRY_HEAP = 64
+
+_UNITS = {"s": 1.0, "m": 60.0, "h": 3600.0, "d": 86400.0}
+_SIZE_SUFFIXES = {"K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+class Rate(NamedTuple):
+    """Allow amount tokens per period seconds, at most burst at once."""
+
+    amount: float
+    period: float
+    burst: float
+
+    @property
+    def interval(self) -> float:
+        """Seconds until a token is refilled."""
+        return self.period / self.amount
+
+
+class BucketTable:
+    """Token buckets with the same rate, one per client."""
+
+    def __init__(
+        self,
+        rate: Rate,
+        *,
+        max_clients: int = DEFAULT_MAX_CLIENTS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.rate = rate
+        self.max_clients = max_clients
+        self._clock = clock
+        self._interval = rate.interval
+        self._tolerance = rate.burst * rate.interval
+        # Time at which each bucket is full again, least recently
+        # updated first.
+        self._full_at: OrderedDict[str, float] = OrderedDict()
+        # Heap of (full_at, key), earliest first. Entries whose bucket
+        # was charged again or dropped since are skipped when popped.
+        self._expiry: list[tuple[float, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._full_at)
+
+    def has_tokens(self, key: str, amount: float = 1.0) -> bool:
+        """Return whether amount tokens can be taken from the bucket."""
+        now = self._clock()
+        full_at = max(self._full_at.get(key, now), now)
+        return full_at + amount * self._interval - now <= self._tolerance
+
+    def take(self, key: str, amount: float = 1.0) -> bool:
+        """Take amount tokens from the bucket, if it has enough left."""
+        if not self.has_tokens(key, amount):
+            return False
+        self.charge(key, amount)
+        return True
+
+    def charge(self, key: str, amount: float) -> None:
+        """Take amount tokens from the bucket, even if it runs into debt.
+
+        A bucket in debt has no tokens until it was refilled.
+        """
+        now = self._clock()
+        full_at = self._full_at.pop(key, now)
+        full_at = max(full_at, now) + amount * self._interval
+        self._full_at[key] = full_at
+        heapq.heappush(self._expiry, (full_at, key))
+        self._expire(now)
+
+    def _expire(self, now: float) -> None:
+        buckets = self._full_at
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now:
+            full_at, key = heapq.heappop(expiry)
+            if buckets.get(key) == full_at:
+                del buckets[key]
+        while len(buckets) > self.max_clients:
+            buckets.popitem(last=False)
+        if len(expiry) > 2 * len(buckets) + _MIN_EXPIRY_HEAP:
+            self._expiry = [(f, k) for k, f in buckets.items()]
+            heapq.heapify(self._expiry)
+
+
+class RateLimiter:
+    """The rate limits of a server.
+
+    Connections are limited per peer IP address. Messages and bytes are
+    limited per peer and per sender address (MAIL FROM). Since the size
+    of a message is only known after it was received, bytes are counted
+    afterwards, and further messages are refused until the byte bucket
+    was refilled.
+    """
+
+    def __init__(
+        self,
+        limits: Iterable[tuple[str, str, Rate]],
+        *,
+        max_clients: int = DEFAULT_MAX_CLIENTS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.tables: dict[tuple[str, str], BucketTable] = {
+            (scope, resource): BucketTable(
+                rate, max_clients=max_clients, clock=clock
+            )
+            for scope, resource, rate in limits
+        }
+        self._connections = self.tables.get((PEER, CONNECTIONS))
+        self._messages = self._tables_for(MESSAGES)
+        self._bytes = self._tables_for(BYTES)
+
+    def _tables_for(self, resource: str) -> list[tuple[str, BucketTable]]:
+        return [
+            (scope, table)
+            for (scope, r), table in self.tables.items()
+            if r == resource
+        ]
+
+    def allow_connection(self, host: str) -> bool:
+        if self._connections is None or self._connections.take(host):
+            return True
+        _count_limited(PEER, CONNECTIONS)
+        return False
+
+    def allow_message(self, host: str, sender: str) -> bool:
+        """Return whether the client may send another message.
+
+        If it may, a token is taken from each message bucket.
+        """
+        keys = {PEER: host, SENDER: sender.lower()}
+        for scope, table in self._bytes:
+            if not table.has_tokens(keys[scope], 0):
+                _count_limited(scope, BYTES)
+                return False
+        for scope, table in self._messages:
+            if not table.has_tokens(keys[scope]):
+                _count_limited(scope, MESSAGES)
+                return False
+        for scope, table in self._messages:
+            table.charge(keys[scope], 1)
+        return True
+
+    def count_bytes(self, host: str, sender: str, size: int) -> None:
+        keys = {PEER: host, SENDER: sender.lower()}
+        for scope, table in self._bytes:
+            table.charge(keys[scope], size)
+
+
+def _count_limited(scope: str, resource: str) -> None:
+    metrics.increment(
+        "rate_limited", labels={"scope": scope, "resource": resource}
+    )
+
+
+def parse_rate_limit(spec: str) -> tuple[str, str, Rate]:
+    """Parse a rate limit specification.
+
+    The specification has the form SCOPE:RESOURCE=AMOUNT/UNIT, optionally
+    followed by ",burst=N". SCOPE is "peer" or "sender", RESOURCE is
+    "connections", "messages", or "bytes", UNIT is "s", "m", "h", or
+    "d". Byte amounts can have a K, M, or G suffix. By default, the burst
+    size is the amount:
+
+        peer:connections=10/s,burst=50
+        sender:bytes=100M/h
+    """
+    limit, *options = spec.split(",")
+    key, sep, rate = limit.partition("=")
+    scope, _, resource = key.partition(":")
+    if not sep:
+        raise ValueError(f"invalid rate limit: {spec}")
+    if scope not in (PEER, SENDER):
+        raise ValueError(f"unknown rate limit scope: {scope}")
+    if resource not in (CONNECTIONS, MESSAGES, BYTES):
+        raise ValueError(f"unknown rate limit resource: {resource}")
+    if scope == SENDER and resource == CONNECTIONS:
+        raise ValueError("connections can only be limited per peer")
+    amount_s, sep, unit = rate.partition("/")
+    if unit not in _UNITS:
+        raise ValueError(f"invalid rate: {rate}")
+    amount = _parse_amount(amount_s, resource)
+    burst = amount
+    for option in options:
+        name, sep, value = option.partition("=")
+        if name != "burst" or not sep:
+            raise ValueError(f"invalid rate limit option: {option}")
+        burst = _parse_amount(value, resource)
+    return scope, resource, Rate(amount, _UNITS[unit], burst)
+
+
+def _parse_amount(s: str, resource: str) -> float:
+    factor = 1
+    if resource == BYTES and s[-1:].upper() in _SIZE_SUFFIXES:
+        factor = _SIZE_SUFFIXES[s[-1].upper()]
+        s = s[:-1]
+    try:
+        amount = float(s) * factor
+    except ValueError:
+        raise ValueError(f"invalid amount: {s}") from None
+    if not amount > 0:
+        raise ValueError(f"amount must be positive: {s}")
+    return amount
@@ -0,0 +1,157 @@
+"""Replay recorded SMTP sessions against a server."""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import struct
+import sys
+import time
+from collections.abc import Sequence
+
+from fakesmtpd.smtp import SMTP_PORT
+from fakesmtpd.trace import INBOUND, OUTBOUND, TraceRecord, read_trace
+
+CLOSE_TIMEOUT = 5.0
+
+
+def parse_speed(s: str) -> float:
+    """Parse a replay speed.
+
+    "max" replays as fast as possible and is returned as 0. All other
+    values are speed factors, for example "1" for the original speed or
+    "2" for double speed.
+    """
+    if s == "max":
+        return 0.0
+    speed = float(s)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive or 'max'")
+    return speed
+
+
+def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Replay recorded SMTP sessions against a server"
+    )
+    parser.add_argument("traces", nargs="+", help="trace files to replay")
+    parser.add_argument(
+        "--host", default="127.0.0.1", help="SMTP server, default 127.0.0.1"
+    )
+    parser.add_argument(
+        "--port", "-p", type=int, default=SMTP_PORT, help="SMTP port"
+    )
+    parser.add_argument(
+        "--speed",
+        "-s",
+        type=parse_speed,
+        default=1.0,
+        help="speed factor, or 'max' to replay without delays, default 1",
+    )
+    parser.add_argument(
+        "--repeat",
+        "-r",
+        type=int,
+        default=1,
+        help="number of times to replay each trace",
+    )
+    parser.add_argument(
+        "--sequential",
+        action="store_true",
+        help="replay sessions one after another instead of concurrently",
+    )
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    args = parse_args()
+    started = time.perf_counter()
+    try:
+        sessions = [read_trace(path)[1] for path in args.traces] * args.repeat
+        sent = asyncio.run(
+            replay_sessions(
+                sessions,
+                args.host,
+                args.port,
+                speed=args.speed,
+                concurrent=not args.sequential,
+            )
+        )
+    except (OSError, ValueError, struct.error) as exc:
+        print(str(exc), file=sys.stderr)
+        sys.exit(1)
+    elapsed = time.perf_counter() - started
+    print(
+        f"replayed {len(sessions)} sessions, {sent} bytes in {elapsed:.3f} s",
+        file=sys.stderr,
+    )
+
+
+async def replay_sessions(
+    sessions: Sequence[Sequence[TraceRecord]],
+    host: str,
+    port: int,
+    *,
+    speed: float = 1.0,
+    concurrent: bool = True,
+) -> int:
+    """Replay several sessions and return the number of bytes sent."""
+    if concurrent:
+        results = await asyncio.gather(
+            *(replay_session(s, host, port, speed=speed) for s in sessions)
+        )
+        return sum(results)
+    total = 0
+    for session in sessions:
+        total += await replay_session(session, host, port, speed=speed)
+    return total
+
+
+async def replay_session(
+    records: Sequence[TraceRecord],
+    host: str,
+    port: int,
+    *,
+    speed: float = 1.0,
+) -> int:
+    """Replay the inbound data of a session and return the bytes sent.
+
+    Data is sent with the original timing divided by speed, or without
+    delays if speed is 0. Replies from the server are read and discarded.
+    The connection is closed once the server has sent as many reply lines
+    as were recorded, or closes the connection itself.
+    """
+    reply_lines = sum(
+        r.data.count(b"\n") for r in records if r.direction == OUTBOUND
+    )
+    reader, writer = await asyncio.open_connection(host, port)
+    drain_task = asyncio.create_task(_discard(reader, reply_lines))
+    sent = 0
+    started = time.monotonic()
+    try:
+        for record in records:
+            if record.direction != INBOUND:
+                continue
+            if speed:
+                delay = started + record.offset / speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            writer.write(record.data)
+            sent += len(record.data)
+            await writer.drain()
+        try:
+            await asyncio.wait_for(asyncio.shield(drain_task), CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+    finally:
+        drain_task.cancel()
+        writer.close()
+    return sent
+
+
+async def _discard(reader: asyncio.StreamReader, lines: int) -> None:
+    while lines > 0:
+        data = await reader.read(64 * 1024)
+        if not data:
+            break
+        lines -= data.count(b"\n")
@@ -0,0 +1,44 @@
+"""Encoding of SMTP replies.
+
+Reply texts can have several lines, separated by "\\n". They are sent as
+multi-line replies (RFC 5321, section 4.2.1), where all lines but the
+last have a hyphen after the reply code:
+
+    250-mail.example.com Hello client.example.com
+    250-PIPELINING
+    250 STARTTLS
+
+Most replies are the same in every session, e.g. "250 OK" or the
+greeting, so encoded replies are cached.
+"""
+
+from __future__ import annotations
+
+from functools import lru_cache
+from socket import getfqdn
+
+from fakesmtpd.smtp import SMTPStatus
+
+REPLY_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=None)
+def server_name() -> str:
+    """Return the fully qualified domain name of this host.
+
+    The name is looked up once, since the lookup may query the DNS.
+    """
+    return getfqdn()
+
+
+@lru_cache(maxsize=REPLY_CACHE_SIZE)
+def encode_reply(code: SMTPStatus, text: str) -> bytes:
+    """Encode a reply, including the final CRLF."""
+    value = code.value
+    if "\n" not in text:
+        return f"{value} {text}\r\n".encode("ascii")
+    *lines, last_line = text.split("\n")
+    return "".join(
+        [f"{value}-{line}\r\n" for line in lines]
+        + [f"{value} {last_line}\r\n"]
+    ).encode("ascii")
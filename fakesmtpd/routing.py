@@ -0,0 +1,127 @@
+"""Delivery of mails to one mbox file per recipient or recipient domain."""
+
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import IO, TYPE_CHECKING
+from urllib.parse import quote
+
+from fakesmtpd.mbox import write_mbox_mail
+from fakesmtpd.metrics import metrics
+from fakesmtpd.state import State
+
+if TYPE_CHECKING:
+    from fakesmtpd.bodystore import BodyStore
+
+RECIPIENT = "recipient"
+DOMAIN = "domain"
+ROUTES = (RECIPIENT, DOMAIN)
+
+DEFAULT_MAX_OPEN_FILES = 128
+
+
+@lru_cache(maxsize=4096)
+def mailbox_name(address: str, route: str = RECIPIENT) -> str:
+    """Return the file name of the mailbox for a recipient address.
+
+    Addresses are case-insensitive. Characters that are not safe in file
+    names are percent-encoded.
+    """
+    key = address.lower()
+    if route == DOMAIN:
+        key = key.rpartition("@")[2]
+    name = quote(key, safe="@+=-_.")
+    if name.startswith("."):
+        name = "%2E" + name[1:]
+    return f"{name}.mbox"
+
+
+class FileCache:
+    """Files opened for appending, at most max_open at a time.
+
+    If another file is needed, the least recently used file is closed.
+    """
+
+    def __init__(self, max_open: int = DEFAULT_MAX_OPEN_FILES) -> None:
+        if max_open < 1:
+            raise ValueError("max_open must be positive")
+        self.max_open = max_open
+        self._files: OrderedDict[str, IO[str]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def __contains__(self, path: object) -> bool:
+        return path in self._files
+
+    def get(self, path: str) -> IO[str]:
+        try:
+            f = self._files[path]
+        except KeyError:
+            pass
+        else:
+            self._files.move_to_end(path)
+            return f
+        while len(self._files) >= self.max_open:
+            _, old = self._files.popitem(last=False)
+            old.close()
+            metrics.increment("mailbox_evictions")
+        f = self._files[path] = open(path, "a")
+        metrics.increment("mailbox_opens")
+        return f
+
+    def close(self) -> None:
+        while self._files:
+            _, f = self._files.popitem()
+            f.close()
+
+
+class MailboxRouter:
+    """Write each mail to the mailboxes of its recipients.
+
+    Each recipient, or each recipient domain if route is "domain", has
+    an mbox file in directory, named by mailbox_name(). A mail for
+    several recipients with the same mailbox is written to it once. Open
+    files are kept in a FileCache, so that files are not opened again
+    for every mail. Mails can be written from a worker thread.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        route: str = RECIPIENT,
+        max_open_files: int = DEFAULT_MAX_OPEN_FILES,
+        body_store: BodyStore | None = None,
+    ) -> None:
+        if route not in ROUTES:
+            raise ValueError(f"unknown route: {route}")
+        self.directory = directory
+        self.route = route
+        self.body_store = body_store
+        self._files = FileCache(max_open_files)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, address: str) -> str:
+        """Return the mailbox path for a recipient address."""
+        return os.path.join(self.directory, mailbox_name(address, self.route))
+
+    def __call__(self, state: State) -> None:
+        assert state.forward_path is not None
+        paths = dict.fromkeys(self.path(a) for a in state.forward_path)
+        with self._lock:
+            for path in paths:
+                f = self._files.get(path)
+                write_mbox_mail(f, state, body_store=self.body_store)
+
+    def reopen(self) -> None:
+        """Close all files, so that they are reopened when needed."""
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._files.close()
@@ -2,47 +2,309 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import os
 import signal
 import sys
 from asyncio.streams import StreamReader, StreamWriter
-from collections.abc import Awaitable, Callable
+from collections.abc import (
+    Awaitable,
+    Callable,
+    Coroutine,
+    Iterable,
+    Sequence,
+)
+from contextlib import AbstractAsyncContextManager, AsyncExitStack, suppress
 from functools import partial
-from typing import Optional
+from socket import AF_UNIX
+from typing import TYPE_CHECKING, Any
 
 from fakesmtpd.args import parse_args
-from fakesmtpd.connection import ConnectionHandler
-from fakesmtpd.mbox import print_mbox_mail
-from fakesmtpd.state import State
+from fakesmtpd.config import (
+    ConfigError,
+    ServerConfig,
+    Settings,
+    add_config_routes,
+    delivering,
+    reloading,
+)
+from fakesmtpd.connection import HandlerFactory, format_peer
+from fakesmtpd.listeners import Listener
+from fakesmtpd.log import configure_logging
+from fakesmtpd.metrics import metrics
+from fakesmtpd.profiling import MemoryTracer, Profiler, profiling
+from fakesmtpd.sessions import SessionRegistry, add_session_routes
+from fakesmtpd.tls import streams_support_tls
+
+if TYPE_CHECKING:
+    from argparse import Namespace
+
+    from fakesmtpd.admin import AdminResponse
+
+logger = logging.getLogger(__name__)
+
+_Runner = Callable[[Coroutine[Any, Any, None]], None]
+_ServerStarter = Callable[[], Awaitable[Sequence[asyncio.Server]]]
+_Service = Callable[[], AbstractAsyncContextManager[object]]
 
 
 def main() -> None:
-    logging.basicConfig(level=logging.INFO)
     args = parse_args()
-    printer = partial(print_mbox_mail, args.output_filename)
+    log_listener = configure_logging(
+        args.log_format, args.log_level, sample_rate=args.log_sample_rate
+    )
+    sessions = SessionRegistry(history_size=args.session_history)
+    listeners = args.listen or [Listener(host=args.bind, port=args.port)]
     try:
-        run_server(args.bind, args.port, partial(handle_connection, printer))
-    except PermissionError as exc:
+        config = ServerConfig(
+            Settings.from_args(args), args.config, sessions=sessions
+        )
+        _check_tls(config, listeners, args.transport)
+    except ConfigError as exc:
+        log_listener.stop()
         print(str(exc), file=sys.stderr)
         sys.exit(1)
+    profiler = Profiler(args.profile_dir)
+    memory_tracer = MemoryTracer(args.profile_dir)
+    services: list[_Service] = [
+        partial(delivering, config),
+        partial(reloading, config),
+        partial(
+            profiling,
+            profiler,
+            memory_tracer,
+            profile_seconds=args.profile_seconds,
+            slow_callback_duration=_ms_to_s(args.slow_callback_ms),
+            lag_interval=_ms_to_s(args.loop_lag_interval_ms),
+        ),
+    ]
+    if args.admin_port is not None:
+        services.append(
+            _admin_service(args, config, sessions, profiler, memory_tracer)
+        )
+    try:
+        run_server(
+            partial(
+                start_listeners,
+                listeners,
+                args.transport,
+                config.handler_factory,
+            ),
+            event_loop=args.loop,
+            services=services,
+            sessions=sessions,
+        )
+    except (PermissionError, ImportError) as exc:
+        print(str(exc), file=sys.stderr)
+        sys.exit(1)
+    finally:
+        config.close()
+        log_listener.stop()
+
+
+def _check_tls(
+    config: ServerConfig, listeners: Sequence[Listener], transport: str
+) -> None:
+    if config.tls_context is None:
+        if any(listener.tls for listener in listeners):
+            raise ConfigError("tls listeners require --tls-cert")
+    elif transport == "streams" and not streams_support_tls():
+        raise ConfigError(
+            "TLS with the streams transport requires Python 3.11, "
+            "use --transport protocol"
+        )
+
+
+def _ms_to_s(ms: float | None) -> float | None:
+    return ms / 1000 if ms is not None else None
+
+
+def _admin_service(
+    args: Namespace,
+    config: ServerConfig,
+    sessions: SessionRegistry,
+    profiler: Profiler,
+    memory_tracer: MemoryTracer,
+) -> _Service:
+    from fakesmtpd.admin import AdminServer
+    from fakesmtpd.profiling import add_profiling_routes
+
+    admin = AdminServer()
+    admin.add_route("GET", "/metrics", _get_metrics)
+    add_config_routes(admin, config)
+    add_session_routes(admin, sessions)
+    add_profiling_routes(
+        admin, profiler, memory_tracer, profile_seconds=args.profile_seconds
+    )
+    return partial(admin.serving, args.admin_bind, args.admin_port)
+
+
+def _get_metrics(query: dict[str, str]) -> AdminResponse:
+    from http import HTTPStatus
+
+    return HTTPStatus.OK, metrics.snapshot()
+
+
+def select_event_loop(name: str) -> tuple[str, _Runner]:
+    """Return the name of the event loop to use and a function to run it.
+
+    name is one of "asyncio", "uvloop", or "auto". "auto" uses uvloop if
+    it is installed and falls back to the default asyncio event loop
+    otherwise. ImportError is raised if "uvloop" is requested, but not
+    installed.
+    """
+    if name not in ["asyncio", "uvloop", "auto"]:
+        raise ValueError(f"unknown event loop: {name}")
+    if name != "asyncio":
+        try:
+            import uvloop
+        except ImportError:
+            if name == "uvloop":
+                raise ImportError("uvloop is not installed") from None
+        else:
+            runner: _Runner = uvloop.run
+            return "uvloop", runner
+    return "asyncio", asyncio.run
+
+
+def run_server(
+    start: _ServerStarter,
+    *,
+    event_loop: str = "asyncio",
+    services: Sequence[_Service] = (),
+    sessions: SessionRegistry | None = None,
+) -> None:
+    loop_name, run = select_event_loop(event_loop)
+    metrics.set_info("event_loop", loop_name)
+    run(serve(start, loop_name, services=services, sessions=sessions))
+
+
+async def serve(
+    start: _ServerStarter,
+    loop_name: str = "asyncio",
+    *,
+    services: Sequence[_Service] = (),
+    sessions: SessionRegistry | None = None,
+) -> None:
+    """Run a server until SIGINT or SIGTERM is received.
+
+    services are async context managers that are entered after the
+    server was started and exited before it is closed.
+
+    On shutdown, the server stops accepting connections first. If
+    sessions is given, open sessions are then drained: idle sessions
+    are closed with a 421 reply, and mail transactions in progress may
+    finish within the registry's shutdown timeout.
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    servers = await start()
+    sockets = [sock for server in servers for sock in server.sockets]
+    addresses = ", ".join(str(sock.getsockname()) for sock in sockets)
+    logger.info("listening on %s using %s event loop", addresses, loop_name)
+    unix_paths = [
+        sock.getsockname() for sock in sockets if sock.family == AF_UNIX
+    ]
+    try:
+        async with AsyncExitStack() as stack:
+            for service in services:
+                await stack.enter_async_context(service())
+            await stop.wait()
+            _close_servers(servers)
+            if sessions is not None and len(sessions) > 0:
+                logger.info("draining %d open sessions", len(sessions))
+                await sessions.drain()
+    finally:
+        loop.remove_signal_handler(signal.SIGINT)
+        loop.remove_signal_handler(signal.SIGTERM)
+        _close_servers(servers)
+        for path in unix_paths:
+            with suppress(FileNotFoundError):
+                os.unlink(path)
+    logger.info("server stopped")
+
+
+def _close_servers(servers: Iterable[asyncio.Server]) -> None:
+    for server in servers:
+        server.close()
+
+
+async def start_listeners(
+    listeners: Iterable[Listener],
+    transport: str,
+    handler_factory: Callable[[Listener], HandlerFactory],
+) -> list[asyncio.Server]:
+    """Start a server for each listener.
+
+    transport is "streams" or "protocol". handler_factory returns the
+    connection handler factory to use for a listener.
+    """
+    start_tcp, start_unix = _server_starters[transport]
+    servers: list[asyncio.Server] = []
+    try:
+        for listener in listeners:
+            factory = handler_factory(listener)
+            if listener.path is not None:
+                server = await start_unix(listener.path, factory)
+            else:
+                assert listener.port is not None
+                server = await start_tcp(listener.host, listener.port, factory)
+            servers.append(server)
+    except BaseException:
+        _close_servers(servers)
+        raise
+    return servers
+
+
+async def start_stream_server(
+    host: str | None, port: int, handler_factory: HandlerFactory
+) -> asyncio.Server:
+    return await asyncio.start_server(
+        partial(handle_connection, handler_factory), host=host, port=port
+    )
+
+
+async def start_unix_stream_server(
+    path: str, handler_factory: HandlerFactory
+) -> asyncio.Server:
+    return await asyncio.start_unix_server(
+        partial(handle_connection, handler_factory), path=path
+    )
+
+
+async def start_protocol_server(
+    host: str | None, port: int, handler_factory: HandlerFactory
+) -> asyncio.Server:
+    from fakesmtpd.protocol import SMTPProtocol
+
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(
+        partial(SMTPProtocol, handler_factory), host=host, port=port
+    )
+
 
+async def start_unix_protocol_server(
+    path: str, handler_factory: HandlerFactory
+) -> asyncio.Server:
+    from fakesmtpd.protocol import SMTPProtocol
 
-_ServerHandler = Callable[
-    [StreamReader, StreamWriter], Optional[Awaitable[None]]
-]
+    loop = asyncio.get_running_loop()
+    return await loop.create_unix_server(
+        partial(SMTPProtocol, handler_factory), path=path
+    )
 
 
-def run_server(host: str, port: int, handler: _ServerHandler) -> None:
-    loop = asyncio.get_event_loop()
-    loop.add_signal_handler(signal.SIGINT, loop.stop)
-    loop.add_signal_handler(signal.SIGTERM, loop.stop)
-    s = asyncio.start_server(handler, host=host, port=port)
-    loop.run_until_complete(s)
-    loop.run_forever()
+_server_starters = {
+    "streams": (start_stream_server, start_unix_stream_server),
+    "protocol": (start_protocol_server, start_unix_protocol_server),
+}
 
 
 async def handle_connection(
-    printer: Callable[[State], None],
+    handler_factory: HandlerFactory,
     reader: StreamReader,
     writer: StreamWriter,
 ) -> None:
-    await ConnectionHandler(reader, writer, printer).handle()
+    peer = format_peer(writer.get_extra_info("peername"))
+    await handler_factory(reader, writer, peer=peer).handle()
@@ -0,0 +1,142 @@
+"""Registry of open SMTP sessions."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from collections.abc import Iterator
+from typing import TYPE_CHECKING, Any
+
+from fakesmtpd.metrics import metrics
+
+if TYPE_CHECKING:
+    from fakesmtpd.admin import AdminResponse, AdminServer
+    from fakesmtpd.connection import ConnectionHandler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHUTDOWN_TIMEOUT = 10.0
+DEFAULT_HISTORY_SIZE = 1000
+DEFAULT_LIMIT = 100
+
+# Summary fields that live sessions can be sorted by.
+SORT_FIELDS = (
+    "phase_seconds",
+    "duration",
+    "commands",
+    "messages",
+    "bytes_received",
+    "bytes_sent",
+)
+
+
+class SessionRegistry:
+    """Keep track of open sessions, so that they can be drained.
+
+    ConnectionHandler adds itself when a session starts and removes
+    itself when it ends. The summaries of the last history_size sessions
+    that ended are kept in history, oldest first.
+    """
+
+    def __init__(
+        self,
+        shutdown_timeout: float = DEFAULT_SHUTDOWN_TIMEOUT,
+        *,
+        history_size: int = DEFAULT_HISTORY_SIZE,
+    ) -> None:
+        self.shutdown_timeout = shutdown_timeout
+        self.history: deque[dict[str, Any]] = deque(maxlen=history_size)
+        self._sessions: dict[str, ConnectionHandler] = {}
+        self._empty = asyncio.Event()
+        self._empty.set()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __iter__(self) -> Iterator[ConnectionHandler]:
+        return iter(list(self._sessions.values()))
+
+    def add(self, handler: ConnectionHandler) -> None:
+        self._sessions[handler.session_id] = handler
+        self._empty.clear()
+        metrics.set_gauge("sessions_open", len(self._sessions))
+
+    def remove(self, handler: ConnectionHandler) -> None:
+        if self._sessions.pop(handler.session_id, None) is not None:
+            self.history.append(handler.summary())
+        metrics.set_gauge("sessions_open", len(self._sessions))
+        if not self._sessions:
+            self._empty.set()
+
+    async def drain(self, timeout: float | None = None) -> int:
+        """Shut down all sessions and wait for them to end.
+
+        Idle sessions are closed at once, sessions with a mail transaction
+        in progress are closed when the transaction ends. Sessions that
+        are still open after timeout seconds (shutdown_timeout by default)
+        are aborted. Return the number of aborted sessions.
+        """
+        if timeout is None:
+            timeout = self.shutdown_timeout
+        for handler in self:
+            handler.shutdown()
+        try:
+            await asyncio.wait_for(self._empty.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        aborted = list(self)
+        for handler in aborted:
+            logger.warning(
+                "aborting session after shutdown timeout",
+                extra={"session": handler.session_id, "peer": handler.peer},
+            )
+            handler.abort()
+        if aborted:
+            metrics.increment("sessions_aborted", len(aborted))
+        return len(aborted)
+
+
+def add_session_routes(admin: AdminServer, sessions: SessionRegistry) -> None:
+    """Add admin routes to inspect sessions.
+
+    GET /sessions lists open sessions, GET /sessions/history the
+    summaries of sessions that ended, most recent first. Both accept a
+    limit parameter. Open sessions can be filtered by phase (e.g.
+    "data") and sorted in descending order by one of SORT_FIELDS, so
+    that e.g. ?sort=phase_seconds&limit=10 returns the ten sessions that
+    are stuck the longest.
+    """
+    import heapq
+    from http import HTTPStatus
+    from itertools import islice
+    from operator import itemgetter
+
+    def get_sessions(query: dict[str, str]) -> AdminResponse:
+        limit = _limit(query)
+        phase = query.get("phase")
+        sort = query.get("sort")
+        if sort is not None and sort not in SORT_FIELDS:
+            raise ValueError(f"can't sort by {sort}")
+        summaries = [handler.summary() for handler in sessions]
+        if phase is not None:
+            summaries = [s for s in summaries if s["phase"] == phase]
+        if sort is None:
+            selected = summaries[:limit]
+        else:
+            selected = heapq.nlargest(limit, summaries, key=itemgetter(sort))
+        return HTTPStatus.OK, {"count": len(summaries), "sessions": selected}
+
+    def get_history(query: dict[str, str]) -> AdminResponse:
+        history = islice(reversed(sessions.history), _limit(query))
+        return HTTPStatus.OK, {"sessions": list(history)}
+
+    admin.add_route("GET", "/sessions", get_sessions)
+    admin.add_route("GET", "/sessions/history", get_history)
+
+
+def _limit(query: dict[str, str]) -> int:
+    limit = int(query.get("limit", DEFAULT_LIMIT))
+    if limit < 0:
+        raise ValueError("limit must not be negative")
+    return limit
@@ -1,5 +1,7 @@
 from enum import Enum
 
+SMTP_PORT = 25
+
 SMTP_LOCAL_PART_LIMIT = 64  # RFC 5321, section 4.5.3.1.1.
 SMTP_DOMAIN_LIMIT = 255  # RFC 5321, section 4.5.3.1.2.
 SMTP_PATH_LIMIT = 256  # RFC 5321, section 4.5.3.1.3.
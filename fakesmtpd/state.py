@@ -1,53 +1,109 @@
 from __future__ import annotations
 
 import datetime
+from enum import IntEnum
+
+
+class Phase(IntEnum):
+    """Progress of an SMTP session."""
+
+    CONNECTED = 0  # waiting for HELO or EHLO
+    GREETED = 1  # ready for a mail transaction
+    MAIL = 2  # sender was given
+    RCPT = 3  # at least one recipient was given
+    DATA = 4  # receiving the mail text
 
 
 class State:
+    """State of an SMTP session and its current mail transaction.
+
+    A session uses a single State object. It is reset in place when a
+    transaction ends, so mail sinks must copy any data they keep.
+    """
+
+    __slots__ = (
+        "phase",
+        "starttls_available",
+        "date",
+        "reverse_path",
+        "forward_path",
+        "mail_data",
+    )
+
     def __init__(self) -> None:
-        self.greeted = False
+        self.phase = Phase.CONNECTED
+        self.starttls_available = False
         self.date: datetime.datetime | None = None
         self.reverse_path: str | None = None
         self.forward_path: list[str] | None = None
         self.mail_data: str | None = None
 
+    @property
+    def greeted(self) -> bool:
+        return self.phase is not Phase.CONNECTED
+
+    def greet(self) -> None:
+        if self.phase is Phase.CONNECTED:
+            self.phase = Phase.GREETED
+
+    def reset(self) -> None:
+        """Reset the session to its initial state, e.g. after STARTTLS."""
+        self.clear()
+        self.phase = Phase.CONNECTED
+        self.starttls_available = False
+
     def clear(self) -> None:
+        """End the current mail transaction, if any."""
+        self.date = None
         self.reverse_path = None
         self.forward_path = None
         self.mail_data = None
+        if self.phase > Phase.GREETED:
+            self.phase = Phase.GREETED
+
+    def copy(self) -> State:
+        """Return a copy that is not affected when this state is reset."""
+        state = State()
+        state.phase = self.phase
+        state.starttls_available = self.starttls_available
+        state.date = self.date
+        state.reverse_path = self.reverse_path
+        if self.forward_path is not None:
+            state.forward_path = list(self.forward_path)
+        state.mail_data = self.mail_data
+        return state
+
+    def start_mail(self, reverse_path: str) -> None:
+        self.clear()
+        self.reverse_path = reverse_path
+        self.phase = Phase.MAIL
 
     def add_forward_path(self, path: str) -> None:
         if self.forward_path is None:
             self.forward_path = []
         self.forward_path.append(path)
+        self.phase = Phase.RCPT
+
+    def start_data(self) -> None:
+        self.phase = Phase.DATA
 
     def add_line(self, line: str) -> None:
         if self.mail_data is None:
             self.mail_data = ""
         self.mail_data += line
 
+    @property
+    def in_transaction(self) -> bool:
+        return self.phase >= Phase.MAIL
+
     @property
     def mail_allowed(self) -> bool:
-        return (
-            self.greeted
-            and self.reverse_path is None
-            and self.forward_path is None
-            and self.mail_data is None
-        )
+        return self.phase is Phase.GREETED
 
     @property
     def rcpt_allowed(self) -> bool:
-        return (
-            self.greeted
-            and self.reverse_path is not None
-            and self.mail_data is None
-        )
+        return self.phase is Phase.MAIL or self.phase is Phase.RCPT
 
     @property
     def data_allowed(self) -> bool:
-        return (
-            self.greeted
-            and self.reverse_path is not None
-            and self.forward_path is not None
-            and self.mail_data is None
-        )
+        return self.phase is Phase.RCPT
@@ -36,18 +36,39 @@ _IPV6V4_COMP = (
 
 _ESMTP_PARAM = "([a-zA-Z0-9][a-zA-Z0-9-]*)(=([!-<>-~]+))?"
 
-_dot_string_re = re.compile(f"^{_DOT_STRING}$")
-_quoted_string_re = re.compile(f"^{_QUOTED_STRING}$")
-
-_domain_re = re.compile(f"^{_DOMAIN}$")
-_ipv4_re = re.compile(f"^{_IPV4_LITERAL}$")
-_ipv6_full_re = re.compile(f"^{_IPV6_FULL}$")
-_ipv6_comp_re = re.compile(f"^{_IPV6_COMP}$")
-_ipv6v4_full_re = re.compile(f"^{_IPV6V4_FULL}$")
-_ipv6v4_comp_re = re.compile(f"^{_IPV6V4_COMP}$")
-_address_literal_re = re.compile(f"^{_ADDRESS_LITERAL}$")
-
-_esmtp_param_re = re.compile(f"^{_ESMTP_PARAM}$")
+
+class _LazyPattern:
+    """Regular expression that is compiled when it is first used.
+
+    Compiling all patterns takes several milliseconds, which would add
+    to the start-up time of every server process.
+    """
+
+    __slots__ = ("_source", "_pattern")
+
+    def __init__(self, source: str) -> None:
+        self._source = source
+        self._pattern: re.Pattern[str] | None = None
+
+    def match(self, s: str) -> re.Match[str] | None:
+        pattern = self._pattern
+        if pattern is None:
+            pattern = self._pattern = re.compile(self._source)
+        return pattern.match(s)
+
+
+_dot_string_re = _LazyPattern(f"^{_DOT_STRING}$")
+_quoted_string_re = _LazyPattern(f"^{_QUOTED_STRING}$")
+
+_domain_re = _LazyPattern(f"^{_DOMAIN}$")
+_ipv4_re = _LazyPattern(f"^{_IPV4_LITERAL}$")
+_ipv6_full_re = _LazyPattern(f"^{_IPV6_FULL}$")
+_ipv6_comp_re = _LazyPattern(f"^{_IPV6_COMP}$")
+_ipv6v4_full_re = _LazyPattern(f"^{_IPV6V4_FULL}$")
+_ipv6v4_comp_re = _LazyPattern(f"^{_IPV6V4_COMP}$")
+_address_literal_re = _LazyPattern(f"^{_ADDRESS_LITERAL}$")
+
+_esmtp_param_re = _LazyPattern(f"^{_ESMTP_PARAM}$")
 
 
 def is_valid_domain(s: str) -> bool:
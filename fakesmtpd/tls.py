@@ -0,0 +1,35 @@
+"""TLS support for STARTTLS and implicit TLS listeners."""
+
+from __future__ import annotations
+
+import asyncio
+import ssl
+
+# Number of TLS 1.3 session tickets sent after a full handshake. Clients
+# use them to resume the session on their next connections.
+SESSION_TICKETS = 2
+
+
+def create_server_context(
+    certfile: str, keyfile: str | None = None
+) -> ssl.SSLContext:
+    """Create a server-side SSL context.
+
+    certfile is a PEM file with the certificate chain. It may contain
+    the private key, otherwise keyfile is required. Session tickets
+    (TLS 1.3) and the session cache (TLS 1.2) are enabled, so that
+    clients can resume sessions without a full handshake.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    context.options &= ~ssl.OP_NO_TICKET
+    context.num_tickets = SESSION_TICKETS
+    return context
+
+
+def streams_support_tls() -> bool:
+    """Return whether asyncio streams can be upgraded to TLS.
+
+    StreamWriter.start_tls() was added in Python 3.11.
+    """
+    return hasattr(asyncio.StreamWriter, "start_tls")
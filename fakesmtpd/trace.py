@@ -0,0 +1,98 @@
+"""Recording of the raw bytes exchanged in an SMTP session.
+
+A trace file starts with an 8 byte magic string, followed by the session
+start time as a little-endian double (seconds since the epoch). Each
+record consists of a 13 byte header -- direction (1 byte), microseconds
+since session start (8 bytes), and payload length (4 bytes) -- followed
+by the payload.
+"""
+
+from __future__ import annotations
+
+import os
+import struct
+import time
+from collections.abc import Iterator
+from typing import BinaryIO, NamedTuple
+
+TRACE_MAGIC = b"FSMTPTR1"
+TRACE_SUFFIX = ".trace"
+
+INBOUND = 0
+OUTBOUND = 1
+
+_file_header = struct.Struct("<d")
+_record_header = struct.Struct("<BQI")
+
+
+class TraceRecord(NamedTuple):
+    direction: int
+    offset: float  # seconds since session start
+    data: bytes
+
+
+class TraceWriter:
+    """Write the data of one session to a trace file."""
+
+    def __init__(self, path: str | os.PathLike[str]) -> None:
+        self.path = path
+        self._started = time.monotonic()
+        self._file: BinaryIO = open(path, "wb")
+        self._file.write(TRACE_MAGIC)
+        self._file.write(_file_header.pack(time.time()))
+
+    @classmethod
+    def for_session(
+        cls, directory: str | os.PathLike[str], session_id: str
+    ) -> TraceWriter:
+        return cls(os.path.join(directory, session_id + TRACE_SUFFIX))
+
+    def record_inbound(self, data: bytes) -> None:
+        self._record(INBOUND, data)
+
+    def record_outbound(self, data: bytes) -> None:
+        self._record(OUTBOUND, data)
+
+    def _record(self, direction: int, data: bytes) -> None:
+        offset = int((time.monotonic() - self._started) * 1_000_000)
+        self._file.write(_record_header.pack(direction, offset, len(data)))
+        self._file.write(data)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def read_trace(
+    path: str | os.PathLike[str],
+) -> tuple[float, list[TraceRecord]]:
+    """Read a trace file.
+
+    Return the session start time and the list of records. ValueError is
+    raised if the file is not a valid trace file.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f"{path}: not a FakeSMTPd trace file")
+        try:
+            (started,) = _file_header.unpack(
+                _read_exactly(f, _file_header.size)
+            )
+            return started, list(_iter_records(f))
+        except ValueError as exc:
+            raise ValueError(f"{path}: {exc}") from None
+
+
+def _iter_records(f: BinaryIO) -> Iterator[TraceRecord]:
+    while header := f.read(_record_header.size):
+        if len(header) < _record_header.size:
+            raise ValueError("truncated trace record")
+        direction, offset, length = _record_header.unpack(header)
+        data = _read_exactly(f, length)
+        yield TraceRecord(direction, offset / 1_000_000, data)
+
+
+def _read_exactly(f: BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) < size:
+        raise ValueError("truncated trace file")
+    return data
@@ -0,0 +1,349 @@
+"""Notification of received mails over HTTP.
+
+A WebhookNotifier POSTs JSON summaries of received mails to a URL, e.g.
+to a test orchestrator that waits for mails. Mails received within a
+short time window are sent in a single request:
+
+    {
+        "messages": [
+            {
+                "date": "2017-06-04T14:34:15",
+                "sender": "sender@example.com",
+                "recipients": ["receiver@example.com"],
+                "size": 1234,
+                "headers": [["Subject", "Test"], ...],
+                "body": "5891b5b522d5df086d0ff0b110fbd9d21bb4fc7163af34d..."
+            }
+        ]
+    }
+
+"body" is the hash of the body in the body store, or null if there is
+no body store or the mail has no body. The connection to the server is
+kept open between requests. Requests that fail with a connection error,
+a timeout, or a 408, 429, or 5xx response are retried with exponential
+backoff.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from collections.abc import Awaitable
+from typing import Any
+from urllib.parse import urlsplit
+
+from fakesmtpd.bodystore import body_digest
+from fakesmtpd.headers import scan_headers
+from fakesmtpd.mbox import stored_body
+from fakesmtpd.metrics import metrics
+from fakesmtpd.state import State
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_WINDOW = 0.05
+DEFAULT_MAX_BATCH = 100
+DEFAULT_MAX_PENDING = 10_000
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.1
+DEFAULT_TIMEOUT = 5.0
+
+MAX_RESPONSE_HEADER_SIZE = 16 * 1024
+
+_RETRY_STATUSES = frozenset({408, 429})
+
+
+class WebhookError(Exception):
+    """The web hook returned an error response."""
+
+    def __init__(self, status: int) -> None:
+        super().__init__(f"web hook returned status {status}")
+        self.status = status
+
+    @property
+    def retry(self) -> bool:
+        return self.status >= 500 or self.status in _RETRY_STATUSES
+
+
+def mail_summary(state: State, *, body_hash: bool = False) -> dict[str, Any]:
+    """Return the JSON summary of a received mail.
+
+    If body_hash is true, the summary includes the hash of the body as
+    stored in a body store.
+    """
+    assert state.date is not None
+    mail_data = state.mail_data or ""
+    body: str | None = None
+    if body_hash:
+        stored = stored_body(mail_data)
+        if stored is not None:
+            body = body_digest(stored)
+    return {
+        "date": state.date.isoformat(),
+        "sender": state.reverse_path,
+        "recipients": list(state.forward_path or ()),
+        "size": len(mail_data),
+        "headers": [list(field) for field in scan_headers(mail_data)],
+        "body": body,
+    }
+
+
+class _HTTPConnection:
+    """A keep-alive HTTP/1.1 connection to a single server."""
+
+    def __init__(
+        self, host: str, port: int, unix_socket: str | None = None
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    async def _connect(self) -> None:
+        if self.unix_socket is not None:
+            self._reader, self._writer = await asyncio.open_unix_connection(
+                self.unix_socket, limit=MAX_RESPONSE_HEADER_SIZE
+            )
+        else:
+            self._reader, self._writer = await asyncio.open_connection(
+                self.host, self.port, limit=MAX_RESPONSE_HEADER_SIZE
+            )
+        metrics.increment("webhook_connections")
+
+    async def post(self, path: str, body: bytes) -> int:
+        """Send a POST request with a JSON body and return the status.
+
+        If the server closed an idle connection, the request is sent
+        again on a new connection.
+        """
+        if self._writer is not None:
+            try:
+                return await self._request(path, body)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+        await self._connect()
+        try:
+            return await self._request(path, body)
+        except BaseException:
+            self.close()
+            raise
+
+    async def _request(self, path: str, body: bytes) -> int:
+        assert self._reader is not None
+        assert self._writer is not None
+        host = self.host if self.port == 80 else f"{self.host}:{self.port}"
+        head = (
+            f"POST {path} HTTP/1.1\r\n"
+            f"Host: {host}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "\r\n"
+        )
+        self._writer.write(head.encode("ascii") + body)
+        await self._writer.drain()
+        version, status = await self._read_response(self._reader)
+        if version == "HTTP/1.0":
+            self.close()
+        return status
+
+    async def _read_response(
+        self, reader: asyncio.StreamReader
+    ) -> tuple[str, int]:
+        status_line = await reader.readuntil(b"\r\n")
+        version, _, rest = status_line.decode("latin-1").partition(" ")
+        try:
+            status = int(rest[:3])
+        except ValueError:
+            raise ConnectionError("invalid HTTP response") from None
+        headers: dict[str, str] = {}
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            await self._skip_chunked_body(reader)
+        elif "content-length" in headers:
+            await reader.readexactly(int(headers["content-length"]))
+        elif status >= 200 and status not in (204, 304):
+            # The body ends when the server closes the connection.
+            await reader.read()
+            self.close()
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return version, status
+
+    @staticmethod
+    async def _skip_chunked_body(reader: asyncio.StreamReader) -> None:
+        while True:
+            size_line = await reader.readuntil(b"\r\n")
+            size = int(size_line.split(b";")[0], 16)
+            if size == 0:
+                break
+            await reader.readexactly(size + 2)
+        # Skip trailer fields.
+        while await reader.readuntil(b"\r\n") != b"\r\n":
+            pass
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+
+class WebhookNotifier:
+    """Send summaries of received mails to a web hook.
+
+    The notifier is a mail sink that must run in the event loop, e.g.
+    with SinkWorker(..., threaded=False). Summaries are built in a worker
+    thread, so that hashing large bodies doesn't block the event loop.
+    They are collected for batch_window seconds, then sent in requests
+    of at most max_batch mails. If the web hook can't keep up, at most
+    max_pending summaries are kept and further mails are dropped. Mails
+    received after close() are dropped as well.
+
+    url must be an http URL. If unix_socket is given, requests are sent
+    to that socket instead of the host in the URL.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        *,
+        unix_socket: str | None = None,
+        body_hash: bool = False,
+        batch_window: float = DEFAULT_BATCH_WINDOW,
+        max_batch: int = DEFAULT_MAX_BATCH,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        timeout: float = DEFAULT_TIMEOUT,
+    ) -> None:
+        parts = urlsplit(url)
+        if parts.scheme != "http" or not parts.hostname:
+            raise ValueError(f"invalid web hook URL: {url}")
+        if max_batch < 1:
+            raise ValueError("max_batch must be positive")
+        if max_pending < 1:
+            raise ValueError("max_pending must be positive")
+        if retries < 0:
+            raise ValueError("retries must not be negative")
+        if backoff < 0:
+            raise ValueError("backoff must not be negative")
+        if timeout <= 0:
+            raise ValueError("timeout must be positive")
+        self.url = url
+        self.body_hash = body_hash
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._path = parts.path or "/"
+        if parts.query:
+            self._path += "?" + parts.query
+        self._connection = _HTTPConnection(
+            parts.hostname, parts.port or 80, unix_socket
+        )
+        self._pending: deque[dict[str, Any]] = deque()
+        self._task: asyncio.Task[None] | None = None
+        self._closed = False
+
+    def __len__(self) -> int:
+        """Number of summaries waiting to be sent."""
+        return len(self._pending)
+
+    def __call__(self, state: State) -> Awaitable[None] | None:
+        if self._closed or len(self._pending) >= self.max_pending:
+            metrics.increment("webhook_dropped")
+            return None
+        return self._add(state)
+
+    async def _add(self, state: State) -> None:
+        summary = await asyncio.to_thread(
+            mail_summary, state, body_hash=self.body_hash
+        )
+        if self._closed:
+            metrics.increment("webhook_dropped")
+            return
+        self._pending.append(summary)
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        try:
+            await asyncio.sleep(self.batch_window)
+            while self._pending:
+                count = min(len(self._pending), self.max_batch)
+                batch = [self._pending.popleft() for _ in range(count)]
+                await self._send(batch)
+        finally:
+            self._task = None
+            if self._closed:
+                self._connection.close()
+
+    async def _send(self, batch: list[dict[str, Any]]) -> None:
+        body = json.dumps({"messages": batch}).encode("utf-8")
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                metrics.increment("webhook_retries")
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            start = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(
+                    self._connection.post(self._path, body), self.timeout
+                )
+                if not 200 <= status < 300:
+                    raise WebhookError(status)
+            except WebhookError as exc:
+                error: Exception = exc
+                if not exc.retry:
+                    break
+            except (
+                OSError,
+                EOFError,
+                ValueError,
+                asyncio.LimitOverrunError,
+                asyncio.TimeoutError,
+            ) as exc:
+                error = exc
+                self._connection.close()
+            else:
+                metrics.observe(
+                    "webhook_request_seconds", time.perf_counter() - start
+                )
+                metrics.increment("webhook_notifications", len(batch))
+                return
+        metrics.increment("webhook_errors")
+        metrics.increment("webhook_dropped", len(batch))
+        logger.warning(
+            "can't notify web hook %s: %s, %d mails dropped",
+            self.url,
+            error,
+            len(batch),
+        )
+
+    async def aclose(self) -> None:
+        """Send the pending summaries, then close the connection."""
+        if self._task is not None:
+            await self._task
+        self._connection.close()
+
+    def close(self) -> None:
+        """Close the connection.
+
+        Summaries that are still pending are dropped, unless they are
+        being sent by a running task, which closes the connection when
+        it is done.
+        """
+        self._closed = True
+        if self._task is None or self._task.done():
+            if self._pending:
+                metrics.increment("webhook_dropped", len(self._pending))
+                self._pending.clear()
+            self._connection.close()
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from http import HTTPStatus
+
+from fakesmtpd.admin import AdminResponse, AdminServer
+
+
+def _ok(query: dict[str, str]) -> AdminResponse:
+    return HTTPStatus.OK, {"query": query}
+
+
+async def _async_ok(query: dict[str, str]) -> AdminResponse:
+    return HTTPStatus.CREATED, {}
+
+
+def _invalid(query: dict[str, str]) -> AdminResponse:
+    raise ValueError("invalid value")
+
+
+def _conflict(query: dict[str, str]) -> AdminResponse:
+    raise RuntimeError("already running")
+
+
+class TestDispatch:
+    def _dispatch(
+        self, method: str, path: str, query: dict[str, str] | None = None
+    ) -> AdminResponse:
+        admin = AdminServer()
+        admin.add_route("GET", "/ok", _ok)
+        admin.add_route("POST", "/async", _async_ok)
+        admin.add_route("POST", "/invalid", _invalid)
+        admin.add_route("POST", "/conflict", _conflict)
+        return asyncio.run(admin.dispatch(method, path, query or {}))
+
+    def test_ok(self) -> None:
+        assert self._dispatch("get", "/ok", {"a": "b"}) == (
+            HTTPStatus.OK,
+            {"query": {"a": "b"}},
+        )
+
+    def test_async(self) -> None:
+        assert self._dispatch("POST", "/async")[0] == HTTPStatus.CREATED
+
+    def test_not_found(self) -> None:
+        assert self._dispatch("GET", "/unknown")[0] == HTTPStatus.NOT_FOUND
+
+    def test_method_not_allowed(self) -> None:
+        status, _ = self._dispatch("POST", "/ok")
+        assert status == HTTPStatus.METHOD_NOT_ALLOWED
+
+    def test_value_error(self) -> None:
+        assert self._dispatch("POST", "/invalid") == (
+            HTTPStatus.BAD_REQUEST,
+            {"error": "invalid value"},
+        )
+
+    def test_runtime_error(self) -> None:
+        assert self._dispatch("POST", "/conflict")[0] == HTTPStatus.CONFLICT
+
+
+class TestAdminServer:
+    def _request(self, request: bytes) -> bytes:
+        async def run() -> bytes:
+            admin = AdminServer()
+            admin.add_route("GET", "/ok", _ok)
+            async with admin.serving("127.0.0.1", 0) as server:
+                port = server.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection(
+                    "127.0.0.1", port
+                )
+                writer.write(request)
+                response = await reader.read()
+                writer.close()
+                return response
+
+        return asyncio.run(run())
+
+    def test_request(self) -> None:
+        response = self._request(
+            b"GET /ok?x=1 HTTP/1.1\r\nHost: localhost\r\n\r\n"
+        )
+        head, body = response.split(b"\r\n\r\n", 1)
+        assert head.startswith(b"HTTP/1.1 200 OK\r\n")
+        assert b"Content-Type: application/json" in head
+        assert json.loads(body) == {"query": {"x": "1"}}
+
+    def test_request_with_body(self) -> None:
+        response = self._request(
+            b"GET /ok HTTP/1.1\r\nContent-Length: 3\r\n\r\nabc"
+        )
+        assert response.startswith(b"HTTP/1.1 200 OK\r\n")
+
+    def test_bad_request(self) -> None:
+        response = self._request(b"INVALID\r\n\r\n")
+        assert response.startswith(b"HTTP/1.1 400 Bad Request\r\n")
@@ -0,0 +1,46 @@
+import hashlib
+import os
+from pathlib import Path
+
+import pytest
+
+from fakesmtpd.bodystore import BodyStore
+from fakesmtpd.metrics import metrics
+
+
+class TestBodyStore:
+    def test_create_directory(self, tmp_path: Path) -> None:
+        BodyStore(str(tmp_path / "a" / "b"))
+        assert (tmp_path / "a" / "b").is_dir()
+
+    def test_put_get(self, tmp_path: Path) -> None:
+        store = BodyStore(str(tmp_path))
+        digest = store.put(b"Text\n")
+        assert digest == hashlib.sha256(b"Text\n").hexdigest()
+        assert store.path(digest) == os.path.join(
+            str(tmp_path), digest[:2], digest
+        )
+        assert store.get(digest) == b"Text\n"
+
+    def test_deduplicate(self, tmp_path: Path) -> None:
+        store = BodyStore(str(tmp_path))
+        first = store.put(b"Text\n")
+        assert store.put(b"Text\n") == first
+        assert store.put(b"Other\n") != first
+        counters = metrics.snapshot()["counters"]
+        assert counters["bodies_stored"] == 2
+        assert counters["bodies_deduplicated"] == 1
+        assert counters["body_bytes_stored"] == 11
+        files = [p for p in tmp_path.rglob("*") if p.is_file()]
+        assert len(files) == 2
+
+    def test_existing_body(self, tmp_path: Path) -> None:
+        digest = BodyStore(str(tmp_path)).put(b"Text\n")
+        store = BodyStore(str(tmp_path))
+        assert store.put(b"Text\n") == digest
+        assert metrics.snapshot()["counters"]["bodies_deduplicated"] == 1
+
+    def test_get_missing(self, tmp_path: Path) -> None:
+        store = BodyStore(str(tmp_path))
+        with pytest.raises(FileNotFoundError):
+            store.get(hashlib.sha256(b"").hexdigest())
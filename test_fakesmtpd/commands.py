@@ -8,7 +8,9 @@ from fakesmtpd.commands import (
     handle_helo,
     handle_mail,
     handle_rcpt,
+    handle_starttls,
 )
+from fakesmtpd.policy import RecipientPolicy
 from fakesmtpd.smtp import (
     SMTP_DOMAIN_LIMIT,
     SMTP_LOCAL_PART_LIMIT,
@@ -19,30 +21,28 @@ from fakesmtpd.state import State
 
 
 @pytest.fixture(autouse=True)
-def getfqdn(mocker: MockerFixture) -> Mock:
+def server_name(mocker: MockerFixture) -> Mock:
     return mocker.patch(
-        "fakesmtpd.commands.getfqdn",
+        "fakesmtpd.commands.server_name",
         return_value="smtp.example.com",
     )
 
 
 class TestEHLO:
-    def test_domain(self, getfqdn: Mock) -> None:
+    def test_domain(self, server_name: Mock) -> None:
         state = State()
-        state.greeted = False
-        getfqdn.return_value = "smtp.example.org"
+        server_name.return_value = "smtp.example.org"
         code, message = handle_ehlo(state, "example.com")
         assert code == SMTPStatus.OK
-        assert message == "smtp.example.org Hello example.com"
+        assert message == "smtp.example.org Hello example.com\nPIPELINING"
         assert state.greeted
 
-    def test_address_literal(self, getfqdn: Mock) -> None:
+    def test_address_literal(self, server_name: Mock) -> None:
         state = State()
-        state.greeted = False
-        getfqdn.return_value = "smtp.example.org"
+        server_name.return_value = "smtp.example.org"
         code, message = handle_ehlo(state, "[192.168.99.22]")
         assert code == SMTPStatus.OK
-        assert message == "smtp.example.org Hello [192.168.99.22]"
+        assert message == "smtp.example.org Hello [192.168.99.22]\nPIPELINING"
         assert state.greeted
 
     def test_empty_argument(self) -> None:
@@ -55,16 +55,25 @@ class TestEHLO:
         assert code == SMTPStatus.SYNTAX_ERROR_IN_PARAMETERS
         assert message == "Syntax error in arguments"
 
+    def test_starttls_available(self, server_name: Mock) -> None:
+        state = State()
+        state.starttls_available = True
+        server_name.return_value = "smtp.example.org"
+        code, message = handle_ehlo(state, "example.com")
+        assert code == SMTPStatus.OK
+        assert message == (
+            "smtp.example.org Hello example.com\nPIPELINING\nSTARTTLS"
+        )
+
 
 class TestHELO:
     def test_set_greeted(self) -> None:
         state = State()
-        state.greeted = False
         handle_helo(state, "example.com")
         assert state.greeted
 
-    def test_response(self, getfqdn: Mock) -> None:
-        getfqdn.return_value = "smtp.example.org"
+    def test_response(self, server_name: Mock) -> None:
+        server_name.return_value = "smtp.example.org"
         code, message = handle_helo(State(), "example.com")
         assert code == SMTPStatus.OK
         assert message == "smtp.example.org Hello example.com"
@@ -83,7 +92,7 @@ class TestHELO:
 class TestMAIL:
     def test_with_mailbox(self) -> None:
         state = State()
-        state.greeted = True
+        state.greet()
         code, message = handle_mail(state, "FROM:<foo@example.com>")
         assert code == SMTPStatus.OK
         assert message == "Sender OK"
@@ -91,7 +100,7 @@ class TestMAIL:
 
     def test_empty_path(self) -> None:
         state = State()
-        state.greeted = True
+        state.greet()
         code, message = handle_mail(state, "FROM:<>")
         assert code == SMTPStatus.OK
         assert message == "Sender OK"
@@ -99,7 +108,7 @@ class TestMAIL:
 
     def test_with_arguments(self) -> None:
         state = State()
-        state.greeted = True
+        state.greet()
         code, message = handle_mail(
             state, "FROM:<foo@example.com> foo=bar abc"
         )
@@ -109,7 +118,7 @@ class TestMAIL:
 
     def test_with_arguments_and_quoted_local_part(self) -> None:
         state = State()
-        state.greeted = True
+        state.greet()
         code, message = handle_mail(
             state, 'FROM:<"foo bar"@example.com> foo=bar'
         )
@@ -153,38 +162,40 @@ class TestMAIL:
 
     def test_invalid_argument(self) -> None:
         state = State()
-        state.greeted = True
+        state.greet()
         code, message = handle_mail(state, "FROM:<foo@example.com> -foo=bar")
         assert code == SMTPStatus.SYNTAX_ERROR_IN_PARAMETERS
         assert message == "Syntax error in arguments"
 
     def test_not_greeted(self) -> None:
         state = State()
-        state.greeted = False
         code, message = handle_mail(state, "FROM:<foo@example.com>")
         assert code == SMTPStatus.BAD_SEQUENCE
         assert message == "No EHLO sent"
 
     def test_has_reverse_path(self) -> None:
         state = State()
-        state.greeted = True
-        state.reverse_path = "bar@example.org"
+        state.greet()
+        state.start_mail("bar@example.org")
         code, message = handle_mail(state, "FROM:<foo@example.com>")
         assert code == SMTPStatus.BAD_SEQUENCE
         assert message == "Bad command sequence"
 
     def test_has_forward_path(self) -> None:
         state = State()
-        state.greeted = True
-        state.forward_path = ["bar@example.org"]
+        state.greet()
+        state.start_mail("foo@example.org")
+        state.add_forward_path("bar@example.org")
         code, message = handle_mail(state, "FROM:<foo@example.com>")
         assert code == SMTPStatus.BAD_SEQUENCE
         assert message == "Bad command sequence"
 
     def test_has_mail_data(self) -> None:
         state = State()
-        state.greeted = True
-        state.mail_data = ""
+        state.greet()
+        state.start_mail("foo@example.org")
+        state.add_forward_path("bar@example.org")
+        state.start_data()
         code, message = handle_mail(state, "FROM:<foo@example.com>")
         assert code == SMTPStatus.BAD_SEQUENCE
         assert message == "Bad command sequence"
@@ -193,24 +204,24 @@ class TestMAIL:
 class TestRCPT:
     def test_response(self) -> None:
         state = State()
-        state.greeted = True
-        state.reverse_path = "bar@example.org"
+        state.greet()
+        state.start_mail("bar@example.org")
         code, message = handle_rcpt(state, "TO:<foo@example.com>")
         assert code == SMTPStatus.OK
         assert message == "Receiver OK"
 
     def test_forward_paths_added(self) -> None:
         state = State()
-        state.greeted = True
-        state.reverse_path = "bar@example.org"
+        state.greet()
+        state.start_mail("bar@example.org")
         handle_rcpt(state, "TO:<foo1@example.com>")
         handle_rcpt(state, "TO:<foo2@example.com>")
         assert state.forward_path == ["foo1@example.com", "foo2@example.com"]
 
     def test_postmaster(self) -> None:
         state = State()
-        state.greeted = True
-        state.reverse_path = "bar@example.org"
+        state.greet()
+        state.start_mail("bar@example.org")
         code, message = handle_rcpt(state, "TO:<postMaster> foo")
         assert code == SMTPStatus.OK
         assert message == "Receiver OK"
@@ -218,13 +229,27 @@ class TestRCPT:
 
     def test_with_arguments(self) -> None:
         state = State()
-        state.greeted = True
-        state.reverse_path = "bar@example.org"
+        state.greet()
+        state.start_mail("bar@example.org")
         code, message = handle_rcpt(state, "TO:<foo@example.com> foo=bar baz")
         assert code == SMTPStatus.OK
         assert message == "Receiver OK"
         assert state.forward_path == ["foo@example.com"]
 
+    def test_recipient_policy(self) -> None:
+        policy = RecipientPolicy(["example.com"])
+        state = State()
+        state.greet()
+        state.start_mail("bar@example.org")
+        code, message = handle_rcpt(state, "TO:<foo@example.com>", policy)
+        assert code == SMTPStatus.OK
+        code, message = handle_rcpt(state, "TO:<foo@example.org>", policy)
+        assert code == SMTPStatus.MAILBOX_PERMANENTLY_UNAVAILABLE
+        assert message == "No such user here"
+        code, message = handle_rcpt(state, "TO:<Postmaster>", policy)
+        assert code == SMTPStatus.OK
+        assert state.forward_path == ["foo@example.com", "Postmaster"]
+
     def test_empty_argument(self) -> None:
         code, message = handle_rcpt(State(), "")
         assert code == SMTPStatus.SYNTAX_ERROR_IN_PARAMETERS
@@ -268,25 +293,58 @@ class TestRCPT:
 
     def test_not_greeted(self) -> None:
         state = State()
-        state.greeted = False
-        state.reverse_path = "bar@example.org"
         code, message = handle_rcpt(state, "TO:<foo@example.com>")
         assert code == SMTPStatus.BAD_SEQUENCE
         assert message == "Bad command sequence"
 
     def test_no_reverse_path(self) -> None:
         state = State()
-        state.greeted = True
-        state.reverse_path = None
+        state.greet()
         code, message = handle_rcpt(state, "TO:<foo@example.com>")
         assert code == SMTPStatus.BAD_SEQUENCE
         assert message == "Bad command sequence"
 
     def test_mail_data(self) -> None:
         state = State()
-        state.greeted = True
-        state.reverse_path = "bar@example.org"
-        state.mail_data = ""
+        state.greet()
+        state.start_mail("bar@example.org")
+        state.add_forward_path("foo@example.org")
+        state.start_data()
         code, message = handle_rcpt(state, "TO:<foo@example.com>")
         assert code == SMTPStatus.BAD_SEQUENCE
         assert message == "Bad command sequence"
+
+
+class TestSTARTTLS:
+    def _state(self) -> State:
+        state = State()
+        state.greet()
+        state.starttls_available = True
+        return state
+
+    def test_ready(self) -> None:
+        code, message = handle_starttls(self._state(), "")
+        assert code == SMTPStatus.SERVICE_READY
+        assert message == "Ready to start TLS"
+
+    def test_not_available(self) -> None:
+        state = self._state()
+        state.starttls_available = False
+        code, message = handle_starttls(state, "")
+        assert code == SMTPStatus.COMMAND_NOT_IMPLEMENTED
+
+    def test_arguments(self) -> None:
+        code, message = handle_starttls(self._state(), "foo")
+        assert code == SMTPStatus.SYNTAX_ERROR_IN_PARAMETERS
+
+    def test_not_greeted(self) -> None:
+        state = State()
+        state.starttls_available = True
+        code, message = handle_starttls(state, "")
+        assert code == SMTPStatus.BAD_SEQUENCE
+
+    def test_in_transaction(self) -> None:
+        state = self._state()
+        state.start_mail("foo@example.com")
+        code, message = handle_starttls(state, "")
+        assert code == SMTPStatus.BAD_SEQUENCE
@@ -0,0 +1,440 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from collections.abc import Iterator
+from http import HTTPStatus
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from fakesmtpd.admin import AdminServer
+from fakesmtpd.config import (
+    ConfigError,
+    ServerConfig,
+    Settings,
+    add_config_routes,
+    load_config,
+    parse_settings,
+)
+from fakesmtpd.log import set_command_sample_rate
+from fakesmtpd.replies import server_name
+from fakesmtpd.sessions import SessionRegistry
+from test_fakesmtpd.connection import FakeStreamReader, FakeStreamWriter
+from test_fakesmtpd.helpers import make_state
+
+
+@pytest.fixture(autouse=True)
+def restore_logging() -> Iterator[None]:
+    root = logging.getLogger()
+    level = root.level
+    yield
+    root.setLevel(level)
+    set_command_sample_rate(1.0)
+
+
+class TestParseSettings:
+    def test_defaults(self) -> None:
+        assert parse_settings({}, Settings()) == Settings()
+
+    def test_override(self) -> None:
+        settings = parse_settings(
+            {"output_filename": "out.mbox", "shutdown_timeout": 3},
+            Settings(trace_dir="/tmp"),
+        )
+        assert settings.output_filename == "out.mbox"
+        assert settings.shutdown_timeout == 3
+        assert settings.trace_dir == "/tmp"
+
+    @pytest.mark.parametrize(
+        "data",
+        [
+            {"unknown": 1},
+            {"write_buffer_high": "1"},
+            {"write_buffer_high": True},
+            {"write_buffer_high": 10, "write_buffer_low": 20},
+            {"shutdown_timeout": -1},
+            {"log_level": "TRACE"},
+            {"log_sample_rate": 2},
+            {"rate_limits": "peer:messages=1/s"},
+            {"rate_limits": [1]},
+            {"rate_limits": ["peer:messages=1"]},
+            {"output_queue_size": 0},
+            {"output_queue_policy": "ignore"},
+            {"mailbox_route": "sender"},
+            {"max_open_mailboxes": 0},
+            {"webhook_socket": "/run/hook.sock"},
+        ],
+    )
+    def test_invalid(self, data: dict[str, Any]) -> None:
+        with pytest.raises(ConfigError):
+            parse_settings(data, Settings())
+
+
+class TestLoadConfig:
+    def test_load(self, tmp_path: Path) -> None:
+        path = tmp_path / "config.json"
+        path.write_text('{"log_level": "DEBUG"}')
+        settings = load_config(str(path), Settings())
+        assert settings == Settings(log_level="DEBUG")
+
+    def test_missing(self, tmp_path: Path) -> None:
+        with pytest.raises(ConfigError):
+            load_config(str(tmp_path / "missing.json"), Settings())
+
+    @pytest.mark.parametrize("content", ["{", "[]"])
+    def test_invalid(self, tmp_path: Path, content: str) -> None:
+        path = tmp_path / "config.json"
+        path.write_text(content)
+        with pytest.raises(ConfigError):
+            load_config(str(path), Settings())
+
+
+class TestServerConfig:
+    @pytest.fixture
+    def config_file(self, tmp_path: Path) -> Path:
+        return tmp_path / "config.json"
+
+    def _write_config(self, path: Path, **settings: object) -> None:
+        path.write_text(json.dumps(settings))
+
+    def test_config_file_takes_precedence(self, config_file: Path) -> None:
+        self._write_config(config_file, write_buffer_high=1000)
+        defaults = Settings(write_buffer_high=500, write_buffer_low=100)
+        config = ServerConfig(defaults, str(config_file))
+        assert config.settings.write_buffer_high == 1000
+        assert config.settings.write_buffer_low == 100
+
+    def test_create_handler(self, config_file: Path) -> None:
+        self._write_config(
+            config_file, write_buffer_high=1000, write_buffer_low=10
+        )
+        sessions = SessionRegistry()
+        config = ServerConfig(Settings(), str(config_file), sessions=sessions)
+        writer = FakeStreamWriter()
+        handler = config.create_handler(FakeStreamReader(), writer, peer="p")
+        assert handler.peer == "p"
+        assert writer.transport.limits == (10, 1000)
+        asyncio.run(handler.handle())
+
+    def test_reload(self, tmp_path: Path, config_file: Path) -> None:
+        old_output = tmp_path / "old.mbox"
+        new_output = tmp_path / "new.mbox"
+        self._write_config(config_file, output_filename=str(old_output))
+        sessions = SessionRegistry()
+        config = ServerConfig(Settings(), str(config_file), sessions=sessions)
+        writer = FakeStreamWriter()
+        old_handler = config.create_handler(FakeStreamReader(), writer)
+        old_handler.print_mail(make_state())
+
+        self._write_config(
+            config_file,
+            output_filename=str(new_output),
+            shutdown_timeout=1.5,
+            log_level="WARNING",
+        )
+        settings = config.reload()
+        assert settings.output_filename == str(new_output)
+        assert config.settings is settings
+        assert sessions.shutdown_timeout == 1.5
+        assert logging.getLogger().level == logging.WARNING
+        new_handler = config.create_handler(FakeStreamReader(), writer)
+
+        # Mails of open sessions go to the new output file.
+        old_handler.print_mail(make_state())
+        new_handler.print_mail(make_state())
+        config.close()
+        assert old_output.read_text().count("From sender@example.com") == 1
+        assert new_output.read_text().count("From sender@example.com") == 2
+
+    def test_reload__close_retired_sinks(self, tmp_path: Path) -> None:
+        old_output = tmp_path / "old.mbox"
+        new_output = tmp_path / "new.mbox"
+        config = ServerConfig(Settings(output_filename=str(old_output)))
+        handler = config.create_handler(FakeStreamReader(), FakeStreamWriter())
+
+        async def run() -> None:
+            handler.print_mail(make_state())
+            config.defaults = config.defaults._replace(
+                output_filename=str(new_output)
+            )
+            config.reload()
+            await config.drain()
+            assert config._retired == []
+            old_output.rename(tmp_path / "old.mbox.1")
+            handler.print_mail(make_state())
+            await config.drain()
+
+        asyncio.run(run())
+        config.close()
+        assert not old_output.exists()
+        assert (tmp_path / "old.mbox.1").read_text().count("From ") == 1
+        assert new_output.read_text().count("From ") == 1
+
+    def test_reload__reopen(self, tmp_path: Path) -> None:
+        output = tmp_path / "out.mbox"
+        rotated = tmp_path / "out.mbox.1"
+        config = ServerConfig(Settings(output_filename=str(output)))
+        handler = config.create_handler(FakeStreamReader(), FakeStreamWriter())
+
+        async def run() -> None:
+            handler.print_mail(make_state())
+            await config.drain()
+            output.rename(rotated)
+            config.reload()
+            handler.print_mail(make_state())
+            await config.drain()
+
+        asyncio.run(run())
+        config.close()
+        assert rotated.read_text().count("From ") == 1
+        assert output.read_text().count("From ") == 1
+
+    def test_body_store(self, tmp_path: Path, config_file: Path) -> None:
+        output = tmp_path / "out.mbox"
+        self._write_config(config_file, output_filename=str(output))
+        config = ServerConfig(Settings(), str(config_file))
+        handler = config.create_handler(FakeStreamReader(), FakeStreamWriter())
+        handler.print_mail(make_state())
+        self._write_config(
+            config_file,
+            output_filename=str(output),
+            body_store=str(tmp_path / "bodies"),
+        )
+        config.reload()
+        handler = config.create_handler(FakeStreamReader(), FakeStreamWriter())
+        handler.print_mail(make_state())
+        config.close()
+        content = output.read_text()
+        assert content.count("Text") == 1
+        assert content.count("X-FakeSMTPd-Body: ") == 1
+        assert len(list((tmp_path / "bodies").rglob("*"))) == 2
+
+    def test_body_store__invalid(self, tmp_path: Path) -> None:
+        (tmp_path / "file").write_text("")
+        with pytest.raises(ConfigError, match="can't create body store"):
+            ServerConfig(Settings(body_store=str(tmp_path / "file")))
+
+    def test_trace_dir(self, tmp_path: Path, config_file: Path) -> None:
+        trace_dir = tmp_path / "traces"
+        ServerConfig(Settings(trace_dir=str(trace_dir)))
+        assert trace_dir.is_dir()
+        self._write_config(config_file)
+        config = ServerConfig(Settings(), str(config_file))
+        self._write_config(config_file, trace_dir=str(tmp_path / "new"))
+        config.reload()
+        assert (tmp_path / "new").is_dir()
+
+    def test_trace_dir__invalid(self, tmp_path: Path) -> None:
+        (tmp_path / "file").write_text("")
+        with pytest.raises(ConfigError, match="can't create trace dir"):
+            ServerConfig(Settings(trace_dir=str(tmp_path / "file")))
+
+    def test_reload__output_queue(self, tmp_path: Path) -> None:
+        output = tmp_path / "out.mbox"
+        config = ServerConfig(Settings(output_filename=str(output)))
+        old_handler = config.create_handler(
+            FakeStreamReader(), FakeStreamWriter()
+        )
+        config.defaults = config.defaults._replace(output_queue_size=10)
+        sinks = config._sinks
+
+        async def run() -> None:
+            old_handler.print_mail(make_state())
+            config.reload()
+            assert config._sinks is sinks
+            new_handler = config.create_handler(
+                FakeStreamReader(), FakeStreamWriter()
+            )
+            new_handler.print_mail(make_state())
+            await config.drain()
+            assert config._retired == []
+            # The reused sinks were not closed with the retired pipeline.
+            assert sinks.output._file is not None
+
+        asyncio.run(run())
+        config.close()
+        assert output.read_text().count("From sender@example.com") == 2
+
+    def test_close__queued_mails(self, tmp_path: Path) -> None:
+        output = tmp_path / "out.mbox"
+        config = ServerConfig(Settings(output_filename=str(output)))
+        handler = config.create_handler(FakeStreamReader(), FakeStreamWriter())
+        handler.print_mail(make_state())
+        config.close()
+        assert output.read_text().startswith("From sender@example.com")
+
+    def test_mailbox_dir(self, tmp_path: Path) -> None:
+        mailboxes = tmp_path / "mail"
+        config = ServerConfig(
+            Settings(
+                output_filename=str(tmp_path / "out.mbox"),
+                mailbox_dir=str(mailboxes),
+                mailbox_route="domain",
+            )
+        )
+        handler = config.create_handler(FakeStreamReader(), FakeStreamWriter())
+        handler.print_mail(make_state())
+        config.close()
+        assert (tmp_path / "out.mbox").exists()
+        content = (mailboxes / "example.com.mbox").read_text()
+        assert content.startswith("From sender@example.com")
+
+    def test_webhook(self, tmp_path: Path) -> None:
+        requests: list[Any] = []
+
+        async def handle_hook(
+            reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+        ) -> None:
+            header = await reader.readuntil(b"\r\n\r\n")
+            length = int(header.split(b"Content-Length: ")[1].split()[0])
+            requests.append(json.loads(await reader.readexactly(length)))
+            writer.write(b"HTTP/1.1 204 No Content\r\n\r\n")
+            writer.close()
+
+        async def run() -> None:
+            server = await asyncio.start_unix_server(
+                handle_hook, str(tmp_path / "hook.sock")
+            )
+            config = ServerConfig(
+                Settings(
+                    output_filename=str(tmp_path / "out.mbox"),
+                    webhook_url="http://orchestrator/mails",
+                    webhook_socket=str(tmp_path / "hook.sock"),
+                )
+            )
+            handler = config.create_handler(
+                FakeStreamReader(), FakeStreamWriter()
+            )
+            handler.print_mail(make_state())
+            await config.drain()
+            config.close()
+            server.close()
+
+        asyncio.run(run())
+        assert len(requests) == 1
+        assert requests[0]["messages"][0]["sender"] == "sender@example.com"
+        assert (tmp_path / "out.mbox").read_text().startswith("From ")
+
+    def test_webhook__invalid_url(self) -> None:
+        with pytest.raises(ConfigError):
+            ServerConfig(Settings(webhook_url="ftp://example.com/"))
+
+    def test_reload__invalid(self, config_file: Path) -> None:
+        self._write_config(config_file, log_level="ERROR")
+        config = ServerConfig(Settings(), str(config_file))
+        config_file.write_text("{")
+        with pytest.raises(ConfigError):
+            config.reload()
+        assert config.settings.log_level == "ERROR"
+
+    def test_tls(self, tmp_path: Path, config_file: Path) -> None:
+        cert_file = str(Path(__file__).parent / "localhost.pem")
+        config = ServerConfig(Settings())
+        assert config.tls_context is None
+        config = ServerConfig(Settings(tls_cert=cert_file))
+        assert config.tls_context is not None
+        writer = FakeStreamWriter()
+        handler = config.create_handler(FakeStreamReader(), writer)
+        assert handler.state.starttls_available
+
+    def test_tls__invalid_cert(self, tmp_path: Path) -> None:
+        with pytest.raises(ConfigError):
+            ServerConfig(Settings(tls_cert=str(tmp_path / "missing.pem")))
+
+    def test_reload__disable_tls(self, config_file: Path) -> None:
+        cert_file = str(Path(__file__).parent / "localhost.pem")
+        self._write_config(config_file, tls_cert=cert_file)
+        config = ServerConfig(Settings(), str(config_file))
+        self._write_config(config_file)
+        with pytest.raises(ConfigError):
+            config.reload()
+        assert config.tls_context is not None
+
+    def test_fault_rules(self, tmp_path: Path, config_file: Path) -> None:
+        rules_file = tmp_path / "faults.json"
+        rules_file.write_text('[{"command": "DATA", "delay": 0.1}]')
+        self._write_config(config_file)
+        config = ServerConfig(Settings(), str(config_file))
+        assert config.fault_rules is None
+        self._write_config(config_file, fault_rules=str(rules_file))
+        config.reload()
+        assert config.fault_rules is not None
+        assert len(config.fault_rules) == 1
+        handler = config.create_handler(FakeStreamReader(), FakeStreamWriter())
+        assert handler._faults is config.fault_rules
+
+    def test_fault_rules__invalid(self, tmp_path: Path) -> None:
+        rules_file = tmp_path / "faults.json"
+        rules_file.write_text('[{"command": "DATA", "delay": "slow"}]')
+        with pytest.raises(ConfigError):
+            ServerConfig(Settings(fault_rules=str(rules_file)))
+        with pytest.raises(ConfigError):
+            ServerConfig(Settings(fault_rules=str(tmp_path / "missing")))
+
+    def test_recipient_policy(self, tmp_path: Path, config_file: Path) -> None:
+        policy_file = tmp_path / "recipients.txt"
+        policy_file.write_text("example.com\n")
+        self._write_config(config_file, recipient_policy=str(policy_file))
+        config = ServerConfig(Settings(), str(config_file))
+        policy = config.recipient_policy
+        assert policy is not None
+        assert not policy.accepts("foo@example.org")
+        assert policy.accepts(f"postmaster@{server_name()}")
+        handler = config.create_handler(FakeStreamReader(), FakeStreamWriter())
+        assert handler._recipient_policy is policy
+        policy_file.write_text("example.com\nexample.org\n")
+        config.reload()
+        assert config.recipient_policy is not policy
+        assert config.recipient_policy is not None
+        assert config.recipient_policy.accepts("foo@example.org")
+        assert handler._recipient_policy is policy
+
+    def test_recipient_policy__invalid(self, tmp_path: Path) -> None:
+        policy_file = tmp_path / "recipients.txt"
+        policy_file.write_text("foo@\n")
+        with pytest.raises(ConfigError):
+            ServerConfig(Settings(recipient_policy=str(policy_file)))
+        with pytest.raises(ConfigError):
+            ServerConfig(Settings(recipient_policy=str(tmp_path / "missing")))
+
+    def test_rate_limits(self, config_file: Path) -> None:
+        self._write_config(config_file, rate_limits=["peer:messages=1/s"])
+        config = ServerConfig(Settings(), str(config_file))
+        limiter = config.rate_limiter
+        assert limiter is not None
+        handler = config.create_handler(FakeStreamReader(), FakeStreamWriter())
+        assert handler._rate_limiter is limiter
+        config.reload()
+        assert config.rate_limiter is limiter
+        self._write_config(config_file, rate_limits=["peer:messages=2/s"])
+        config.reload()
+        assert config.rate_limiter is not limiter
+        self._write_config(config_file)
+        config.reload()
+        assert config.rate_limiter is None
+
+
+class TestConfigRoutes:
+    def test_routes(self, tmp_path: Path) -> None:
+        config_file = tmp_path / "config.json"
+        config_file.write_text('{"log_level": "WARNING"}')
+        config = ServerConfig(Settings(), str(config_file))
+        admin = AdminServer()
+        add_config_routes(admin, config)
+
+        status, body = asyncio.run(admin.dispatch("GET", "/config", {}))
+        assert status == HTTPStatus.OK
+        assert body["log_level"] == "WARNING"
+
+        config_file.write_text('{"log_level": "ERROR"}')
+        status, body = asyncio.run(admin.dispatch("POST", "/reload", {}))
+        assert status == HTTPStatus.OK
+        assert body["log_level"] == "ERROR"
+
+        config_file.write_text('{"log_level": "TRACE"}')
+        status, body = asyncio.run(admin.dispatch("POST", "/reload", {}))
+        assert status == HTTPStatus.BAD_REQUEST
+        assert config.settings.log_level == "ERROR"
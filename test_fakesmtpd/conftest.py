@@ -0,0 +1,16 @@
+"""Fixtures shared by all test modules."""
+
+from __future__ import annotations
+
+from collections.abc import Iterator
+
+import pytest
+
+from fakesmtpd.metrics import metrics
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics() -> Iterator[None]:
+    metrics.reset()
+    yield
+    metrics.reset()
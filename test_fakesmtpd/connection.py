@@ -2,13 +2,29 @@ from __future__ import annotations
 
 import asyncio
 import datetime
+import ssl
+from collections.abc import Iterable
+from functools import partial
+from pathlib import Path
+from typing import Any
 
 import pytest
 from pytest_mock import MockerFixture
 
-from fakesmtpd.connection import CRLF_LENGTH, ConnectionHandler
+from fakesmtpd.connection import (
+    CRLF_LENGTH,
+    ConnectionHandler,
+    format_peer,
+    has_buffered_data,
+    peer_host,
+)
+from fakesmtpd.embedded import ReceivedMessage
+from fakesmtpd.faults import FaultRule, FaultRules
+from fakesmtpd.ratelimit import Rate, RateLimiter
+from fakesmtpd.sessions import SessionRegistry
 from fakesmtpd.smtp import SMTP_COMMAND_LIMIT, SMTP_TEXT_LINE_LIMIT, SMTPStatus
 from fakesmtpd.state import State
+from fakesmtpd.trace import INBOUND, OUTBOUND, read_trace
 
 FAKE_HOST = "mail.example.com"
 
@@ -36,16 +52,56 @@ class FakeStreamReader:
     # Test Interface
 
 
+class YieldingStreamReader(FakeStreamReader):
+    """Stream reader that lets other tasks run before each line."""
+
+    async def readuntil(self, separator: bytes = b"\n") -> bytes:
+        await asyncio.sleep(0)
+        return await super().readuntil(separator)
+
+
+class FakeTransport:
+    def __init__(self) -> None:
+        self.buffer_size = 0
+        self.limits = (16 * 1024, 64 * 1024)
+
+    def get_extra_info(self, name: str, default: Any = None) -> Any:
+        return default
+
+    def get_write_buffer_size(self) -> int:
+        return self.buffer_size
+
+    def get_write_buffer_limits(self) -> tuple[int, int]:
+        return self.limits
+
+    def set_write_buffer_limits(
+        self, high: int | None = None, low: int | None = None
+    ) -> None:
+        assert high is not None and low is not None
+        self.limits = (low, high)
+
+
 class FakeStreamWriter:
     def __init__(self) -> None:
         self.open = True
         self.data = b""
+        self.transport = FakeTransport()
+        self.drain_calls = 0
+        self.writelines_calls = 0
 
     # SUT Interface
 
     def write(self, data: bytes) -> None:
         self.data += data
 
+    def writelines(self, data: Iterable[bytes]) -> None:
+        self.writelines_calls += 1
+        self.data += b"".join(data)
+
+    async def drain(self) -> None:
+        self.drain_calls += 1
+        self.transport.buffer_size = 0
+
     def close(self) -> None:
         self.open = False
 
@@ -70,9 +126,9 @@ class FakeStreamWriter:
 
 class TestConnectionHandler:
     @pytest.fixture(autouse=True)
-    def getfqdn(self, mocker: MockerFixture) -> None:
-        mocker.patch("fakesmtpd.connection.getfqdn", lambda: FAKE_HOST)
-        mocker.patch("fakesmtpd.commands.getfqdn", lambda: FAKE_HOST)
+    def server_name(self, mocker: MockerFixture) -> None:
+        mocker.patch("fakesmtpd.connection.server_name", lambda: FAKE_HOST)
+        mocker.patch("fakesmtpd.commands.server_name", lambda: FAKE_HOST)
 
     def _handle(self, lines: list[str] | None = None) -> FakeStreamWriter:
         reader = FakeStreamReader()
@@ -83,7 +139,7 @@ class TestConnectionHandler:
         return writer
 
     def _print_mail(self, state: State) -> None:
-        self.printed_state = state
+        self.printed_state = ReceivedMessage.from_state(state)
 
     def test_greeting(self) -> None:
         writer = self._handle()
@@ -173,8 +229,32 @@ class TestConnectionHandler:
 
     def test_ehlo(self) -> None:
         writer = self._handle(["EHLO client.example.com"])
+        assert writer.lines[-2:] == [
+            f"250-{FAKE_HOST} Hello client.example.com",
+            "250 PIPELINING",
+        ]
+
+    def test_ehlo__starttls(self) -> None:
+        reader = FakeStreamReader()
+        reader.lines = ["EHLO client.example.com"]
+        writer = FakeStreamWriter()
+        handler = ConnectionHandler(
+            reader,
+            writer,
+            self._print_mail,
+            tls_context=ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER),
+        )
+        asyncio.run(handler.handle())
+        assert writer.lines[-3:] == [
+            f"250-{FAKE_HOST} Hello client.example.com",
+            "250-PIPELINING",
+            "250 STARTTLS",
+        ]
+
+    def test_starttls__not_available(self) -> None:
+        writer = self._handle(["EHLO client.example.com", "STARTTLS"])
         writer.assert_last_reply(
-            SMTPStatus.OK, f"{FAKE_HOST} Hello client.example.com"
+            SMTPStatus.COMMAND_NOT_IMPLEMENTED, "TLS not available"
         )
 
     def test_ehlo__no_domain(self) -> None:
@@ -307,6 +387,32 @@ class TestConnectionHandler:
             "Enter mail text. End with . on a separate line.",
         )
 
+    def test_wait_for_sink(self) -> None:
+        reader = FakeStreamReader()
+        reader.lines = [
+            "EHLO client.example.com",
+            "MAIL FROM:<foo@example.com>",
+            "RCPT TO:<bar@example.com>",
+            "DATA",
+            "Subject: Foo",
+            ".",
+            "NOOP",
+        ]
+        writer = FakeStreamWriter()
+        events: list[str] = []
+
+        async def wait_for_room() -> None:
+            await asyncio.sleep(0)
+            events.append(f"sink done, {len(reader.lines)} lines left")
+
+        def print_mail(state: State) -> Any:
+            return wait_for_room()
+
+        handler = ConnectionHandler(reader, writer, print_mail)
+        asyncio.run(handler.handle())
+        assert events == ["sink done, 1 lines left"]
+        assert writer.lines[-2] == "250 OK"
+
     def test_data_with_arguments(self) -> None:
         writer = self._handle(
             [
@@ -479,3 +585,421 @@ class TestConnectionHandler:
             ]
         )
         writer.assert_last_reply(SMTPStatus.SYNTAX_ERROR, "Line too long.")
+
+    def test_session_statistics(self) -> None:
+        lines = [
+            "EHLO client.example.com",
+            "MAIL FROM:<foo@example.com>",
+            "RCPT TO:<bar@example.com>",
+            "DATA",
+            "Subject: Foo",
+            ".",
+            "QUIT",
+        ]
+        reader = FakeStreamReader()
+        reader.lines = lines
+        writer = FakeStreamWriter()
+        handler = ConnectionHandler(
+            reader, writer, self._print_mail, peer="192.0.2.1:1234"
+        )
+        asyncio.run(handler.handle())
+        assert handler.peer == "192.0.2.1:1234"
+        assert handler.commands == 5
+        assert handler.messages == 1
+        assert handler.bytes_received == sum(len(li) + 2 for li in lines)
+        assert handler.bytes_sent == len(writer.data)
+
+    def test_summary(self) -> None:
+        reader = FakeStreamReader()
+        reader.lines = [
+            "EHLO client.example.com",
+            "MAIL FROM:<foo@example.com>",
+            "RCPT TO:<bar@example.com>",
+            "DATA",
+            "Subject: Foo",
+        ]
+        writer = FakeStreamWriter()
+        sessions = SessionRegistry()
+        handler = ConnectionHandler(
+            reader,
+            writer,
+            self._print_mail,
+            peer="192.0.2.1:1234",
+            sessions=sessions,
+        )
+        summary = handler.summary()
+        assert summary["phase"] == "connected"
+        asyncio.run(handler.handle())
+        summary = handler.summary()
+        assert summary["session"] == handler.session_id
+        assert summary["peer"] == "192.0.2.1:1234"
+        assert summary["listener"] is None
+        assert summary["tls"] is False
+        assert summary["phase"] == "data"
+        assert 0 <= summary["phase_seconds"] <= summary["duration"]
+        assert summary["commands"] == 4
+        assert summary["messages"] == 0
+        assert summary["bytes_received"] == handler.bytes_received
+        assert summary["bytes_sent"] == len(writer.data)
+        assert len(sessions.history) == 1
+        assert sessions.history[0]["session"] == handler.session_id
+        assert sessions.history[0]["phase"] == "data"
+
+    def test_drain_above_high_water_mark(self) -> None:
+        reader = FakeStreamReader()
+        reader.lines = ["NOOP", "NOOP", "NOOP"]
+        writer = FakeStreamWriter()
+        handler = ConnectionHandler(
+            reader,
+            writer,
+            self._print_mail,
+            write_buffer_limits=(100, 10),
+        )
+        assert writer.transport.limits == (10, 100)
+        writer.transport.buffer_size = 50
+        asyncio.run(handler.handle())
+        assert writer.drain_calls == 0
+        assert handler.max_write_buffer_size == 50
+
+        reader.lines = ["NOOP", "NOOP"]
+        writer.transport.buffer_size = 150
+        handler = ConnectionHandler(
+            reader,
+            writer,
+            self._print_mail,
+            write_buffer_limits=(100, 10),
+        )
+        asyncio.run(handler.handle())
+        assert writer.drain_calls == 1
+        assert handler.max_write_buffer_size == 150
+
+    def test_shutdown_idle(self) -> None:
+        reader = FakeStreamReader()
+        reader.lines = ["NOOP"]
+        writer = FakeStreamWriter()
+        handler = ConnectionHandler(reader, writer, self._print_mail)
+        handler.shutdown()
+        asyncio.run(handler.handle())
+        writer.assert_is_closed()
+        assert len(writer.lines) == 2
+        writer.assert_last_reply(
+            SMTPStatus.SERVICE_NOT_AVAILABLE,
+            f"{FAKE_HOST} Service not available, closing transmission channel",
+        )
+
+    def test_shutdown_during_transaction(self) -> None:
+        reader = YieldingStreamReader()
+        reader.lines = [
+            "EHLO client.example.com",
+            "MAIL FROM:<foo@example.com>",
+            "RCPT TO:<bar@example.com>",
+            "DATA",
+            "Subject: Foo",
+            ".",
+            "NOOP",
+        ]
+        writer = FakeStreamWriter()
+        handler = ConnectionHandler(reader, writer, self._print_mail)
+
+        async def handle() -> None:
+            task = asyncio.create_task(handler.handle())
+            while not handler.in_transaction:
+                await asyncio.sleep(0)
+            handler.shutdown()
+            await task
+
+        asyncio.run(handle())
+        assert handler.messages == 1
+        assert writer.lines[-2] == "250 OK"
+        writer.assert_last_reply(
+            SMTPStatus.SERVICE_NOT_AVAILABLE,
+            f"{FAKE_HOST} Service not available, closing transmission channel",
+        )
+        assert handler.commands == 4
+
+
+class TestFaultInjection:
+    @pytest.fixture(autouse=True)
+    def server_name(self, mocker: MockerFixture) -> None:
+        mocker.patch("fakesmtpd.connection.server_name", lambda: FAKE_HOST)
+        mocker.patch("fakesmtpd.commands.server_name", lambda: FAKE_HOST)
+
+    MAIL_LINES = [
+        "EHLO client.example.com",
+        "MAIL FROM:<foo@example.com>",
+        "RCPT TO:<bar@example.com>",
+        "RCPT TO:<baz@example.org>",
+        "DATA",
+        "Subject: Foo",
+        "",
+        "Test",
+        ".",
+        "QUIT",
+    ]
+
+    def _handle(
+        self, rules: list[FaultRule], lines: list[str] | None = None
+    ) -> tuple[ConnectionHandler, FakeStreamWriter]:
+        reader = FakeStreamReader()
+        reader.lines = list(lines if lines is not None else self.MAIL_LINES)
+        writer = FakeStreamWriter()
+        handler = ConnectionHandler(
+            reader, writer, self._print_mail, faults=FaultRules(rules)
+        )
+        self.printed: list[ReceivedMessage] = []
+        asyncio.run(handler.handle())
+        return handler, writer
+
+    def _print_mail(self, state: State) -> None:
+        self.printed.append(ReceivedMessage.from_state(state))
+
+    def test_no_match(self) -> None:
+        handler, writer = self._handle([FaultRule("VRFY", disconnect=True)])
+        assert len(self.printed) == 1
+        assert writer.lines[-1].startswith("221 ")
+
+    def test_reply_instead_of_command(self) -> None:
+        rule = FaultRule(
+            "RCPT",
+            recipient="*@example.org",
+            reply=(SMTPStatus.LOCAL_ERROR, "Try again later"),
+        )
+        handler, writer = self._handle([rule])
+        assert "451 Try again later" in writer.lines
+        assert len(self.printed) == 1
+        assert self.printed[0].forward_path == ["bar@example.com"]
+
+    def test_reply_by_sender(self) -> None:
+        rule = FaultRule(
+            "MAIL",
+            sender="FOO@*",
+            reply=(SMTPStatus.TRANSACTION_FAILED, "Go away"),
+        )
+        handler, writer = self._handle([rule])
+        assert writer.lines[3] == "554 Go away"
+        assert self.printed == []
+
+    def test_delay(self, mocker: MockerFixture) -> None:
+        sleep = mocker.patch("asyncio.sleep")
+        self._handle([FaultRule("DATA", delay=lambda: 1.5)])
+        sleep.assert_called_once_with(1.5)
+
+    def test_disconnect(self) -> None:
+        handler, writer = self._handle([FaultRule("RCPT", disconnect=True)])
+        writer.assert_is_closed()
+        writer.assert_last_reply(SMTPStatus.OK, "Sender OK")
+        assert handler.commands == 3
+
+    def test_service_not_available_closes_connection(self) -> None:
+        rule = FaultRule(
+            reply=(SMTPStatus.SERVICE_NOT_AVAILABLE, "Closing"),
+        )
+        handler, writer = self._handle([rule])
+        writer.assert_is_closed()
+        assert writer.lines[-1] == "421 Closing"
+        assert handler.commands == 1
+
+    def test_disconnect_during_data(self) -> None:
+        rule = FaultRule("DATA", disconnect_after_bytes=12)
+        handler, writer = self._handle([rule])
+        writer.assert_is_closed()
+        assert writer.lines[-1].startswith("354 ")
+        assert self.printed == []
+
+    def test_end_of_data_reply(self) -> None:
+        rule = FaultRule(
+            "END-OF-DATA",
+            reply=(SMTPStatus.INSUFFICIENT_STORAGE, "Mailbox full"),
+        )
+        handler, writer = self._handle([rule])
+        assert writer.lines[-2] == "452 Mailbox full"
+        assert self.printed == []
+        assert handler.state.reverse_path is None
+        assert handler.state.greeted
+
+    def test_end_of_data_disconnect(self) -> None:
+        rule = FaultRule("END-OF-DATA", disconnect=True)
+        handler, writer = self._handle([rule])
+        writer.assert_is_closed()
+        assert writer.lines[-1].startswith("354 ")
+        assert len(self.printed) == 1
+
+    def test_drip(self, mocker: MockerFixture) -> None:
+        sleep = mocker.patch("asyncio.sleep")
+        handler, writer = self._handle(
+            [FaultRule("NOOP", drip=0.25)], ["NOOP"]
+        )
+        assert writer.lines[-1] == "250 OK"
+        assert sleep.call_count == len(b"250 OK\r\n")
+        sleep.assert_called_with(0.25)
+        assert handler.bytes_sent == len(writer.data)
+
+
+class TestRateLimiting:
+    @pytest.fixture(autouse=True)
+    def server_name(self, mocker: MockerFixture) -> None:
+        mocker.patch("fakesmtpd.connection.server_name", lambda: FAKE_HOST)
+        mocker.patch("fakesmtpd.commands.server_name", lambda: FAKE_HOST)
+
+    def _handle(
+        self,
+        limiter: RateLimiter,
+        lines: list[str],
+        peer: str = "192.0.2.1:12345",
+    ) -> tuple[ConnectionHandler, FakeStreamWriter]:
+        reader = FakeStreamReader()
+        reader.lines = list(lines)
+        writer = FakeStreamWriter()
+        handler = ConnectionHandler(
+            reader,
+            writer,
+            lambda state: None,
+            peer=peer,
+            rate_limiter=limiter,
+        )
+        asyncio.run(handler.handle())
+        return handler, writer
+
+    def _mail(self, sender: str = "foo@example.com") -> list[str]:
+        return [
+            f"MAIL FROM:<{sender}>",
+            "RCPT TO:<bar@example.com>",
+            "DATA",
+            "Subject: Test",
+            "",
+            "0123456789",
+            ".",
+        ]
+
+    def test_connections(self) -> None:
+        limiter = RateLimiter([("peer", "connections", Rate(1, 60, 1))])
+        _, writer = self._handle(limiter, ["NOOP"])
+        assert writer.lines[-1] == "250 OK"
+        handler, writer = self._handle(limiter, ["NOOP"])
+        writer.assert_is_closed()
+        assert writer.lines == [
+            f"421 {FAKE_HOST} Too many connections from your host, "
+            "closing transmission channel"
+        ]
+        assert handler.commands == 0
+        _, writer = self._handle(limiter, ["NOOP"], peer="192.0.2.2:12345")
+        assert writer.lines[-1] == "250 OK"
+
+    def test_messages(self) -> None:
+        limiter = RateLimiter([("peer", "messages", Rate(1, 60, 1))])
+        handler, writer = self._handle(
+            limiter,
+            ["EHLO client.example.com"] + self._mail() + self._mail(),
+        )
+        assert handler.messages == 1
+        assert "451 Too many messages, try again later" in writer.lines
+        assert handler.state.reverse_path is None
+
+    def test_messages_per_sender(self) -> None:
+        limiter = RateLimiter([("sender", "messages", Rate(1, 60, 1))])
+        handler, writer = self._handle(
+            limiter,
+            ["EHLO client.example.com"]
+            + self._mail("foo@example.com")
+            + self._mail("bar@example.com"),
+        )
+        assert handler.messages == 2
+
+    def test_bytes(self) -> None:
+        limiter = RateLimiter([("peer", "bytes", Rate(20, 60, 20))])
+        handler, writer = self._handle(
+            limiter,
+            ["EHLO client.example.com"] + self._mail() + self._mail(),
+        )
+        assert handler.messages == 1
+        assert "451 Too many messages, try again later" in writer.lines
+
+
+class TestHasBufferedData:
+    def test_stream_reader(self) -> None:
+        async def run() -> None:
+            reader = asyncio.StreamReader()
+            assert not has_buffered_data(reader)
+            reader.feed_data(b"NOOP\r\nNOOP\r\n")
+            assert has_buffered_data(reader)
+            await reader.readuntil(b"\r\n")
+            assert has_buffered_data(reader)
+            await reader.readuntil(b"\r\n")
+            assert not has_buffered_data(reader)
+
+        asyncio.run(run())
+
+    def test_protocol(self) -> None:
+        from fakesmtpd.protocol import SMTPProtocol
+
+        protocol = SMTPProtocol(
+            partial(ConnectionHandler, print_mail=lambda state: None)
+        )
+        assert not has_buffered_data(protocol)
+        protocol.get_buffer(-1)[:6] = b"NOOP\r\n"
+        protocol.buffer_updated(6)
+        assert has_buffered_data(protocol)
+
+    def test_other_reader(self) -> None:
+        assert not has_buffered_data(FakeStreamReader())
+
+
+class TestFormatPeer:
+    def test_ipv4(self) -> None:
+        assert format_peer(("192.0.2.1", 25)) == "192.0.2.1:25"
+
+    def test_ipv6(self) -> None:
+        assert format_peer(("2001:db8::1", 25, 0, 0)) == "[2001:db8::1]:25"
+
+    def test_unix(self) -> None:
+        assert format_peer("/run/smtp.sock") == "/run/smtp.sock"
+
+    def test_none(self) -> None:
+        assert format_peer(None) == ""
+
+
+class TestPeerHost:
+    def test_ipv4(self) -> None:
+        assert peer_host("192.0.2.1:25") == "192.0.2.1"
+
+    def test_ipv6(self) -> None:
+        assert peer_host("[2001:db8::1]:25") == "2001:db8::1"
+
+    def test_unix(self) -> None:
+        assert peer_host("/run/smtp.sock") == "/run/smtp.sock"
+        assert peer_host("") == ""
+
+
+class TestTraceRecording:
+    def test_record(self, tmp_path: Path) -> None:
+        reader = FakeStreamReader()
+        reader.lines = ["NOOP", "QUIT"]
+        writer = FakeStreamWriter()
+        handler = ConnectionHandler(
+            reader, writer, lambda state: None, trace_dir=str(tmp_path)
+        )
+        asyncio.run(handler.handle())
+        _, records = read_trace(tmp_path / f"{handler.session_id}.trace")
+        assert b"".join(r.data for r in records if r.direction == INBOUND) == (
+            b"NOOP\r\nQUIT\r\n"
+        )
+        assert b"".join(
+            r.data for r in records if r.direction == OUTBOUND
+        ) == (writer.data)
+
+    def test_missing_dir(
+        self, tmp_path: Path, caplog: pytest.LogCaptureFixture
+    ) -> None:
+        reader = FakeStreamReader()
+        reader.lines = ["NOOP", "QUIT"]
+        writer = FakeStreamWriter()
+        handler = ConnectionHandler(
+            reader,
+            writer,
+            lambda state: None,
+            trace_dir=str(tmp_path / "missing"),
+        )
+        asyncio.run(handler.handle())
+        assert writer.data.startswith(b"220 ")
+        assert b"221 " in writer.data
+        assert "can't record trace" in caplog.text
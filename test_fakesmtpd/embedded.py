@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import hashlib
+import smtplib
+
+import pytest
+
+from fakesmtpd.embedded import FakeSMTPServer, ReceivedMessage
+from fakesmtpd.policy import RecipientPolicy
+from fakesmtpd.postprocess import PostProcessor, content_hash
+from fakesmtpd.state import State
+
+
+def _send_mail(port: int, to: str = "bar@example.com") -> None:
+    with smtplib.SMTP("127.0.0.1", port) as smtp:
+        smtp.sendmail(
+            "foo@example.com", [to], "Subject: Test\r\n\r\nHello\r\n"
+        )
+
+
+class TestFakeSMTPServer:
+    def test_receive(self) -> None:
+        async def run() -> None:
+            async with FakeSMTPServer() as server:
+                assert server.port > 0
+                await asyncio.to_thread(_send_mail, server.port)
+                messages = await server.wait_for_messages(1)
+            assert len(messages) == 1
+            assert messages[0].reverse_path == "foo@example.com"
+            assert messages[0].forward_path == ["bar@example.com"]
+            assert messages[0].mail_data == "Subject: Test\r\n\r\nHello\r\n"
+
+        asyncio.run(run())
+
+    def test_sink(self) -> None:
+        received: list[State] = []
+
+        async def run() -> None:
+            async with FakeSMTPServer(sink=received.append) as server:
+                await asyncio.to_thread(_send_mail, server.port)
+                await server.wait_for_messages(1)
+
+        asyncio.run(run())
+        assert len(received) == 1
+
+    def test_recipient_policy(self) -> None:
+        policy = RecipientPolicy(["example.com"])
+
+        async def run() -> None:
+            async with FakeSMTPServer(recipient_policy=policy) as server:
+                await asyncio.to_thread(_send_mail, server.port)
+                with pytest.raises(smtplib.SMTPRecipientsRefused):
+                    await asyncio.to_thread(
+                        _send_mail, server.port, "bar@example.org"
+                    )
+                await server.wait_for_messages(1)
+                server.recipient_policy = RecipientPolicy(["example.org"])
+                await asyncio.to_thread(
+                    _send_mail, server.port, "bar@example.org"
+                )
+                messages = await server.wait_for_messages(2)
+            assert [m.forward_path for m in messages] == [
+                ["bar@example.com"],
+                ["bar@example.org"],
+            ]
+
+        asyncio.run(run())
+
+    def test_post_processor(self) -> None:
+        processor = PostProcessor({"hash": content_hash}, max_workers=1)
+
+        async def run() -> dict[str, object]:
+            async with FakeSMTPServer(post_processor=processor) as server:
+                await asyncio.to_thread(_send_mail, server.port)
+                messages = await server.wait_for_messages(1)
+                return await messages[0].wait_for_results()
+
+        try:
+            results = asyncio.run(run())
+        finally:
+            processor.close()
+        assert results == {
+            "hash": hashlib.sha256(
+                b"Subject: Test\r\n\r\nHello\r\n"
+            ).hexdigest()
+        }
+
+    def test_no_post_processor(self) -> None:
+        async def run() -> None:
+            async with FakeSMTPServer() as server:
+                await asyncio.to_thread(_send_mail, server.port)
+                messages = await server.wait_for_messages(1)
+                assert await messages[0].wait_for_results() == {}
+
+        asyncio.run(run())
+
+    def test_concurrent_instances(self) -> None:
+        async def run() -> None:
+            async with FakeSMTPServer() as s1, FakeSMTPServer() as s2:
+                assert s1.port != s2.port
+                await asyncio.to_thread(_send_mail, s1.port, "a@example.com")
+                await asyncio.to_thread(_send_mail, s2.port, "b@example.com")
+                await s1.wait_for_messages(1)
+                await s2.wait_for_messages(1)
+                assert s1.messages[0].forward_path == ["a@example.com"]
+                assert s2.messages[0].forward_path == ["b@example.com"]
+
+        asyncio.run(run())
+
+    def test_clear(self) -> None:
+        async def run() -> None:
+            async with FakeSMTPServer() as server:
+                await asyncio.to_thread(_send_mail, server.port)
+                await server.wait_for_messages(1)
+                server.clear()
+                assert server.messages == []
+
+        asyncio.run(run())
+
+    def test_wait_timeout(self) -> None:
+        async def run() -> None:
+            async with FakeSMTPServer() as server:
+                with pytest.raises(asyncio.TimeoutError):
+                    await server.wait_for_messages(1, timeout=0.01)
+
+        asyncio.run(run())
+
+    def test_stop_with_open_connection(self) -> None:
+        async def run() -> None:
+            async with FakeSMTPServer() as server:
+                reader, writer = await asyncio.open_connection(
+                    "127.0.0.1", server.port
+                )
+                await reader.readline()
+            assert await reader.read() == b""
+            writer.close()
+
+        asyncio.run(asyncio.wait_for(run(), 5))
+
+    def test_port_not_running(self) -> None:
+        with pytest.raises(RuntimeError):
+            _ = FakeSMTPServer().port
+
+
+class TestReceivedMessage:
+    MAIL_DATA = (
+        "Subject: Test\r\n"
+        "MIME-Version: 1.0\r\n"
+        'Content-Type: multipart/mixed; boundary="b"\r\n'
+        "\r\n"
+        "--b\r\n"
+        "Content-Type: text/plain\r\n"
+        "\r\n"
+        "Hello\r\n"
+        "--b--\r\n"
+    )
+
+    def _message(self) -> ReceivedMessage:
+        return ReceivedMessage(
+            datetime.datetime(2026, 1, 1),
+            "foo@example.com",
+            ["bar@example.com"],
+            self.MAIL_DATA,
+        )
+
+    def test_headers(self) -> None:
+        message = self._message()
+        assert message.headers.get("subject") == "Test"
+        assert message._message is None
+
+    def test_body(self) -> None:
+        assert self._message().body.startswith("--b\r\n")
+
+    def test_message(self) -> None:
+        message = self._message()
+        parsed = message.message
+        assert parsed.is_multipart()
+        assert [p.get_content_type() for p in parsed.iter_parts()] == [
+            "text/plain"
+        ]
+        assert message.message is parsed
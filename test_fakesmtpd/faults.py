@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from fakesmtpd.faults import (
+    FaultRule,
+    FaultRules,
+    command_addresses,
+    load_fault_rules,
+    parse_fault_rule,
+)
+from fakesmtpd.smtp import SMTPStatus
+from fakesmtpd.state import State
+
+
+class TestFaultRule:
+    def test_command_is_case_insensitive(self) -> None:
+        assert FaultRule("rcpt").command == "RCPT"
+
+    def test_match_without_addresses(self) -> None:
+        assert FaultRule("RCPT").matches(None, ())
+
+    def test_match_sender(self) -> None:
+        rule = FaultRule(sender="*@Example.com")
+        assert rule.matches("foo@example.com", ())
+        assert not rule.matches("foo@example.org", ())
+        assert not rule.matches(None, ())
+
+    def test_match_any_recipient(self) -> None:
+        rule = FaultRule(recipient="bounce-*@*")
+        assert rule.matches(None, ["foo@example.com", "bounce-1@example.com"])
+        assert not rule.matches(None, ["foo@example.com"])
+        assert not rule.matches(None, ())
+
+    def test_invalid_probability(self) -> None:
+        with pytest.raises(ValueError):
+            FaultRule(probability=1.5)
+
+    def test_disconnect_after_bytes_requires_data(self) -> None:
+        with pytest.raises(ValueError):
+            FaultRule("RCPT", disconnect_after_bytes=10)
+
+
+class TestFaultRules:
+    def test_empty(self) -> None:
+        rules = FaultRules()
+        assert len(rules) == 0
+        assert not rules
+        assert rules.match("MAIL", None, ()) is None
+
+    def test_first_match_wins(self) -> None:
+        rule1 = FaultRule("RCPT", recipient="*@example.org")
+        rule2 = FaultRule()
+        rule3 = FaultRule("RCPT")
+        rules = FaultRules([rule1, rule2, rule3])
+        assert rules.match("RCPT", None, ["foo@example.org"]) is rule1
+        assert rules.match("RCPT", None, ["foo@example.com"]) is rule2
+        assert rules.match("NOOP", None, ()) is rule2
+
+    def test_command_not_matched(self) -> None:
+        rules = FaultRules([FaultRule("DATA")])
+        assert rules.match("RCPT", None, ()) is None
+
+    def test_probability(self, mocker: MockerFixture) -> None:
+        random = mocker.patch("fakesmtpd.faults.random.random")
+        rule = FaultRule("DATA", probability=0.25)
+        rules = FaultRules([rule])
+        random.return_value = 0.3
+        assert rules.match("DATA", None, ()) is None
+        random.return_value = 0.2
+        assert rules.match("DATA", None, ()) is rule
+
+    def test_probability_zero(self) -> None:
+        rules = FaultRules([FaultRule("DATA", probability=0.0)])
+        assert rules.match("DATA", None, ()) is None
+
+
+class TestCommandAddresses:
+    def test_mail(self) -> None:
+        assert command_addresses(
+            State(), "MAIL", "FROM:<foo@example.com> SIZE=100"
+        ) == ("foo@example.com", ())
+
+    def test_rcpt(self) -> None:
+        state = State()
+        state.reverse_path = "foo@example.com"
+        state.forward_path = ["bar@example.com"]
+        assert command_addresses(state, "RCPT", "TO:<baz@example.com>") == (
+            "foo@example.com",
+            ("baz@example.com",),
+        )
+
+    def test_invalid_arguments(self) -> None:
+        assert command_addresses(State(), "MAIL", "FROM:foo") == (None, ())
+
+    def test_other_command(self) -> None:
+        state = State()
+        state.reverse_path = "foo@example.com"
+        state.forward_path = ["bar@example.com"]
+        assert command_addresses(state, "DATA", "") == (
+            "foo@example.com",
+            ["bar@example.com"],
+        )
+
+
+class TestParseFaultRule:
+    def test_defaults(self) -> None:
+        rule = parse_fault_rule({})
+        assert rule.command == "*"
+        assert rule.probability == 1.0
+        assert rule.delay is None
+        assert rule.reply is None
+        assert not rule.disconnect
+        assert rule.drip is None
+
+    def test_all_fields(self) -> None:
+        rule = parse_fault_rule(
+            {
+                "command": "DATA",
+                "sender": "*@example.com",
+                "recipient": "*@example.org",
+                "probability": 0.5,
+                "delay": 0.1,
+                "reply": [451, "Try again"],
+                "disconnect": True,
+                "disconnect_after_bytes": 100,
+                "drip": 0.01,
+            }
+        )
+        assert rule.command == "DATA"
+        assert rule.probability == 0.5
+        assert rule.delay is not None and rule.delay() == 0.1
+        assert rule.reply == (SMTPStatus.LOCAL_ERROR, "Try again")
+        assert rule.disconnect
+        assert rule.disconnect_after_bytes == 100
+        assert rule.drip == 0.01
+
+    @pytest.mark.parametrize(
+        "delay,low,high",
+        [
+            ({"uniform": [0.1, 0.2]}, 0.1, 0.2),
+            ({"exponential": 0.1}, 0.0, float("inf")),
+            ({"normal": [0.1, 0.05]}, 0.0, float("inf")),
+            ({"lognormal": [-3, 0.5]}, 0.0, float("inf")),
+        ],
+    )
+    def test_delay_distribution(
+        self, delay: dict[str, object], low: float, high: float
+    ) -> None:
+        rule = parse_fault_rule({"delay": delay})
+        assert rule.delay is not None
+        for _ in range(100):
+            assert low <= rule.delay() <= high
+
+    @pytest.mark.parametrize(
+        "data",
+        [
+            [],
+            {"unknown": 1},
+            {"command": 1},
+            {"probability": "0.5"},
+            {"probability": True},
+            {"probability": 2},
+            {"delay": "1"},
+            {"delay": {"uniform": 1}},
+            {"delay": {"pareto": [1, 2]}},
+            {"delay": -1},
+            {"delay": {"exponential": 0}},
+            {"delay": {"exponential": -0.5}},
+            {"reply": 451},
+            {"reply": [451]},
+            {"reply": [250, "OK"]},
+            {"reply": [999, "Unknown"]},
+            {"disconnect": 1},
+            {"command": "MAIL", "disconnect_after_bytes": 10},
+        ],
+    )
+    def test_invalid(self, data: object) -> None:
+        with pytest.raises(ValueError):
+            parse_fault_rule(data)
+
+
+class TestLoadFaultRules:
+    def test_load(self, tmp_path: Path) -> None:
+        filename = tmp_path / "faults.json"
+        filename.write_text(
+            json.dumps(
+                [
+                    {"command": "RCPT", "reply": [450, "Busy"]},
+                    {"command": "DATA", "delay": 0.5},
+                ]
+            )
+        )
+        rules = load_fault_rules(str(filename))
+        assert len(rules) == 2
+        assert rules.match("DATA", None, ()) is rules.rules[1]
+
+    def test_not_a_list(self, tmp_path: Path) -> None:
+        filename = tmp_path / "faults.json"
+        filename.write_text("{}")
+        with pytest.raises(ValueError):
+            load_fault_rules(str(filename))
+
+    def test_invalid_rule(self, tmp_path: Path) -> None:
+        filename = tmp_path / "faults.json"
+        filename.write_text(
+            json.dumps([{"command": "DATA"}, {"delay": {"exponential": 0}}])
+        )
+        with pytest.raises(ValueError, match="^rule 2: .*mean must be"):
+            load_fault_rules(str(filename))
+
+    def test_invalid_json(self, tmp_path: Path) -> None:
+        filename = tmp_path / "faults.json"
+        filename.write_text("[")
+        with pytest.raises(ValueError):
+            load_fault_rules(str(filename))
@@ -0,0 +1,75 @@
+from fakesmtpd.headers import scan_headers
+
+MAIL = (
+    "From: Foo <foo@example.com>\r\n"
+    "To: bar@example.com,\r\n"
+    "\tbaz@example.com\r\n"
+    "Subject: =?utf-8?q?Gr=C3=BC=C3=9Fe?=\r\n"
+    "Received: from a\r\n"
+    "Received: from b\r\n"
+    "\r\n"
+    "Body: not a header\r\n"
+)
+
+
+class TestScanHeaders:
+    def test_fields(self) -> None:
+        headers = scan_headers(MAIL)
+        assert len(headers) == 5
+        assert list(headers)[0] == ("From", "Foo <foo@example.com>")
+
+    def test_get(self) -> None:
+        headers = scan_headers(MAIL)
+        assert headers.get("from") == "Foo <foo@example.com>"
+        assert headers.get("RECEIVED") == "from a"
+        assert headers.get("Body") is None
+        assert headers.get("Cc", "") == ""
+
+    def test_contains(self) -> None:
+        headers = scan_headers(MAIL)
+        assert "subject" in headers
+        assert "Cc" not in headers
+        assert 1 not in headers
+
+    def test_get_all(self) -> None:
+        headers = scan_headers(MAIL)
+        assert headers.get_all("Received") == ["from a", "from b"]
+        assert headers.get_all("Cc") == []
+
+    def test_folded(self) -> None:
+        headers = scan_headers(MAIL)
+        assert headers.get("To") == "bar@example.com, baz@example.com"
+
+    def test_decode(self) -> None:
+        headers = scan_headers(MAIL)
+        assert headers.decode("Subject") == "Grüße"
+        assert headers.decode("From") == "Foo <foo@example.com>"
+        assert headers.decode("Cc") is None
+
+    def test_body_offset(self) -> None:
+        headers = scan_headers(MAIL)
+        assert MAIL[headers.body_offset :] == "Body: not a header\r\n"
+
+    def test_no_body(self) -> None:
+        headers = scan_headers("Subject: Test\r\n")
+        assert headers.get("Subject") == "Test"
+        assert headers.body_offset == len("Subject: Test\r\n")
+
+    def test_no_headers(self) -> None:
+        headers = scan_headers("\r\nBody\r\n")
+        assert len(headers) == 0
+        assert headers.body_offset == 2
+
+    def test_empty(self) -> None:
+        headers = scan_headers("")
+        assert len(headers) == 0
+        assert headers.body_offset == 0
+
+    def test_invalid_lines_ignored(self) -> None:
+        headers = scan_headers(" folded\r\nno colon\r\nSubject: x\r\n\r\n")
+        assert list(headers) == [("Subject", "x")]
+
+    def test_lf(self) -> None:
+        headers = scan_headers("Subject: Test\n\nBody\n", "\n")
+        assert headers.get("Subject") == "Test"
+        assert headers.body_offset == len("Subject: Test\n\n")
@@ -0,0 +1,29 @@
+"""Helpers shared by several test modules."""
+
+from __future__ import annotations
+
+import datetime
+from collections.abc import Sequence
+
+from fakesmtpd.state import State
+
+MAIL_DATE = datetime.datetime(2017, 6, 4, 14, 34, 15)
+MAIL_DATA = "Subject: Foo\r\n\r\nText\r\n"
+
+
+def make_state(
+    sender: str = "sender@example.com",
+    recipients: Sequence[str] = ("receiver@example.com",),
+    *,
+    mail_data: str = MAIL_DATA,
+    date: datetime.datetime = MAIL_DATE,
+) -> State:
+    """Return the state of a received mail."""
+    state = State()
+    state.start_mail(sender)
+    for recipient in recipients:
+        state.add_forward_path(recipient)
+    state.start_data()
+    state.add_line(mail_data)
+    state.date = date
+    return state
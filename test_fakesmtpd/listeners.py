@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import pytest
+
+from fakesmtpd.listeners import Listener, parse_listener
+
+
+class TestListener:
+    def test_address(self) -> None:
+        assert Listener(host="127.0.0.1", port=25).address == "127.0.0.1:25"
+        assert Listener(host="::1", port=25).address == "[::1]:25"
+        assert Listener(path="/run/smtp.sock").address == "unix:/run/smtp.sock"
+
+    def test_name(self) -> None:
+        assert Listener(host="127.0.0.1", port=25).name == "127.0.0.1:25"
+        assert Listener("local", path="/run/smtp.sock").name == "local"
+
+    def test_invalid(self) -> None:
+        with pytest.raises(ValueError):
+            Listener(host="127.0.0.1")
+        with pytest.raises(ValueError):
+            Listener(port=25, path="/run/smtp.sock")
+        with pytest.raises(ValueError):
+            Listener(port=25, max_connections=0)
+
+    def test_max_connections(self) -> None:
+        listener = Listener(port=25, max_connections=2)
+        assert listener.acquire()
+        assert listener.acquire()
+        assert not listener.acquire()
+        assert listener.open_connections == 2
+        listener.release()
+        assert listener.acquire()
+
+    def test_unlimited(self) -> None:
+        listener = Listener(port=25)
+        for _ in range(100):
+            assert listener.acquire()
+
+
+class TestParseListener:
+    def test_ipv4(self) -> None:
+        listener = parse_listener("127.0.0.1:2525")
+        assert listener.host == "127.0.0.1"
+        assert listener.port == 2525
+        assert listener.path is None
+        assert listener.max_connections is None
+
+    def test_ipv6(self) -> None:
+        listener = parse_listener("[::1]:2525")
+        assert listener.host == "::1"
+        assert listener.port == 2525
+
+    def test_unix(self) -> None:
+        listener = parse_listener("unix:/run/smtp.sock")
+        assert listener.path == "/run/smtp.sock"
+        assert listener.port is None
+
+    def test_options(self) -> None:
+        listener = parse_listener("localhost:25,name=local,max-connections=5")
+        assert listener.name == "local"
+        assert listener.max_connections == 5
+        assert not listener.tls
+
+    def test_tls(self) -> None:
+        assert parse_listener("localhost:465,tls").tls
+
+    @pytest.mark.parametrize(
+        "spec",
+        [
+            "127.0.0.1",
+            ":25",
+            "127.0.0.1:port",
+            "::1:25",
+            "unix:",
+            "127.0.0.1:25,name",
+            "127.0.0.1:25,foo=bar",
+            "127.0.0.1:25,max-connections=many",
+        ],
+    )
+    def test_invalid(self, spec: str) -> None:
+        with pytest.raises(ValueError):
+            parse_listener(spec)
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import json
+import logging
+from collections.abc import Iterator
+from io import StringIO
+
+import pytest
+from pytest_mock import MockerFixture
+
+from fakesmtpd.log import (
+    JSONFormatter,
+    TextFormatter,
+    configure_logging,
+    new_session_id,
+    sample_command_log,
+    set_command_sample_rate,
+)
+
+
+def _record(**extra: object) -> logging.LogRecord:
+    record = logging.LogRecord(
+        "fakesmtpd.test", logging.INFO, __file__, 1, "foo %s", ("bar",), None
+    )
+    record.__dict__.update(extra)
+    return record
+
+
+@pytest.fixture(autouse=True)
+def reset_sample_rate() -> Iterator[None]:
+    yield
+    set_command_sample_rate(1.0)
+
+
+class TestNewSessionID:
+    def test_unique(self) -> None:
+        assert new_session_id() != new_session_id()
+
+
+class TestSampleCommandLog:
+    def test_debug_disabled(self) -> None:
+        logger = logging.getLogger("fakesmtpd.test.sample")
+        logger.setLevel(logging.INFO)
+        assert not sample_command_log(logger)
+
+    def test_debug_enabled(self) -> None:
+        logger = logging.getLogger("fakesmtpd.test.sample")
+        logger.setLevel(logging.DEBUG)
+        assert sample_command_log(logger)
+
+    def test_sampled(self, mocker: MockerFixture) -> None:
+        logger = logging.getLogger("fakesmtpd.test.sample")
+        logger.setLevel(logging.DEBUG)
+        set_command_sample_rate(0.25)
+        mocker.patch("random.random", return_value=0.2)
+        assert sample_command_log(logger)
+        mocker.patch("random.random", return_value=0.3)
+        assert not sample_command_log(logger)
+
+    def test_invalid_rate(self) -> None:
+        with pytest.raises(ValueError):
+            set_command_sample_rate(1.5)
+
+
+class TestTextFormatter:
+    def test_without_session(self) -> None:
+        line = TextFormatter().format(_record())
+        assert line.endswith(" INFO fakesmtpd.test: foo bar")
+
+    def test_with_session(self) -> None:
+        line = TextFormatter().format(_record(session="s1", peer="1.2.3.4:5"))
+        assert line.endswith("foo bar [session=s1 peer=1.2.3.4:5]")
+
+
+class TestJSONFormatter:
+    def test_format(self) -> None:
+        line = JSONFormatter().format(_record(session="s1", commands=3))
+        data = json.loads(line)
+        assert data["level"] == "INFO"
+        assert data["logger"] == "fakesmtpd.test"
+        assert data["message"] == "foo bar"
+        assert data["session"] == "s1"
+        assert data["commands"] == 3
+        assert "peer" not in data
+        assert "time" in data
+
+
+class TestConfigureLogging:
+    @pytest.fixture(autouse=True)
+    def restore_root_logger(self) -> Iterator[None]:
+        root = logging.getLogger()
+        handlers = root.handlers[:]
+        level = root.level
+        yield
+        root.handlers[:] = handlers
+        root.setLevel(level)
+
+    def test_json(self) -> None:
+        out = StringIO()
+        listener = configure_logging("json", logging.INFO, stream=out)
+        logging.getLogger("fakesmtpd.test").info("foo %s", "bar")
+        logging.getLogger("fakesmtpd.test").debug("ignored")
+        listener.stop()
+        lines = out.getvalue().splitlines()
+        assert len(lines) == 1
+        assert json.loads(lines[0])["message"] == "foo bar"
+
+    def test_unknown_format(self) -> None:
+        with pytest.raises(ValueError):
+            configure_logging("xml")
+
+    def test_foreign_logger_arguments_are_rendered(self) -> None:
+        out = StringIO()
+        listener = configure_logging("json", logging.INFO, stream=out)
+        args = ["before"]
+        logging.getLogger("other").info("value %s", args)
+        args[0] = "after"
+        listener.stop()
+        data = json.loads(out.getvalue())
+        assert data["message"] == "value ['before']"
+
+    def test_foreign_logger_exception(self) -> None:
+        out = StringIO()
+        listener = configure_logging("json", logging.INFO, stream=out)
+        try:
+            raise RuntimeError("boom")
+        except RuntimeError:
+            logging.getLogger("other").exception("failed")
+        listener.stop()
+        data = json.loads(out.getvalue())
+        assert data["message"] == "failed"
+        assert "RuntimeError: boom" in data["exception"]
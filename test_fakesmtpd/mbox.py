@@ -1,8 +1,16 @@
 import datetime
+import hashlib
+import os
 from io import StringIO
+from pathlib import Path
 
-from fakesmtpd.mbox import write_mbox_mail
+import pytest
+from pytest_mock import MockerFixture
+
+from fakesmtpd.bodystore import BodyStore
+from fakesmtpd.mbox import MboxReader, MboxSink, write_mbox_mail
 from fakesmtpd.state import State
+from test_fakesmtpd.helpers import make_state
 
 
 class TestWriteMboxMail:
@@ -23,3 +31,221 @@ class TestWriteMboxMail:
             "Text\n"
             "\n"
         )
+
+    def test_body_store(self, tmp_path: Path) -> None:
+        store = BodyStore(str(tmp_path))
+        out = StringIO()
+        write_mbox_mail(out, make_state(), body_store=store)
+        digest = hashlib.sha256(b"Text\n").hexdigest()
+        assert out.getvalue() == (
+            "From sender@example.com Sun Jun  4 14:34:15 2017\n"
+            "X-FakeSMTPd-Receiver: receiver@example.com\n"
+            f"X-FakeSMTPd-Body: {digest}\n"
+            "Subject: Foo\n"
+            "\n"
+            "\n"
+        )
+        assert store.get(digest) == b"Text\n"
+
+    def test_body_store__no_body(self, tmp_path: Path) -> None:
+        store = BodyStore(str(tmp_path))
+        out = StringIO()
+        state = make_state(mail_data="Subject: Foo\r\n")
+        write_mbox_mail(out, state, body_store=store)
+        assert "X-FakeSMTPd-Body" not in out.getvalue()
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestMboxSink:
+    def test_append(self, tmp_path: Path) -> None:
+        filename = tmp_path / "mbox"
+        filename.write_text("existing\n")
+        sink = MboxSink(str(filename))
+        sink(make_state())
+        sink(make_state())
+        sink.flush()
+        content = filename.read_text()
+        assert content.startswith("existing\nFrom sender@example.com ")
+        assert content.count("From sender@example.com") == 2
+        sink.close()
+        sink.close()
+
+    def test_fsync(self, tmp_path: Path, mocker: MockerFixture) -> None:
+        fsync = mocker.patch("os.fsync")
+        sink = MboxSink(str(tmp_path / "mbox"))
+        sink.flush()
+        fsync.assert_not_called()
+        sink(make_state())
+        sink.close()
+        fsync.assert_called_once()
+
+    def test_device(self) -> None:
+        sink = MboxSink(os.devnull)
+        sink(make_state())
+        sink.close()
+
+    def test_stdout(self, capsys: pytest.CaptureFixture[str]) -> None:
+        sink = MboxSink("-")
+        sink(make_state())
+        sink.close()
+        assert capsys.readouterr().out.startswith("From sender@example.com")
+
+
+def _write_mails(filename: Path, *mails: tuple[str, list[str], str]) -> None:
+    with open(filename, "a") as f:
+        for i, (reverse_path, forward_path, mail_data) in enumerate(mails):
+            state = State()
+            state.date = datetime.datetime(2017, 6, 4, 14, 34, i)
+            state.reverse_path = reverse_path
+            state.forward_path = forward_path
+            state.mail_data = mail_data
+            write_mbox_mail(f, state)
+
+
+class TestMboxReader:
+    def test_read(self, tmp_path: Path) -> None:
+        filename = tmp_path / "mbox"
+        _write_mails(
+            filename,
+            (
+                "sender@example.com",
+                ["r1@example.com", "r2@example.com"],
+                "Subject: Foo\r\n\r\nText\r\n",
+            ),
+            ("", ["r3@example.com"], "Subject: Bar\r\n\r\nMore\r\n"),
+        )
+        with MboxReader(str(filename)) as reader:
+            assert len(reader) == 2
+            first, second = reader
+            assert first.offset == 0
+            assert first.reverse_path == "sender@example.com"
+            assert first.forward_path == ["r1@example.com", "r2@example.com"]
+            assert first.date == datetime.datetime(2017, 6, 4, 14, 34, 0)
+            assert first.mail_data == "Subject: Foo\n\nText\n"
+            assert first.headers.get("Subject") == "Foo"
+            assert second.reverse_path == ""
+            assert second.forward_path == ["r3@example.com"]
+            assert second.date == datetime.datetime(2017, 6, 4, 14, 34, 1)
+            assert second.mail_data == "Subject: Bar\n\nMore\n"
+            assert second.size == len(second.mail_data)
+            assert reader.offsets == [0, second.offset]
+            assert reader[1].mail_data == second.mail_data
+            assert reader[-2].offset == 0
+            with pytest.raises(IndexError):
+                reader[2]
+
+    def test_body_store(self, tmp_path: Path) -> None:
+        filename = tmp_path / "mbox"
+        store = BodyStore(str(tmp_path / "bodies"))
+        sink = MboxSink(str(filename), body_store=store)
+        for i in range(3):
+            recipient = f"r{i}@example.com"
+            sink(
+                make_state(
+                    recipients=[recipient],
+                    mail_data=f"To: {recipient}\r\n\r\nText\r\n",
+                )
+            )
+        sink.close()
+        with MboxReader(str(filename)) as reader:
+            messages = list(reader)
+            assert len({m.body_hash for m in messages}) == 1
+            assert messages[1].mail_data == "To: r1@example.com\n\n"
+        with MboxReader(str(filename), body_store=store) as reader:
+            messages = list(reader)
+            assert messages[1].forward_path == ["r1@example.com"]
+            assert messages[1].mail_data == "To: r1@example.com\n\nText\n"
+            assert messages[2].headers.get("To") == "r2@example.com"
+
+    def test_empty_file(self, tmp_path: Path) -> None:
+        filename = tmp_path / "mbox"
+        filename.write_text("")
+        with MboxReader(str(filename)) as reader:
+            assert len(reader) == 0
+            assert list(reader) == []
+
+    def test_missing_file(self, tmp_path: Path) -> None:
+        reader = MboxReader(str(tmp_path / "mbox"))
+        with pytest.raises(FileNotFoundError):
+            len(reader)
+
+    def test_skip_leading_data(self, tmp_path: Path) -> None:
+        filename = tmp_path / "mbox"
+        filename.write_text("existing\n\n")
+        _write_mails(filename, ("a@example.com", ["b@example.com"], "\r\n"))
+        with MboxReader(str(filename)) as reader:
+            assert reader.offsets == [len("existing\n\n")]
+
+    def test_from_lines_in_body(self, tmp_path: Path) -> None:
+        filename = tmp_path / "mbox"
+        _write_mails(
+            filename,
+            (
+                "a@example.com",
+                ["b@example.com"],
+                "Subject: Foo\r\n\r\nFrom here on\r\n\r\nFrom me\r\n",
+            ),
+        )
+        with MboxReader(str(filename)) as reader:
+            assert len(reader) == 1
+            assert reader[0].mail_data.endswith("From me\n")
+
+    def test_refresh(self, tmp_path: Path) -> None:
+        filename = tmp_path / "mbox"
+        _write_mails(filename, ("a@example.com", ["b@example.com"], "\r\n"))
+        with MboxReader(str(filename)) as reader:
+            assert len(reader) == 1
+            assert not reader.refresh()
+            _write_mails(
+                filename, ("c@example.com", ["d@example.com"], "X: y\r\n")
+            )
+            assert len(reader) == 1
+            assert reader.refresh()
+            assert len(reader) == 2
+            assert reader[1].reverse_path == "c@example.com"
+            assert reader[0].mail_data == "\n"
+
+    def test_refresh_replaced_file(self, tmp_path: Path) -> None:
+        filename = tmp_path / "mbox"
+        _write_mails(filename, ("a@example.com", ["b@example.com"], "\r\n"))
+        with MboxReader(str(filename)) as reader:
+            assert len(reader) == 1
+            filename.rename(tmp_path / "mbox.1")
+            _write_mails(
+                filename, ("c@example.com", ["d@example.com"], "\r\n")
+            )
+            assert reader.refresh()
+            assert [m.reverse_path for m in reader] == ["c@example.com"]
+
+    def test_tail(self, tmp_path: Path) -> None:
+        filename = tmp_path / "mbox"
+        _write_mails(filename, ("a@example.com", ["b@example.com"], "\r\n"))
+        with MboxReader(str(filename)) as reader:
+            messages = reader.tail(interval=0)
+            _write_mails(
+                filename, ("c@example.com", ["d@example.com"], "\r\n")
+            )
+            assert next(messages).reverse_path == "c@example.com"
+            _write_mails(
+                filename, ("e@example.com", ["f@example.com"], "\r\n")
+            )
+            assert next(messages).reverse_path == "e@example.com"
+
+    def test_tail_from_start(self, tmp_path: Path) -> None:
+        filename = tmp_path / "mbox"
+        _write_mails(filename, ("a@example.com", ["b@example.com"], "\r\n"))
+        with MboxReader(str(filename)) as reader:
+            messages = reader.tail(interval=0, from_start=True)
+            assert next(messages).reverse_path == "a@example.com"
+
+    def test_tail_incomplete_message(self, tmp_path: Path) -> None:
+        filename = tmp_path / "mbox"
+        filename.write_text(
+            "From a@example.com Sun Jun  4 14:34:15 2017\nSubject: Foo\n"
+        )
+        with MboxReader(str(filename)) as reader:
+            messages = reader.tail(interval=0, from_start=True)
+            with open(filename, "a") as f:
+                f.write("\nText\n\n")
+            message = next(messages)
+            assert message.mail_data == "Subject: Foo\n\nText\n"
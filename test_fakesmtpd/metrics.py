@@ -0,0 +1,44 @@
+from fakesmtpd.metrics import Metrics, metric_name
+
+
+class TestMetricName:
+    def test_without_labels(self) -> None:
+        assert metric_name("connections") == "connections"
+
+    def test_with_labels(self) -> None:
+        name = metric_name("connections", {"listener": "a", "family": "b"})
+        assert name == 'connections{family="b",listener="a"}'
+
+
+class TestMetrics:
+    def test_increment(self) -> None:
+        metrics = Metrics()
+        metrics.increment("messages")
+        metrics.increment("messages", 2)
+        assert metrics.snapshot()["counters"] == {"messages": 3}
+
+    def test_gauges(self) -> None:
+        metrics = Metrics()
+        metrics.set_gauge("sessions", 4)
+        metrics.add_to_gauge("sessions", -1)
+        metrics.add_to_gauge("other", 2)
+        assert metrics.snapshot()["gauges"] == {"sessions": 3, "other": 2}
+
+    def test_observe(self) -> None:
+        metrics = Metrics()
+        metrics.observe("latency", 1.0)
+        metrics.observe("latency", 3.0)
+        assert metrics.snapshot()["summaries"] == {
+            "latency": {"count": 2, "sum": 4.0, "max": 3.0}
+        }
+
+    def test_info(self) -> None:
+        metrics = Metrics()
+        metrics.set_info("event_loop", "uvloop")
+        assert metrics.snapshot()["info"] == {"event_loop": "uvloop"}
+
+    def test_reset(self) -> None:
+        metrics = Metrics()
+        metrics.increment("messages")
+        metrics.reset()
+        assert metrics.snapshot()["counters"] == {}
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections.abc import Callable
+
+import pytest
+
+from fakesmtpd.metrics import metrics
+from fakesmtpd.pipeline import DROP, SinkPipeline, SinkWorker
+from fakesmtpd.state import State
+from test_fakesmtpd.helpers import make_state
+
+
+def _blocking_sink(release: threading.Event) -> Callable[[State], None]:
+    def sink(state: State) -> None:
+        release.wait()
+
+    return sink
+
+
+class TestSinkWorker:
+    def test_invalid_policy(self) -> None:
+        with pytest.raises(ValueError):
+            SinkWorker("test", lambda state: None, policy="ignore")
+
+    def test_deliver(self) -> None:
+        senders: list[str | None] = []
+        threads: list[threading.Thread] = []
+
+        def sink(state: State) -> None:
+            senders.append(state.reverse_path)
+            threads.append(threading.current_thread())
+
+        worker = SinkWorker("test", sink)
+
+        async def run() -> None:
+            worker.submit(make_state("a@example.com"))
+            worker.submit(make_state("b@example.com"))
+            await worker.aclose()
+
+        asyncio.run(run())
+        assert senders == ["a@example.com", "b@example.com"]
+        assert threads[0] is not threading.main_thread()
+        summaries = metrics.snapshot()["summaries"]
+        assert summaries['sink_latency_seconds{sink="test"}']["count"] == 2
+
+    def test_not_threaded(self) -> None:
+        senders: list[str | None] = []
+
+        async def sink(state: State) -> None:
+            await asyncio.sleep(0)
+            senders.append(state.reverse_path)
+
+        worker = SinkWorker("test", sink, threaded=False)
+
+        async def run() -> None:
+            worker.submit(make_state())
+            await worker.aclose()
+
+        asyncio.run(run())
+        assert senders == ["sender@example.com"]
+
+    def test_error(self) -> None:
+        senders: list[str | None] = []
+
+        def sink(state: State) -> None:
+            if state.reverse_path == "bad@example.com":
+                raise OSError("disk full")
+            senders.append(state.reverse_path)
+
+        worker = SinkWorker("test", sink)
+
+        async def run() -> None:
+            worker.submit(make_state("bad@example.com"))
+            worker.submit(make_state("good@example.com"))
+            await worker.aclose()
+
+        asyncio.run(run())
+        assert senders == ["good@example.com"]
+        counters = metrics.snapshot()["counters"]
+        assert counters['sink_errors{sink="test"}'] == 1
+
+    def test_drop(self) -> None:
+        release = threading.Event()
+        senders: list[str | None] = []
+
+        def sink(state: State) -> None:
+            release.wait()
+            senders.append(state.reverse_path)
+
+        worker = SinkWorker("test", sink, queue_size=1, policy=DROP)
+
+        async def run() -> None:
+            worker.submit(make_state("a@example.com"))
+            await asyncio.sleep(0.01)  # a is being delivered
+            assert worker.submit(make_state("b@example.com")) is None
+            assert worker.submit(make_state("c@example.com")) is None
+            assert len(worker) == 1
+            release.set()
+            await worker.aclose()
+
+        asyncio.run(run())
+        assert senders == ["a@example.com", "b@example.com"]
+        counters = metrics.snapshot()["counters"]
+        assert counters['sink_dropped{sink="test"}'] == 1
+
+    def test_block(self) -> None:
+        release = threading.Event()
+        senders: list[str | None] = []
+
+        def sink(state: State) -> None:
+            release.wait()
+            senders.append(state.reverse_path)
+
+        worker = SinkWorker("test", sink, queue_size=1)
+
+        async def run() -> None:
+            worker.submit(make_state("a@example.com"))
+            await asyncio.sleep(0.01)
+            assert worker.submit(make_state("b@example.com")) is None
+            waiting = worker.submit(make_state("c@example.com"))
+            assert waiting is not None
+            task = asyncio.ensure_future(waiting)
+            await asyncio.sleep(0.01)
+            assert not task.done()
+            release.set()
+            await task
+            await worker.aclose()
+
+        asyncio.run(run())
+        assert senders == ["a@example.com", "b@example.com", "c@example.com"]
+        counters = metrics.snapshot()["counters"]
+        assert counters['sink_blocked{sink="test"}'] == 1
+
+    def test_close(self) -> None:
+        senders: list[str | None] = []
+        worker = SinkWorker("test", lambda state: senders.append("x"))
+        worker.submit(make_state())
+        worker.submit(make_state())
+        assert senders == []
+        worker.close()
+        assert senders == ["x", "x"]
+        assert len(worker) == 0
+
+    def test_close__not_threaded(self) -> None:
+        senders: list[str | None] = []
+        worker = SinkWorker(
+            "test", lambda state: senders.append("x"), threaded=False
+        )
+        worker.submit(make_state())
+        worker.close()
+        assert senders == []
+        counters = metrics.snapshot()["counters"]
+        assert counters['sink_dropped{sink="test"}'] == 1
+
+
+class TestSinkPipeline:
+    def test_fan_out(self) -> None:
+        first: list[State] = []
+        second: list[State] = []
+        pipeline = SinkPipeline(
+            [
+                SinkWorker("first", first.append),
+                SinkWorker("second", second.append),
+            ]
+        )
+
+        async def run() -> None:
+            state = make_state()
+            assert pipeline(state) is None
+            state.clear()
+            await pipeline.aclose()
+
+        asyncio.run(run())
+        assert len(first) == 1
+        assert first[0] is second[0]
+        assert first[0].reverse_path == "sender@example.com"
+        assert first[0].forward_path == ["receiver@example.com"]
+        assert first[0].mail_data == "Subject: Foo\r\n\r\nText\r\n"
+
+    def test_slow_sink(self) -> None:
+        release = threading.Event()
+        fast: list[State] = []
+        pipeline = SinkPipeline(
+            [
+                SinkWorker("slow", _blocking_sink(release)),
+                SinkWorker("fast", fast.append),
+            ]
+        )
+
+        async def run() -> None:
+            for _ in range(3):
+                assert pipeline(make_state()) is None
+            for _ in range(100):
+                if len(fast) == 3:
+                    break
+                await asyncio.sleep(0.01)
+            assert len(fast) == 3
+            release.set()
+            await pipeline.aclose()
+
+        asyncio.run(run())
+
+    def test_block(self) -> None:
+        release = threading.Event()
+        pipeline = SinkPipeline(
+            [
+                SinkWorker("slow", _blocking_sink(release), queue_size=1),
+                SinkWorker("fast", lambda state: None),
+            ]
+        )
+
+        async def run() -> None:
+            pipeline(make_state())
+            await asyncio.sleep(0.01)
+            pipeline(make_state())
+            waiting = pipeline(make_state())
+            assert waiting is not None
+            release.set()
+            await waiting
+            await pipeline.aclose()
+
+        asyncio.run(run())
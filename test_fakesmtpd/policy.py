@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from fakesmtpd.policy import RecipientPolicy, load_recipient_policy
+
+
+class TestRecipientPolicy:
+    def test_empty(self) -> None:
+        policy = RecipientPolicy()
+        assert len(policy) == 0
+        assert not policy.accepts("foo@example.com")
+
+    def test_postmaster(self) -> None:
+        policy = RecipientPolicy()
+        assert policy.accepts("Postmaster")
+        assert not policy.accepts("postmaster@example.com")
+
+    def test_postmaster__domain(self) -> None:
+        policy = RecipientPolicy(["example.com"])
+        assert policy.accepts("PostMaster@Example.com")
+        assert not policy.accepts("postmaster@example.org")
+
+    def test_postmaster__address(self) -> None:
+        policy = RecipientPolicy(["foo@example.com", "!example.com"])
+        assert policy.accepts("Postmaster@example.com")
+        assert not policy.accepts("bar@example.com")
+
+    def test_postmaster__rejected(self) -> None:
+        policy = RecipientPolicy(["example.com", "!postmaster@example.com"])
+        assert policy.accepts("postmaster@example.com")
+
+    def test_postmaster__local_domains(self) -> None:
+        policy = RecipientPolicy(local_domains=["Mail.Example.com"])
+        assert policy.accepts("postmaster@mail.example.com")
+        assert not policy.accepts("foo@mail.example.com")
+        assert not policy.accepts("postmaster@example.com")
+
+    def test_address(self) -> None:
+        policy = RecipientPolicy(["Foo@Example.com"])
+        assert policy.accepts("foo@example.com")
+        assert policy.accepts("FOO@EXAMPLE.COM")
+        assert not policy.accepts("bar@example.com")
+        assert not policy.accepts("foo@example.org")
+
+    def test_domain(self) -> None:
+        policy = RecipientPolicy(["example.com"])
+        assert policy.accepts("foo@example.com")
+        assert policy.accepts("bar@Example.COM")
+        assert not policy.accepts("foo@sub.example.com")
+        assert not policy.accepts("foo@com")
+        assert not policy.accepts("foo@example.org")
+
+    def test_subdomains(self) -> None:
+        policy = RecipientPolicy(["*.example.com"])
+        assert policy.accepts("foo@sub.example.com")
+        assert policy.accepts("foo@a.b.example.com")
+        assert not policy.accepts("foo@example.com")
+        assert not policy.accepts("foo@otherexample.com")
+
+    def test_wildcard(self) -> None:
+        policy = RecipientPolicy(["*", "!example.com"])
+        assert policy.accepts("foo@example.org")
+        assert policy.accepts("foo@sub.example.com")
+        assert not policy.accepts("foo@example.com")
+
+    def test_reject_address(self) -> None:
+        policy = RecipientPolicy(["example.com", "!bob@example.com"])
+        assert policy.accepts("alice@example.com")
+        assert not policy.accepts("bob@example.com")
+
+    def test_most_specific_rule(self) -> None:
+        policy = RecipientPolicy(
+            [
+                "*.example.com",
+                "!*.test.example.com",
+                "ok.test.example.com",
+                "alice@bad.test.example.com",
+            ]
+        )
+        assert policy.accepts("foo@a.example.com")
+        assert policy.accepts("foo@test.example.com")
+        assert not policy.accepts("foo@a.test.example.com")
+        assert policy.accepts("foo@ok.test.example.com")
+        assert not policy.accepts("foo@a.ok.test.example.com")
+        assert policy.accepts("alice@bad.test.example.com")
+
+    def test_address_literal(self) -> None:
+        policy = RecipientPolicy(["[192.0.2.1]"])
+        assert policy.accepts("foo@[192.0.2.1]")
+        assert not policy.accepts("foo@[192.0.2.2]")
+
+    def test_replace(self) -> None:
+        policy = RecipientPolicy(["example.com", "!example.com"])
+        assert not policy.accepts("foo@example.com")
+
+    @pytest.mark.parametrize(
+        "rule",
+        ["", "!", "@example.com", "foo@", "*@example.com", "*.", "a*.com"],
+    )
+    def test_invalid(self, rule: str) -> None:
+        with pytest.raises(ValueError):
+            RecipientPolicy([rule])
+
+
+class TestLoadRecipientPolicy:
+    def test_load(self, tmp_path: Path) -> None:
+        filename = tmp_path / "recipients.txt"
+        filename.write_text(
+            "# Comment\n\nexample.com\n  !bob@example.com  \nfoo@example.org\n"
+        )
+        policy = load_recipient_policy(str(filename))
+        assert len(policy) == 3
+        assert policy.accepts("alice@example.com")
+        assert not policy.accepts("bob@example.com")
+        assert policy.accepts("foo@example.org")
+
+    def test_invalid(self, tmp_path: Path) -> None:
+        filename = tmp_path / "recipients.txt"
+        filename.write_text("example.com\nfoo@\n")
+        with pytest.raises(ValueError, match="line 2"):
+            load_recipient_policy(str(filename))
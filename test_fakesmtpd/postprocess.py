@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+from collections.abc import Iterator
+from typing import Any
+
+import pytest
+
+from fakesmtpd.metrics import metrics
+from fakesmtpd.postprocess import PostProcessor, content_hash, mime_summary
+from fakesmtpd.state import State
+
+MAIL = (
+    "Subject: Test\r\n"
+    "MIME-Version: 1.0\r\n"
+    'Content-Type: multipart/mixed; boundary="b"\r\n'
+    "\r\n"
+    "--b\r\n"
+    "Content-Type: text/plain\r\n"
+    "\r\n"
+    "Hello\r\n"
+    "--b\r\n"
+    "Content-Type: application/octet-stream\r\n"
+    'Content-Disposition: attachment; filename="data.bin"\r\n'
+    "Content-Transfer-Encoding: base64\r\n"
+    "\r\n"
+    "AAECAw==\r\n"
+    "--b--\r\n"
+)
+
+
+def size(data: memoryview) -> int:
+    return len(data)
+
+
+def fail(data: memoryview) -> None:
+    raise ValueError("invalid mail")
+
+
+@pytest.fixture
+def processor() -> Iterator[PostProcessor]:
+    processor = PostProcessor(
+        {"hash": content_hash, "size": size}, max_workers=1
+    )
+    yield processor
+    processor.close()
+
+
+class TestPostProcessor:
+    def test_process(self, processor: PostProcessor) -> None:
+        results = asyncio.run(processor.process(MAIL))
+        assert results == {
+            "hash": hashlib.sha256(MAIL.encode()).hexdigest(),
+            "size": len(MAIL),
+        }
+        summaries = metrics.snapshot()["summaries"]
+        assert summaries["postprocess_seconds"]["count"] == 1
+
+    def test_process__shared_memory(self) -> None:
+        processor = PostProcessor(
+            {"hash": content_hash, "size": size},
+            max_workers=1,
+            shared_memory_threshold=0,
+        )
+        try:
+            results = asyncio.run(processor.process(MAIL.encode()))
+        finally:
+            processor.close()
+        assert results == {
+            "hash": hashlib.sha256(MAIL.encode()).hexdigest(),
+            "size": len(MAIL),
+        }
+
+    def test_process__error(self) -> None:
+        processor = PostProcessor({"fail": fail}, max_workers=1)
+        try:
+            with pytest.raises(ValueError, match="invalid mail"):
+                asyncio.run(processor.process(MAIL))
+        finally:
+            processor.close()
+        assert metrics.snapshot()["counters"]["postprocess_errors"] == 1
+
+    def test_sink(self, processor: PostProcessor) -> None:
+        received: list[tuple[State, dict[str, Any]]] = []
+        state = State()
+        state.mail_data = MAIL
+        sink = processor.sink(lambda s, r: received.append((s, r)))
+
+        async def run() -> None:
+            await sink(state)
+
+        asyncio.run(run())
+        assert len(received) == 1
+        assert received[0][0] is state
+        assert received[0][1]["size"] == len(MAIL)
+
+
+class TestMimeSummary:
+    def test_summary(self) -> None:
+        summary = mime_summary(memoryview(MAIL.encode()))
+        assert summary == {
+            "content_type": "multipart/mixed",
+            "parts": [
+                {"content_type": "text/plain", "filename": None, "size": 5},
+                {
+                    "content_type": "application/octet-stream",
+                    "filename": "data.bin",
+                    "size": 4,
+                },
+            ],
+        }
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import pstats
+from http import HTTPStatus
+from pathlib import Path
+
+import pytest
+
+from fakesmtpd.admin import AdminServer
+from fakesmtpd.metrics import metrics
+from fakesmtpd.profiling import (
+    MemoryTracer,
+    Profiler,
+    add_profiling_routes,
+    monitor_loop_lag,
+)
+
+
+class TestProfiler:
+    def test_start_stop(self, tmp_path: Path) -> None:
+        async def run() -> str:
+            profiler = Profiler(str(tmp_path))
+            profiler.start(60)
+            assert profiler.running
+            sum(range(1000))
+            return profiler.stop()
+
+        filename = asyncio.run(run())
+        assert os.path.dirname(filename) == str(tmp_path)
+        pstats.Stats(filename)
+
+    def test_stop_after_timeout(self, tmp_path: Path) -> None:
+        async def run() -> Profiler:
+            profiler = Profiler(str(tmp_path))
+            profiler.start(0.01)
+            await asyncio.sleep(0.05)
+            return profiler
+
+        profiler = asyncio.run(run())
+        assert not profiler.running
+        assert len(list(tmp_path.glob("*.pstats"))) == 1
+
+    def test_toggle(self, tmp_path: Path) -> None:
+        async def run() -> None:
+            profiler = Profiler(str(tmp_path))
+            profiler.toggle()
+            assert profiler.running
+            profiler.toggle()
+            assert not profiler.running
+
+        asyncio.run(run())
+
+    def test_start_twice(self, tmp_path: Path) -> None:
+        async def run() -> None:
+            profiler = Profiler(str(tmp_path))
+            profiler.start()
+            try:
+                with pytest.raises(RuntimeError):
+                    profiler.start()
+            finally:
+                profiler.stop()
+
+        asyncio.run(run())
+
+    def test_stop_not_running(self) -> None:
+        with pytest.raises(RuntimeError):
+            Profiler().stop()
+
+
+class TestMemoryTracer:
+    def test_snapshots(self, tmp_path: Path) -> None:
+        tracer = MemoryTracer(str(tmp_path))
+        try:
+            assert tracer.snapshot() is None
+            data = [bytearray(1000) for _ in range(100)]
+            filename = tracer.snapshot()
+        finally:
+            tracer.stop()
+        assert filename is not None
+        assert os.path.exists(filename)
+        assert data
+
+
+class TestMonitorLoopLag:
+    def test_record_lag(self) -> None:
+        async def run() -> None:
+            task = asyncio.create_task(monitor_loop_lag(0.001, 1.0))
+            await asyncio.sleep(0.02)
+            task.cancel()
+
+        metrics.reset()
+        asyncio.run(run())
+        assert "event_loop_lag_seconds" in metrics.gauges
+        assert metrics.summaries["event_loop_lag"].count > 0
+
+
+class TestProfilingRoutes:
+    def test_profile(self, tmp_path: Path) -> None:
+        admin = AdminServer()
+        add_profiling_routes(
+            admin, Profiler(str(tmp_path)), MemoryTracer(str(tmp_path))
+        )
+
+        async def run() -> None:
+            status, body = await admin.dispatch(
+                "POST", "/profile", {"seconds": "10"}
+            )
+            assert status == HTTPStatus.ACCEPTED
+            assert body == {"profiling": True, "seconds": 10.0}
+            status, _ = await admin.dispatch("POST", "/profile", {})
+            assert status == HTTPStatus.CONFLICT
+            status, body = await admin.dispatch("DELETE", "/profile", {})
+            assert status == HTTPStatus.OK
+            assert os.path.exists(body["file"])
+
+        asyncio.run(run())
+
+    def test_invalid_seconds(self) -> None:
+        admin = AdminServer()
+        add_profiling_routes(admin, Profiler(), MemoryTracer())
+        status, _ = asyncio.run(
+            admin.dispatch("POST", "/profile", {"seconds": "-1"})
+        )
+        assert status == HTTPStatus.BAD_REQUEST
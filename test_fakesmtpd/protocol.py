@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import asyncio
+from functools import partial
+
+import pytest
+from pytest_mock import MockerFixture
+
+from fakesmtpd.connection import ConnectionHandler
+from fakesmtpd.embedded import ReceivedMessage
+from fakesmtpd.protocol import SMTPProtocol
+from fakesmtpd.smtp import SMTPStatus
+from fakesmtpd.state import State
+
+FAKE_HOST = "mail.example.com"
+
+
+class FakeTransport(asyncio.Transport):
+    def __init__(self) -> None:
+        super().__init__()
+        self.data = b""
+        self.closed = False
+        self.reading_paused = False
+        self.writes = 0
+
+    def write(self, data: bytes | bytearray | memoryview) -> None:
+        self.writes += 1
+        self.data += data
+
+    def close(self) -> None:
+        self.closed = True
+
+    def is_closing(self) -> bool:
+        return self.closed
+
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+    def get_write_buffer_limits(self) -> tuple[int, int]:
+        return 16 * 1024, 64 * 1024
+
+    def pause_reading(self) -> None:
+        self.reading_paused = True
+
+    def resume_reading(self) -> None:
+        self.reading_paused = False
+
+    @property
+    def lines(self) -> list[str]:
+        return self.data.decode("ascii").splitlines()
+
+
+def _feed(protocol: SMTPProtocol, data: bytes) -> None:
+    while data:
+        buffer = protocol.get_buffer(len(data))
+        n = min(len(buffer), len(data))
+        buffer[:n] = data[:n]
+        protocol.buffer_updated(n)
+        data = data[n:]
+
+
+class TestSMTPProtocol:
+    @pytest.fixture(autouse=True)
+    def server_name(self, mocker: MockerFixture) -> None:
+        mocker.patch("fakesmtpd.connection.server_name", lambda: FAKE_HOST)
+        mocker.patch("fakesmtpd.commands.server_name", lambda: FAKE_HOST)
+
+    def _run(
+        self, chunks: list[bytes], *, buffer_size: int = 1024
+    ) -> FakeTransport:
+        printed: list[ReceivedMessage] = []
+        self.printed = printed
+
+        def print_mail(state: State) -> None:
+            printed.append(ReceivedMessage.from_state(state))
+
+        async def run() -> FakeTransport:
+            protocol = SMTPProtocol(
+                partial(ConnectionHandler, print_mail=print_mail),
+                buffer_size=buffer_size,
+            )
+            transport = FakeTransport()
+            protocol.connection_made(transport)
+            for chunk in chunks:
+                await asyncio.sleep(0)
+                _feed(protocol, chunk)
+            await asyncio.sleep(0)
+            protocol.eof_received()
+            assert protocol._task is not None
+            await protocol._task
+            return transport
+
+        return asyncio.run(run())
+
+    def test_greeting(self) -> None:
+        transport = self._run([])
+        assert transport.lines == [
+            f"{SMTPStatus.SERVICE_READY.value} {FAKE_HOST} "
+            "FakeSMTPd Service ready"
+        ]
+
+    def test_command(self) -> None:
+        transport = self._run([b"NOOP\r\n"])
+        assert transport.lines[-1] == "250 OK"
+
+    def test_pipelined_commands(self) -> None:
+        transport = self._run([b"NOOP\r\nNOOP\r\nQUIT\r\n"])
+        assert transport.lines[1:] == [
+            "250 OK",
+            "250 OK",
+            f"221 {FAKE_HOST} Service closing transmission channel",
+        ]
+        assert transport.closed
+
+    def test_pipelined_commands__single_write(self) -> None:
+        transport = self._run([b"NOOP\r\nNOOP\r\nNOOP\r\n"])
+        assert transport.lines[1:] == ["250 OK"] * 3
+        # One write for the greeting, one for the replies.
+        assert transport.writes == 2
+
+    def test_split_line(self) -> None:
+        transport = self._run([b"NO", b"OP\r", b"\n"])
+        assert transport.lines[-1] == "250 OK"
+
+    def test_line_larger_than_buffer(self) -> None:
+        line = b"NOOP " + b"x" * 100 + b"\r\n"
+        transport = self._run([line], buffer_size=16)
+        assert transport.lines[-1] == "250 OK"
+
+    def test_mail(self) -> None:
+        self._run(
+            [
+                b"EHLO client.example.com\r\n"
+                b"MAIL FROM:<foo@example.com>\r\n"
+                b"RCPT TO:<bar@example.com>\r\n"
+                b"DATA\r\n",
+                b"Subject: Foo\r\n\r\nText\r\n.\r\n",
+            ]
+        )
+        assert len(self.printed) == 1
+        assert self.printed[0].reverse_path == "foo@example.com"
+        assert self.printed[0].mail_data == "Subject: Foo\r\n\r\nText\r\n"
+
+    def test_incomplete_line_at_eof(self) -> None:
+        transport = self._run([b"NOOP"])
+        assert len(transport.lines) == 1
+
+    def test_pause_reading(self) -> None:
+        async def run() -> FakeTransport:
+            protocol = SMTPProtocol(
+                partial(ConnectionHandler, print_mail=lambda state: None),
+                limit=8,
+            )
+            transport = FakeTransport()
+            protocol.connection_made(transport)
+            _feed(protocol, b"NOOP\r\n" * 4)
+            assert transport.reading_paused
+            await asyncio.sleep(0)
+            assert not transport.reading_paused
+            protocol.connection_lost(None)
+            assert protocol._task is not None
+            await protocol._task
+            return transport
+
+        transport = asyncio.run(run())
+        assert transport.lines[1:] == ["250 OK"] * 4
+
+    def test_drain(self) -> None:
+        async def run() -> None:
+            protocol = SMTPProtocol(
+                partial(ConnectionHandler, print_mail=lambda state: None)
+            )
+            protocol.connection_made(FakeTransport())
+            await protocol.drain()
+            protocol.pause_writing()
+            drain = asyncio.create_task(protocol.drain())
+            await asyncio.sleep(0)
+            assert not drain.done()
+            protocol.resume_writing()
+            await asyncio.wait_for(drain, 1)
+            protocol.connection_lost(None)
+            assert protocol._task is not None
+            await protocol._task
+
+        asyncio.run(run())
+
+    def test_shared_receive_buffer(self) -> None:
+        factory = partial(ConnectionHandler, print_mail=lambda state: None)
+        first = SMTPProtocol(factory)
+        second = SMTPProtocol(factory)
+        assert first.get_buffer(-1) is second.get_buffer(-1)
+
+    def test_many_pipelined_lines(self) -> None:
+        commands = b"".join(b"NOOP %d\r\n" % i for i in range(500))
+        transport = self._run([commands[:1001], commands[1001:]])
+        assert transport.lines[1:] == ["250 OK"] * 500
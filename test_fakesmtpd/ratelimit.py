@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import pytest
+
+from fakesmtpd.metrics import metrics
+from fakesmtpd.ratelimit import (
+    BucketTable,
+    Rate,
+    RateLimiter,
+    parse_rate_limit,
+)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+class TestBucketTable:
+    def test_burst(self, clock: FakeClock) -> None:
+        table = BucketTable(Rate(1, 1.0, 3), clock=clock)
+        assert table.take("a")
+        assert table.take("a")
+        assert table.take("a")
+        assert not table.take("a")
+        assert table.take("b")
+
+    def test_refill(self, clock: FakeClock) -> None:
+        table = BucketTable(Rate(2, 1.0, 2), clock=clock)
+        assert table.take("a", 2)
+        assert not table.take("a")
+        clock.now += 0.5
+        assert table.take("a")
+        assert not table.take("a")
+        clock.now += 10
+        assert table.take("a", 2)
+
+    def test_has_tokens(self, clock: FakeClock) -> None:
+        table = BucketTable(Rate(1, 1.0, 1), clock=clock)
+        assert table.has_tokens("a")
+        assert not table.has_tokens("a", 2)
+        assert len(table) == 0
+
+    def test_charge_into_debt(self, clock: FakeClock) -> None:
+        table = BucketTable(Rate(10, 1.0, 10), clock=clock)
+        table.charge("a", 30)
+        assert not table.has_tokens("a", 0)
+        clock.now += 1.5
+        assert not table.has_tokens("a", 0)
+        clock.now += 0.5
+        assert table.has_tokens("a", 0)
+        assert not table.has_tokens("a", 1)
+
+    def test_full_buckets_expire(self, clock: FakeClock) -> None:
+        table = BucketTable(Rate(1, 1.0, 5), clock=clock)
+        table.take("a")
+        table.take("b", 3)
+        assert len(table) == 2
+        clock.now += 2
+        table.take("c")
+        assert len(table) == 2
+        clock.now += 5
+        table.take("d")
+        assert len(table) == 1
+
+    def test_full_buckets_expire__out_of_order(self, clock: FakeClock) -> None:
+        table = BucketTable(Rate(1, 1.0, 20), clock=clock)
+        table.take("a", 10)
+        table.take("b")
+        clock.now += 2
+        table.take("c")
+        assert len(table) == 2
+        assert table.has_tokens("a", 12)
+        assert not table.has_tokens("a", 13)
+
+    def test_expiry_heap_is_bounded(self, clock: FakeClock) -> None:
+        table = BucketTable(Rate(1, 1.0, 1000), clock=clock)
+        for _ in range(1000):
+            table.take("a")
+        assert len(table) == 1
+        assert len(table._expiry) <= 66
+
+    def test_max_clients(self, clock: FakeClock) -> None:
+        table = BucketTable(Rate(1, 1.0, 2), max_clients=2, clock=clock)
+        table.take("a", 2)
+        table.take("b")
+        table.take("c")
+        assert len(table) == 2
+        assert table.take("a")
+
+
+class TestRateLimiter:
+    def test_no_limits(self) -> None:
+        limiter = RateLimiter([])
+        assert limiter.allow_connection("192.0.2.1")
+        assert limiter.allow_message("192.0.2.1", "foo@example.com")
+        limiter.count_bytes("192.0.2.1", "foo@example.com", 10**9)
+        assert limiter.allow_message("192.0.2.1", "foo@example.com")
+
+    def test_connections(self, clock: FakeClock) -> None:
+        limiter = RateLimiter(
+            [("peer", "connections", Rate(1, 1.0, 1))], clock=clock
+        )
+        assert limiter.allow_connection("192.0.2.1")
+        assert not limiter.allow_connection("192.0.2.1")
+        assert limiter.allow_connection("192.0.2.2")
+        counters = metrics.snapshot()["counters"]
+        assert (
+            counters['rate_limited{resource="connections",scope="peer"}'] == 1
+        )
+
+    def test_messages_per_sender(self, clock: FakeClock) -> None:
+        limiter = RateLimiter(
+            [("sender", "messages", Rate(1, 60.0, 1))], clock=clock
+        )
+        assert limiter.allow_message("192.0.2.1", "foo@example.com")
+        assert not limiter.allow_message("192.0.2.2", "FOO@example.com")
+        assert limiter.allow_message("192.0.2.1", "bar@example.com")
+
+    def test_message_not_counted_if_rejected(self, clock: FakeClock) -> None:
+        limiter = RateLimiter(
+            [
+                ("peer", "messages", Rate(2, 1.0, 2)),
+                ("sender", "messages", Rate(1, 1.0, 1)),
+            ],
+            clock=clock,
+        )
+        assert limiter.allow_message("192.0.2.1", "foo@example.com")
+        assert not limiter.allow_message("192.0.2.1", "foo@example.com")
+        assert limiter.allow_message("192.0.2.1", "bar@example.com")
+
+    def test_bytes(self, clock: FakeClock) -> None:
+        limiter = RateLimiter(
+            [("peer", "bytes", Rate(1000, 1.0, 1000))], clock=clock
+        )
+        assert limiter.allow_message("192.0.2.1", "foo@example.com")
+        limiter.count_bytes("192.0.2.1", "foo@example.com", 3000)
+        assert not limiter.allow_message("192.0.2.1", "foo@example.com")
+        assert limiter.allow_message("192.0.2.2", "foo@example.com")
+        clock.now += 2
+        assert limiter.allow_message("192.0.2.1", "foo@example.com")
+
+
+class TestParseRateLimit:
+    @pytest.mark.parametrize(
+        "spec,expected",
+        [
+            (
+                "peer:connections=10/s",
+                ("peer", "connections", Rate(10, 1, 10)),
+            ),
+            (
+                "peer:messages=100/m,burst=20",
+                ("peer", "messages", Rate(100, 60, 20)),
+            ),
+            (
+                "sender:bytes=10M/h",
+                ("sender", "bytes", Rate(10 * 1024**2, 3600, 10 * 1024**2)),
+            ),
+            (
+                "sender:bytes=1.5k/d,burst=2K",
+                ("sender", "bytes", Rate(1536, 86400, 2048)),
+            ),
+        ],
+    )
+    def test_valid(self, spec: str, expected: tuple[str, str, Rate]) -> None:
+        assert parse_rate_limit(spec) == expected
+
+    @pytest.mark.parametrize(
+        "spec",
+        [
+            "",
+            "peer:messages",
+            "host:messages=1/s",
+            "peer:mails=1/s",
+            "sender:connections=1/s",
+            "peer:messages=1",
+            "peer:messages=1/w",
+            "peer:messages=x/s",
+            "peer:messages=0/s",
+            "peer:messages=10K/s",
+            "peer:messages=1/s,burst",
+            "peer:messages=1/s,size=1",
+        ],
+    )
+    def test_invalid(self, spec: str) -> None:
+        with pytest.raises(ValueError):
+            parse_rate_limit(spec)
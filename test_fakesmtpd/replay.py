@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import socket
+from functools import partial
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from fakesmtpd.connection import ConnectionHandler
+from fakesmtpd.embedded import ReceivedMessage
+from fakesmtpd.replay import main, parse_speed, replay_session
+from fakesmtpd.server import start_stream_server
+from fakesmtpd.state import State
+from fakesmtpd.trace import INBOUND, OUTBOUND, TraceRecord, TraceWriter
+
+
+class TestParseSpeed:
+    def test_max(self) -> None:
+        assert parse_speed("max") == 0.0
+
+    def test_factor(self) -> None:
+        assert parse_speed("2.5") == 2.5
+
+    def test_not_positive(self) -> None:
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_speed("0")
+
+
+class TestReplaySession:
+    def test_replay(self) -> None:
+        records = [
+            TraceRecord(OUTBOUND, 0.0, b"220 Ready\r\n"),
+            TraceRecord(INBOUND, 0.01, b"EHLO client.example.com\r\n"),
+            TraceRecord(OUTBOUND, 0.01, b"250 Hello\r\n"),
+            TraceRecord(
+                INBOUND,
+                0.02,
+                b"MAIL FROM:<foo@example.com>\r\n"
+                b"RCPT TO:<bar@example.com>\r\n"
+                b"DATA\r\n",
+            ),
+            TraceRecord(OUTBOUND, 0.02, b"250 OK\r\n250 OK\r\n354 Go\r\n"),
+            TraceRecord(INBOUND, 0.03, b"Subject: Foo\r\n\r\n.\r\n"),
+            TraceRecord(OUTBOUND, 0.03, b"250 OK\r\n"),
+        ]
+        printed: list[ReceivedMessage] = []
+
+        def print_mail(state: State) -> None:
+            printed.append(ReceivedMessage.from_state(state))
+
+        async def run() -> int:
+            factory = partial(ConnectionHandler, print_mail=print_mail)
+            server = await start_stream_server("127.0.0.1", 0, factory)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                return await replay_session(
+                    records, "127.0.0.1", port, speed=10
+                )
+
+        sent = asyncio.run(run())
+        assert sent == sum(
+            len(r.data) for r in records if r.direction == INBOUND
+        )
+        assert len(printed) == 1
+        assert printed[0].forward_path == ["bar@example.com"]
+
+
+class TestMain:
+    def _main(self, mocker: MockerFixture, *args: str) -> None:
+        mocker.patch("sys.argv", ["fakesmtpd-replay", *args])
+        with pytest.raises(SystemExit) as exc_info:
+            main()
+        assert exc_info.value.code == 1
+
+    def test_invalid_trace(
+        self,
+        tmp_path: Path,
+        mocker: MockerFixture,
+        capsys: pytest.CaptureFixture[str],
+    ) -> None:
+        path = tmp_path / "invalid.trace"
+        path.write_bytes(b"INVALID!")
+        self._main(mocker, str(path))
+        assert capsys.readouterr().err.strip() == (
+            f"{path}: not a FakeSMTPd trace file"
+        )
+
+    def test_connection_refused(
+        self,
+        tmp_path: Path,
+        mocker: MockerFixture,
+        capsys: pytest.CaptureFixture[str],
+    ) -> None:
+        path = tmp_path / "session.trace"
+        writer = TraceWriter(path)
+        writer.record_inbound(b"QUIT\r\n")
+        writer.close()
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        self._main(mocker, "--port", str(port), str(path))
+        assert capsys.readouterr().err.count("\n") == 1
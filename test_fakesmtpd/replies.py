@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+from fakesmtpd.replies import encode_reply
+from fakesmtpd.smtp import SMTPStatus
+
+
+class TestEncodeReply:
+    def test_single_line(self) -> None:
+        assert encode_reply(SMTPStatus.OK, "OK") == b"250 OK\r\n"
+
+    def test_multi_line(self) -> None:
+        reply = encode_reply(SMTPStatus.OK, "mail.example.com\nPIPELINING\nX")
+        assert reply == (
+            b"250-mail.example.com\r\n250-PIPELINING\r\n250 X\r\n"
+        )
+
+    def test_empty_text(self) -> None:
+        assert encode_reply(SMTPStatus.OK, "") == b"250 \r\n"
+
+    def test_cached(self) -> None:
+        first = encode_reply(SMTPStatus.SERVICE_CLOSING, "Bye")
+        assert encode_reply(SMTPStatus.SERVICE_CLOSING, "Bye") is first
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from fakesmtpd.mbox import MboxReader
+from fakesmtpd.metrics import metrics
+from fakesmtpd.routing import (
+    DOMAIN,
+    FileCache,
+    MailboxRouter,
+    mailbox_name,
+)
+from test_fakesmtpd.helpers import make_state
+
+
+class TestMailboxName:
+    def test_recipient(self) -> None:
+        assert mailbox_name("Foo@Example.com") == "foo@example.com.mbox"
+
+    def test_domain(self) -> None:
+        assert mailbox_name("foo@Example.com", DOMAIN) == "example.com.mbox"
+
+    def test_postmaster(self) -> None:
+        assert mailbox_name("Postmaster", DOMAIN) == "postmaster.mbox"
+
+    def test_unsafe_characters(self) -> None:
+        assert mailbox_name("a/b@example.com") == "a%2Fb@example.com.mbox"
+        assert mailbox_name('"a b"@example.com') == (
+            "%22a%20b%22@example.com.mbox"
+        )
+
+    def test_leading_dot(self) -> None:
+        assert mailbox_name("..@example.com") == "%2E.@example.com.mbox"
+
+
+class TestFileCache:
+    def test_invalid_max_open(self) -> None:
+        with pytest.raises(ValueError):
+            FileCache(0)
+
+    def test_reuse(self, tmp_path: Path) -> None:
+        cache = FileCache(2)
+        f = cache.get(str(tmp_path / "a"))
+        assert cache.get(str(tmp_path / "a")) is f
+        assert len(cache) == 1
+        assert metrics.snapshot()["counters"]["mailbox_opens"] == 1
+        cache.close()
+        assert f.closed
+        assert len(cache) == 0
+
+    def test_evict_least_recently_used(self, tmp_path: Path) -> None:
+        a, b, c = (str(tmp_path / name) for name in "abc")
+        cache = FileCache(2)
+        fa = cache.get(a)
+        fb = cache.get(b)
+        cache.get(a)
+        cache.get(c)
+        assert fb.closed
+        assert not fa.closed
+        assert a in cache
+        assert b not in cache
+        assert metrics.snapshot()["counters"]["mailbox_evictions"] == 1
+        cache.close()
+
+
+class TestMailboxRouter:
+    def test_invalid_route(self, tmp_path: Path) -> None:
+        with pytest.raises(ValueError):
+            MailboxRouter(str(tmp_path), route="sender")
+
+    def test_route_by_recipient(self, tmp_path: Path) -> None:
+        router = MailboxRouter(str(tmp_path / "mail"))
+        router(make_state(recipients=["a@example.com", "B@example.org"]))
+        router(make_state(recipients=["a@example.com"]))
+        router.close()
+        with MboxReader(str(tmp_path / "mail" / "a@example.com.mbox")) as r:
+            assert len(r) == 2
+            assert r[1].forward_path == ["a@example.com"]
+        with MboxReader(str(tmp_path / "mail" / "b@example.org.mbox")) as r:
+            assert len(r) == 1
+            assert r[0].forward_path == ["a@example.com", "B@example.org"]
+
+    def test_route_by_domain(self, tmp_path: Path) -> None:
+        router = MailboxRouter(str(tmp_path), route=DOMAIN)
+        router(
+            make_state(
+                recipients=["a@example.com", "b@example.com", "c@example.org"]
+            )
+        )
+        router.close()
+        assert sorted(p.name for p in tmp_path.iterdir()) == [
+            "example.com.mbox",
+            "example.org.mbox",
+        ]
+        with MboxReader(str(tmp_path / "example.com.mbox")) as r:
+            assert len(r) == 1
+
+    def test_many_recipients(self, tmp_path: Path) -> None:
+        router = MailboxRouter(str(tmp_path), max_open_files=3)
+        recipients = [f"r{i}@example.com" for i in range(10)]
+        router(make_state(recipients=recipients))
+        router(make_state(recipients=recipients))
+        router.close()
+        assert len(list(tmp_path.iterdir())) == 10
+        text = (tmp_path / "r0@example.com.mbox").read_text()
+        assert text.count("From sender@example.com") == 2
+
+    def test_reopen(self, tmp_path: Path) -> None:
+        router = MailboxRouter(str(tmp_path))
+        router(make_state(recipients=["a@example.com"]))
+        mailbox = tmp_path / "a@example.com.mbox"
+        mailbox.rename(tmp_path / "rotated")
+        router.reopen()
+        router(make_state(recipients=["a@example.com"]))
+        router.close()
+        assert mailbox.read_text().count("From ") == 1
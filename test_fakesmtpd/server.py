@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+from functools import partial
+from pathlib import Path
+from types import ModuleType
+from unittest.mock import Mock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from fakesmtpd.connection import ConnectionHandler, HandlerFactory
+from fakesmtpd.listeners import Listener
+from fakesmtpd.metrics import metrics
+from fakesmtpd.server import (
+    select_event_loop,
+    serve,
+    start_listeners,
+    start_stream_server,
+)
+from fakesmtpd.sessions import SessionRegistry
+from fakesmtpd.state import State
+
+
+class TestSelectEventLoop:
+    @pytest.fixture
+    def uvloop(self, mocker: MockerFixture) -> Mock:
+        module = ModuleType("uvloop")
+        run = Mock()
+        module.run = run  # type: ignore[attr-defined]
+        mocker.patch.dict(sys.modules, {"uvloop": module})
+        return run
+
+    @pytest.fixture
+    def no_uvloop(self, mocker: MockerFixture) -> None:
+        mocker.patch.dict(sys.modules, {"uvloop": None})
+
+    def test_asyncio(self, uvloop: Mock) -> None:
+        assert select_event_loop("asyncio") == ("asyncio", asyncio.run)
+
+    def test_uvloop(self, uvloop: Mock) -> None:
+        assert select_event_loop("uvloop") == ("uvloop", uvloop)
+
+    @pytest.mark.usefixtures("no_uvloop")
+    def test_uvloop__not_installed(self) -> None:
+        with pytest.raises(ImportError):
+            select_event_loop("uvloop")
+
+    def test_auto(self, uvloop: Mock) -> None:
+        assert select_event_loop("auto") == ("uvloop", uvloop)
+
+    @pytest.mark.usefixtures("no_uvloop")
+    def test_auto__not_installed(self) -> None:
+        assert select_event_loop("auto") == ("asyncio", asyncio.run)
+
+    def test_unknown(self) -> None:
+        with pytest.raises(ValueError):
+            select_event_loop("foo")
+
+
+class TestServe:
+    def test_stop_on_signal(self) -> None:
+        async def run() -> None:
+            servers: list[asyncio.Server] = []
+
+            async def start() -> list[asyncio.Server]:
+                server = await start_stream_server(
+                    "127.0.0.1",
+                    0,
+                    partial(ConnectionHandler, print_mail=lambda state: None),
+                )
+                servers.append(server)
+                asyncio.get_running_loop().call_soon(
+                    os.kill, os.getpid(), signal.SIGTERM
+                )
+                return [server]
+
+            await asyncio.wait_for(serve(start), 5)
+            assert not servers[0].is_serving()
+
+        asyncio.run(run())
+
+    def test_drain_on_signal(self) -> None:
+        mails: list[State] = []
+        sessions = SessionRegistry(shutdown_timeout=5)
+        factory = partial(
+            ConnectionHandler, print_mail=mails.append, sessions=sessions
+        )
+
+        async def command(
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter,
+            line: str,
+        ) -> bytes:
+            writer.write(line.encode("ascii") + b"\r\n")
+            return await reader.readline()
+
+        async def run() -> None:
+            started = asyncio.Event()
+            servers: list[asyncio.Server] = []
+
+            async def start() -> list[asyncio.Server]:
+                server = await start_stream_server("127.0.0.1", 0, factory)
+                servers.append(server)
+                started.set()
+                return [server]
+
+            serve_task = asyncio.create_task(serve(start, sessions=sessions))
+            await started.wait()
+            port = servers[0].sockets[0].getsockname()[1]
+            idle_r, idle_w = await asyncio.open_connection("127.0.0.1", port)
+            busy_r, busy_w = await asyncio.open_connection("127.0.0.1", port)
+            await idle_r.readline()
+            await busy_r.readline()
+            for line in [
+                "HELO client.example.com",
+                "MAIL FROM:<foo@example.com>",
+                "RCPT TO:<bar@example.com>",
+                "DATA",
+            ]:
+                await command(busy_r, busy_w, line)
+
+            os.kill(os.getpid(), signal.SIGTERM)
+            assert (await idle_r.readline()).startswith(b"421 ")
+            assert await idle_r.read() == b""
+            busy_w.write(b"Subject: Foo\r\n")
+            assert await command(busy_r, busy_w, ".") == b"250 OK\r\n"
+            assert (await busy_r.readline()).startswith(b"421 ")
+            await asyncio.wait_for(serve_task, 5)
+            assert len(sessions) == 0
+            idle_w.close()
+            busy_w.close()
+
+        asyncio.run(run())
+        assert len(mails) == 1
+
+
+class TestStartListeners:
+    def test_tcp_and_unix(self, tmp_path: Path) -> None:
+        metrics.reset()
+        path = str(tmp_path / "smtp.sock")
+        listeners = [
+            Listener(host="127.0.0.1", port=0),
+            Listener("local", path=path, max_connections=1),
+        ]
+
+        def handler_factory(listener: Listener) -> HandlerFactory:
+            return partial(
+                ConnectionHandler,
+                print_mail=lambda state: None,
+                listener=listener,
+            )
+
+        async def run() -> None:
+            servers = await start_listeners(
+                listeners, "streams", handler_factory
+            )
+            try:
+                port = servers[0].sockets[0].getsockname()[1]
+                tcp_r, tcp_w = await asyncio.open_connection("127.0.0.1", port)
+                assert (await tcp_r.readline()).startswith(b"220 ")
+                unix_r, unix_w = await asyncio.open_unix_connection(path)
+                assert (await unix_r.readline()).startswith(b"220 ")
+                rejected_r, rejected_w = await asyncio.open_unix_connection(
+                    path
+                )
+                assert (await rejected_r.readline()).startswith(b"421 ")
+                assert await rejected_r.read() == b""
+                for writer in [tcp_w, unix_w, rejected_w]:
+                    writer.close()
+            finally:
+                for server in servers:
+                    server.close()
+
+        asyncio.run(run())
+        assert metrics.counters['connections_accepted{listener="local"}'] == 1
+        assert metrics.counters['connections_rejected{listener="local"}'] == 1
+
+    @pytest.mark.parametrize("transport", ["streams", "protocol"])
+    def test_unix_socket_removed(self, tmp_path: Path, transport: str) -> None:
+        path = tmp_path / "smtp.sock"
+
+        async def run() -> None:
+            async def start() -> list[asyncio.Server]:
+                servers = await start_listeners(
+                    [Listener(path=str(path))],
+                    transport,
+                    lambda listener: partial(
+                        ConnectionHandler, print_mail=lambda state: None
+                    ),
+                )
+                assert path.exists()
+                asyncio.get_running_loop().call_soon(
+                    os.kill, os.getpid(), signal.SIGTERM
+                )
+                return servers
+
+            await asyncio.wait_for(serve(start), 5)
+
+        asyncio.run(run())
+        assert not path.exists()
+
+
+class TestImports:
+    def test_no_unneeded_imports(self) -> None:
+        code = (
+            "import sys, fakesmtpd.server; "
+            "print(' '.join(sorted(sys.modules)))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        modules = set(result.stdout.split())
+        for module in [
+            "smtplib",
+            "typing_extensions",
+            "fakesmtpd.admin",
+            "fakesmtpd.protocol",
+            "cProfile",
+            "tracemalloc",
+        ]:
+            assert module not in modules
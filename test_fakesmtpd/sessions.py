@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import asyncio
+from http import HTTPStatus
+from typing import Any
+from unittest.mock import Mock
+
+import pytest
+
+from fakesmtpd.admin import AdminServer
+from fakesmtpd.sessions import SessionRegistry, add_session_routes
+
+
+def _handler(session_id: str) -> Mock:
+    handler = Mock()
+    handler.session_id = session_id
+    handler.peer = "192.0.2.1:1234"
+    return handler
+
+
+class TestSessionRegistry:
+    def test_add_remove(self) -> None:
+        sessions = SessionRegistry()
+        h1, h2 = _handler("a"), _handler("b")
+        sessions.add(h1)
+        sessions.add(h2)
+        assert len(sessions) == 2
+        assert list(sessions) == [h1, h2]
+        sessions.remove(h1)
+        sessions.remove(h1)
+        assert list(sessions) == [h2]
+
+    def test_drain(self) -> None:
+        sessions = SessionRegistry()
+        handler = _handler("a")
+        handler.shutdown.side_effect = lambda: sessions.remove(handler)
+        sessions.add(handler)
+        aborted = asyncio.run(sessions.drain(5))
+        assert aborted == 0
+        handler.shutdown.assert_called_once_with()
+        handler.abort.assert_not_called()
+
+    def test_drain__empty(self) -> None:
+        assert asyncio.run(SessionRegistry().drain(5)) == 0
+
+    def test_drain__timeout(self) -> None:
+        sessions = SessionRegistry()
+        handler = _handler("a")
+        sessions.add(handler)
+        aborted = asyncio.run(sessions.drain(0.01))
+        assert aborted == 1
+        handler.shutdown.assert_called_once_with()
+        handler.abort.assert_called_once_with()
+
+    def test_history(self) -> None:
+        sessions = SessionRegistry(history_size=2)
+        handlers = [_handler(name) for name in "abc"]
+        for handler in handlers:
+            handler.summary.return_value = {"session": handler.session_id}
+            sessions.add(handler)
+        for handler in handlers:
+            sessions.remove(handler)
+        sessions.remove(handlers[2])
+        assert list(sessions.history) == [{"session": "b"}, {"session": "c"}]
+
+
+def _summary_handler(session_id: str, **summary: Any) -> Mock:
+    handler = _handler(session_id)
+    handler.summary.return_value = {
+        "session": session_id,
+        "phase": "greeted",
+        "phase_seconds": 0.0,
+        **summary,
+    }
+    return handler
+
+
+class TestSessionRoutes:
+    @pytest.fixture
+    def sessions(self) -> SessionRegistry:
+        sessions = SessionRegistry()
+        sessions.add(_summary_handler("a", phase_seconds=1.0))
+        sessions.add(_summary_handler("b", phase="data", phase_seconds=30.0))
+        sessions.add(_summary_handler("c", phase="data", phase_seconds=5.0))
+        return sessions
+
+    def _get(
+        self,
+        sessions: SessionRegistry,
+        path: str,
+        query: dict[str, str] | None = None,
+    ) -> tuple[HTTPStatus, Any]:
+        admin = AdminServer()
+        add_session_routes(admin, sessions)
+        return asyncio.run(admin.dispatch("GET", path, query or {}))
+
+    def test_sessions(self, sessions: SessionRegistry) -> None:
+        status, body = self._get(sessions, "/sessions")
+        assert status == HTTPStatus.OK
+        assert body["count"] == 3
+        assert [s["session"] for s in body["sessions"]] == ["a", "b", "c"]
+
+    def test_sessions__sort(self, sessions: SessionRegistry) -> None:
+        status, body = self._get(
+            sessions, "/sessions", {"sort": "phase_seconds", "limit": "2"}
+        )
+        assert status == HTTPStatus.OK
+        assert body["count"] == 3
+        assert [s["session"] for s in body["sessions"]] == ["b", "c"]
+
+    def test_sessions__phase(self, sessions: SessionRegistry) -> None:
+        status, body = self._get(sessions, "/sessions", {"phase": "greeted"})
+        assert body["count"] == 1
+        assert body["sessions"][0]["session"] == "a"
+
+    @pytest.mark.parametrize(
+        "query", [{"sort": "peer"}, {"limit": "-1"}, {"limit": "many"}]
+    )
+    def test_sessions__invalid(
+        self, sessions: SessionRegistry, query: dict[str, str]
+    ) -> None:
+        status, _ = self._get(sessions, "/sessions", query)
+        assert status == HTTPStatus.BAD_REQUEST
+
+    def test_history(self, sessions: SessionRegistry) -> None:
+        for handler in sessions:
+            sessions.remove(handler)
+        status, body = self._get(sessions, "/sessions/history", {"limit": "2"})
+        assert status == HTTPStatus.OK
+        assert [s["session"] for s in body["sessions"]] == ["c", "b"]
+        status, body = self._get(sessions, "/sessions")
+        assert body == {"count": 0, "sessions": []}
@@ -0,0 +1,86 @@
+import pytest
+
+from fakesmtpd.state import Phase, State
+
+
+class TestState:
+    def test_initial(self) -> None:
+        state = State()
+        assert state.phase is Phase.CONNECTED
+        assert not state.greeted
+        assert not state.mail_allowed
+        assert not state.in_transaction
+
+    def test_no_instance_dict(self) -> None:
+        with pytest.raises(AttributeError):
+            State().foo = 1  # type: ignore[attr-defined]
+
+    def test_greet(self) -> None:
+        state = State()
+        state.greet()
+        assert state.phase is Phase.GREETED
+        assert state.greeted
+        assert state.mail_allowed
+        assert not state.rcpt_allowed
+        assert not state.data_allowed
+
+    def test_greet_again(self) -> None:
+        state = State()
+        state.greet()
+        state.start_mail("foo@example.com")
+        state.greet()
+        assert state.phase is Phase.MAIL
+
+    def test_transaction(self) -> None:
+        state = State()
+        state.greet()
+        state.start_mail("foo@example.com")
+        assert state.phase is Phase.MAIL
+        assert state.in_transaction
+        assert not state.mail_allowed
+        assert state.rcpt_allowed
+        assert not state.data_allowed
+        state.add_forward_path("bar@example.com")
+        state.add_forward_path("baz@example.com")
+        assert state.phase is Phase.RCPT
+        assert state.rcpt_allowed
+        assert state.data_allowed
+        assert state.forward_path == ["bar@example.com", "baz@example.com"]
+        state.start_data()
+        assert state.phase is Phase.DATA
+        assert not state.rcpt_allowed
+        assert not state.data_allowed
+        state.add_line("Subject: Foo\r\n")
+        state.add_line("\r\n")
+        assert state.mail_data == "Subject: Foo\r\n\r\n"
+
+    def test_clear(self) -> None:
+        state = State()
+        state.starttls_available = True
+        state.greet()
+        state.start_mail("foo@example.com")
+        state.add_forward_path("bar@example.com")
+        state.start_data()
+        state.add_line("Test\r\n")
+        state.clear()
+        assert state.phase is Phase.GREETED
+        assert state.starttls_available
+        assert state.reverse_path is None
+        assert state.forward_path is None
+        assert state.mail_data is None
+        assert state.date is None
+
+    def test_clear_not_greeted(self) -> None:
+        state = State()
+        state.clear()
+        assert state.phase is Phase.CONNECTED
+
+    def test_reset(self) -> None:
+        state = State()
+        state.starttls_available = True
+        state.greet()
+        state.start_mail("foo@example.com")
+        state.reset()
+        assert state.phase is Phase.CONNECTED
+        assert not state.starttls_available
+        assert state.reverse_path is None
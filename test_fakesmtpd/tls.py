@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import asyncio
+import socket
+import ssl
+from collections.abc import Awaitable, Callable
+from functools import partial
+from pathlib import Path
+
+import pytest
+
+from fakesmtpd.connection import ConnectionHandler
+from fakesmtpd.listeners import Listener
+from fakesmtpd.metrics import metrics
+from fakesmtpd.server import start_listeners
+from fakesmtpd.state import State
+from fakesmtpd.tls import create_server_context, streams_support_tls
+
+CERT_FILE = str(Path(__file__).parent / "localhost.pem")
+
+TRANSPORTS = [
+    pytest.param(
+        "streams",
+        marks=pytest.mark.skipif(
+            not streams_support_tls(), reason="requires Python 3.11"
+        ),
+    ),
+    "protocol",
+]
+
+
+def _client_context() -> ssl.SSLContext:
+    return ssl.create_default_context(cafile=CERT_FILE)
+
+
+class TestCreateServerContext:
+    def test_session_tickets(self) -> None:
+        context = create_server_context(CERT_FILE)
+        assert not context.options & ssl.OP_NO_TICKET
+        assert context.num_tickets > 0
+
+    def test_missing_file(self, tmp_path: Path) -> None:
+        with pytest.raises(OSError):
+            create_server_context(str(tmp_path / "missing.pem"))
+
+
+class TestTLSSessions:
+    def _run(
+        self,
+        transport: str,
+        listener: Listener,
+        client: Callable[[int], Awaitable[None]],
+    ) -> list[State]:
+        mails: list[State] = []
+        context = create_server_context(CERT_FILE)
+
+        def handler_factory(listener: Listener) -> partial[ConnectionHandler]:
+            return partial(
+                ConnectionHandler,
+                print_mail=mails.append,
+                tls_context=context,
+                implicit_tls=listener.tls,
+            )
+
+        async def run() -> None:
+            servers = await start_listeners(
+                [listener], transport, handler_factory
+            )
+            try:
+                port = servers[0].sockets[0].getsockname()[1]
+                await asyncio.wait_for(client(port), 5)
+            finally:
+                for server in servers:
+                    server.close()
+
+        asyncio.run(run())
+        return mails
+
+    @pytest.mark.parametrize("transport", TRANSPORTS)
+    def test_starttls(self, transport: str) -> None:
+        async def client(port: int) -> None:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            assert (await reader.readline()).startswith(b"220 ")
+            writer.write(b"EHLO client.example.com\r\n")
+            assert (await reader.readline()).startswith(b"250-")
+            assert await reader.readline() == b"250-PIPELINING\r\n"
+            assert await reader.readline() == b"250 STARTTLS\r\n"
+            writer.write(b"STARTTLS\r\n")
+            assert await reader.readline() == b"220 Ready to start TLS\r\n"
+            await writer.start_tls(
+                _client_context(), server_hostname="localhost"
+            )
+            for line, reply in [
+                (b"MAIL FROM:<foo@example.com>", b"503 "),
+                (b"EHLO client.example.com", b"250 "),
+                (b"MAIL FROM:<foo@example.com>", b"250 "),
+                (b"RCPT TO:<bar@example.com>", b"250 "),
+                (b"DATA", b"354 "),
+                (b"Subject: Foo\r\n\r\nText\r\n.", b"250 "),
+                (b"QUIT", b"221 "),
+            ]:
+                writer.write(line + b"\r\n")
+                received = await reader.readline()
+                while received[3:4] == b"-":
+                    received = await reader.readline()
+                assert received.startswith(reply)
+            writer.close()
+
+        if not streams_support_tls():
+            pytest.skip("client requires Python 3.11")
+        mails = self._run(
+            transport, Listener(host="127.0.0.1", port=0), client
+        )
+        assert len(mails) == 1
+        assert metrics.summaries['tls_handshake_seconds{mode="starttls"}']
+
+    @pytest.mark.parametrize("transport", TRANSPORTS)
+    def test_implicit_tls_with_resumption(self, transport: str) -> None:
+        def connect(port: int) -> None:
+            context = _client_context()
+            session = None
+            for _ in range(2):
+                sock = socket.create_connection(("127.0.0.1", port))
+                with context.wrap_socket(
+                    sock, server_hostname="localhost", session=session
+                ) as tls_sock:
+                    assert tls_sock.recv(1024).startswith(b"220 ")
+                    tls_sock.sendall(b"QUIT\r\n")
+                    assert tls_sock.recv(1024).startswith(b"221 ")
+                    session = tls_sock.session
+
+        async def client(port: int) -> None:
+            await asyncio.to_thread(connect, port)
+
+        self._run(
+            transport,
+            Listener(host="127.0.0.1", port=0, tls=True),
+            client,
+        )
+        assert metrics.counters == {
+            'tls_handshakes{mode="implicit",resumed="no"}': 1,
+            'tls_handshakes{mode="implicit",resumed="yes"}': 1,
+        }
+
+    @pytest.mark.parametrize("transport", TRANSPORTS)
+    def test_pipelined_after_starttls(self, transport: str) -> None:
+        async def client(port: int) -> None:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            await reader.readline()
+            writer.write(b"EHLO client.example.com\r\n")
+            await reader.readline()
+            await reader.readline()
+            await reader.readline()
+            writer.write(b"STARTTLS\r\nMAIL FROM:<foo@example.com>\r\n")
+            assert await reader.readline() == b"220 Ready to start TLS\r\n"
+            assert await reader.read() == b""
+            writer.close()
+
+        self._run(transport, Listener(host="127.0.0.1", port=0), client)
+        assert not metrics.counters
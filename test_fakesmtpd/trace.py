@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from fakesmtpd.trace import (
+    INBOUND,
+    OUTBOUND,
+    TRACE_SUFFIX,
+    TraceWriter,
+    read_trace,
+)
+
+
+class TestTrace:
+    def test_round_trip(self, tmp_path: Path) -> None:
+        writer = TraceWriter.for_session(tmp_path, "abc-1")
+        writer.record_outbound(b"220 Ready\r\n")
+        writer.record_inbound(b"QUIT\r\n")
+        writer.close()
+        path = tmp_path / f"abc-1{TRACE_SUFFIX}"
+        started, records = read_trace(path)
+        assert started > 0
+        assert [(r.direction, r.data) for r in records] == [
+            (OUTBOUND, b"220 Ready\r\n"),
+            (INBOUND, b"QUIT\r\n"),
+        ]
+        assert 0 <= records[0].offset <= records[1].offset
+
+    def test_empty_session(self, tmp_path: Path) -> None:
+        TraceWriter(tmp_path / "empty.trace").close()
+        _, records = read_trace(tmp_path / "empty.trace")
+        assert records == []
+
+    def test_invalid_magic(self, tmp_path: Path) -> None:
+        path = tmp_path / "invalid.trace"
+        path.write_bytes(b"INVALID!" + b"\0" * 8)
+        with pytest.raises(ValueError):
+            read_trace(path)
+
+    def test_truncated(self, tmp_path: Path) -> None:
+        path = tmp_path / "truncated.trace"
+        writer = TraceWriter(path)
+        writer.record_inbound(b"QUIT\r\n")
+        writer.close()
+        path.write_bytes(path.read_bytes()[:-2])
+        with pytest.raises(ValueError, match="truncated.trace: truncated"):
+            read_trace(path)
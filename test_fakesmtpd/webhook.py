@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from fakesmtpd.bodystore import BodyStore
+from fakesmtpd.mbox import BODY_HEADER, write_mbox_mail
+from fakesmtpd.metrics import metrics
+from fakesmtpd.state import State
+from fakesmtpd.webhook import WebhookNotifier, mail_summary
+from test_fakesmtpd.helpers import make_state
+
+
+class _HookServer:
+    """HTTP server that records the JSON bodies of POST requests."""
+
+    def __init__(self, statuses: list[int] | None = None) -> None:
+        self.statuses = list(statuses or [])
+        self.requests: list[dict[str, Any]] = []
+        self.connections = 0
+        self.close_after_response = False
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readuntil(b"\r\n")
+                assert request_line.startswith(b"POST /hook HTTP/1.1")
+                length = 0
+                while (line := await reader.readuntil(b"\r\n")) != b"\r\n":
+                    name, _, value = line.decode().partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                body = await reader.readexactly(length)
+                status = self.statuses.pop(0) if self.statuses else 200
+                if status < 300:
+                    self.requests.append(json.loads(body))
+                writer.write(
+                    f"HTTP/1.1 {status} Status\r\n"
+                    "Content-Length: 2\r\n\r\nOK".encode()
+                )
+                await writer.drain()
+                if self.close_after_response:
+                    break
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    @property
+    def messages(self) -> list[dict[str, Any]]:
+        return [m for request in self.requests for m in request["messages"]]
+
+
+@asynccontextmanager
+async def _serving(hook: _HookServer) -> AsyncIterator[str]:
+    server = await asyncio.start_server(hook.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{port}/hook"
+    finally:
+        server.close()
+
+
+async def _notify(notifier: WebhookNotifier, state: State) -> None:
+    result = notifier(state)
+    if result is not None:
+        await result
+
+
+def _run(
+    hook: _HookServer,
+    mails: int,
+    **kwargs: Any,
+) -> WebhookNotifier:
+    async def run() -> WebhookNotifier:
+        async with _serving(hook) as url:
+            notifier = WebhookNotifier(url, backoff=0.01, **kwargs)
+            for i in range(mails):
+                await _notify(notifier, make_state(f"s{i}@example.com"))
+            await notifier.aclose()
+            return notifier
+
+    return asyncio.run(run())
+
+
+class TestMailSummary:
+    def test_summary(self) -> None:
+        state = make_state(
+            mail_data=(
+                "Subject: Foo\r\nTo: receiver@example.com\r\n\r\nText\r\n"
+            )
+        )
+        assert mail_summary(state) == {
+            "date": "2017-06-04T14:34:15",
+            "sender": "sender@example.com",
+            "recipients": ["receiver@example.com"],
+            "size": 48,
+            "headers": [["Subject", "Foo"], ["To", "receiver@example.com"]],
+            "body": None,
+        }
+
+    def test_body_hash(self, tmp_path: Path) -> None:
+        state = make_state()
+        summary = mail_summary(state, body_hash=True)
+        with open(tmp_path / "out.mbox", "w") as f:
+            write_mbox_mail(f, state, body_store=BodyStore(str(tmp_path)))
+        mbox = (tmp_path / "out.mbox").read_text()
+        assert f"{BODY_HEADER}: {summary['body']}\n" in mbox
+
+    def test_body_hash__no_body(self) -> None:
+        state = make_state()
+        state.mail_data = "Subject: Foo\r\n"
+        assert mail_summary(state, body_hash=True)["body"] is None
+
+
+class TestWebhookNotifier:
+    @pytest.mark.parametrize(
+        "url", ["https://example.com/", "unix:/tmp/hook", "http:///hook"]
+    )
+    def test_invalid_url(self, url: str) -> None:
+        with pytest.raises(ValueError):
+            WebhookNotifier(url)
+
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            {"max_batch": 0},
+            {"max_pending": 0},
+            {"retries": -1},
+            {"backoff": -0.1},
+            {"timeout": 0},
+        ],
+    )
+    def test_invalid_arguments(self, kwargs: dict[str, Any]) -> None:
+        with pytest.raises(ValueError):
+            WebhookNotifier("http://127.0.0.1/hook", **kwargs)
+
+    def test_no_retries(self) -> None:
+        hook = _HookServer([500])
+        _run(hook, 1, retries=0)
+        counters = metrics.snapshot()["counters"]
+        assert "webhook_retries" not in counters
+        assert counters["webhook_dropped"] == 1
+
+    def test_batch(self) -> None:
+        hook = _HookServer()
+        _run(hook, 3)
+        assert len(hook.requests) == 1
+        senders = [m["sender"] for m in hook.messages]
+        assert senders == [
+            "s0@example.com",
+            "s1@example.com",
+            "s2@example.com",
+        ]
+        counters = metrics.snapshot()["counters"]
+        assert counters["webhook_notifications"] == 3
+
+    def test_max_batch(self) -> None:
+        hook = _HookServer()
+        _run(hook, 5, max_batch=2)
+        assert [len(r["messages"]) for r in hook.requests] == [2, 2, 1]
+        assert hook.connections == 1
+
+    def test_keep_alive(self) -> None:
+        hook = _HookServer()
+
+        async def run() -> None:
+            async with _serving(hook) as url:
+                notifier = WebhookNotifier(url, batch_window=0)
+                await _notify(notifier, make_state())
+                await asyncio.sleep(0.05)
+                await _notify(notifier, make_state())
+                await notifier.aclose()
+
+        asyncio.run(run())
+        assert len(hook.requests) == 2
+        assert hook.connections == 1
+
+    def test_reconnect(self) -> None:
+        hook = _HookServer()
+        hook.close_after_response = True
+
+        async def run() -> None:
+            async with _serving(hook) as url:
+                notifier = WebhookNotifier(url, batch_window=0)
+                await _notify(notifier, make_state())
+                await asyncio.sleep(0.05)
+                await _notify(notifier, make_state())
+                await notifier.aclose()
+
+        asyncio.run(run())
+        assert len(hook.requests) == 2
+        assert hook.connections == 2
+        assert "webhook_retries" not in metrics.snapshot()["counters"]
+
+    def test_retry(self) -> None:
+        hook = _HookServer([503, 429])
+        _run(hook, 2)
+        assert len(hook.messages) == 2
+        counters = metrics.snapshot()["counters"]
+        assert counters["webhook_retries"] == 2
+        assert "webhook_errors" not in counters
+
+    def test_retries_exhausted(self) -> None:
+        hook = _HookServer([500, 500, 500])
+        _run(hook, 2, retries=2)
+        assert hook.messages == []
+        counters = metrics.snapshot()["counters"]
+        assert counters["webhook_errors"] == 1
+        assert counters["webhook_dropped"] == 2
+
+    def test_client_error(self) -> None:
+        hook = _HookServer([400])
+        _run(hook, 1)
+        assert hook.messages == []
+        counters = metrics.snapshot()["counters"]
+        assert "webhook_retries" not in counters
+        assert counters["webhook_dropped"] == 1
+
+    def test_connection_refused(self) -> None:
+        async def run() -> None:
+            async with _serving(_HookServer()) as url:
+                pass
+            notifier = WebhookNotifier(url, retries=1, backoff=0.01)
+            await _notify(notifier, make_state())
+            await notifier.aclose()
+
+        asyncio.run(run())
+        counters = metrics.snapshot()["counters"]
+        assert counters["webhook_retries"] == 1
+        assert counters["webhook_dropped"] == 1
+
+    def test_unix_socket(self, tmp_path: Path) -> None:
+        hook = _HookServer()
+        path = str(tmp_path / "hook.sock")
+
+        async def run() -> None:
+            server = await asyncio.start_unix_server(hook.handle, path)
+            try:
+                notifier = WebhookNotifier(
+                    "http://orchestrator/hook", unix_socket=path
+                )
+                await _notify(notifier, make_state())
+                await notifier.aclose()
+            finally:
+                server.close()
+
+        asyncio.run(run())
+        assert len(hook.messages) == 1
+
+    def test_max_pending(self) -> None:
+        hook = _HookServer()
+        _run(hook, 3, max_pending=2)
+        assert len(hook.messages) == 2
+        assert metrics.snapshot()["counters"]["webhook_dropped"] == 1
+
+    def test_close(self) -> None:
+        notifier = WebhookNotifier("http://127.0.0.1:9/hook")
+
+        async def run() -> None:
+            await _notify(notifier, make_state())
+            assert len(notifier) == 1
+            task = notifier._task
+            assert task is not None
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        asyncio.run(run())
+        notifier.close()
+        assert len(notifier) == 0
+        assert metrics.snapshot()["counters"]["webhook_dropped"] == 1
+
+    def test_close__new_mail(self) -> None:
+        notifier = WebhookNotifier("http://127.0.0.1:9/hook")
+        notifier.close()
+        assert notifier(make_state()) is None
+        assert len(notifier) == 0
+        assert metrics.snapshot()["counters"]["webhook_dropped"] == 1
+
+    def test_close__while_summarizing(self) -> None:
+        notifier = WebhookNotifier("http://127.0.0.1:9/hook")
+
+        async def run() -> None:
+            result = notifier(make_state())
+            assert result is not None
+            notifier.close()
+            await result
+
+        asyncio.run(run())
+        assert len(notifier) == 0
+        assert notifier._task is None
+        assert metrics.snapshot()["counters"]["webhook_dropped"] == 1